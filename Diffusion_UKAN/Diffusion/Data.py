@@ -0,0 +1,157 @@
+"""
+Packed image datasets.
+
+``pack_folder`` turns a folder of equally sized images into one contiguous
+(N, H, W, 3) uint8 ``.npy`` file plus a ``.json`` index with the file names,
+so training reads a memory map instead of decoding a PNG per sample:
+
+    python tools/pack_dataset.py --dataset cvc    # data/cvc/images_64.npy + .json
+
+``PackedDataset`` serves uint8 (3, H, W) tensors from that file. The random
+flips and the [-1, 1] normalisation of the PNG pipeline are applied per batch
+on the device by ``augment_batch``. For the small ``images_64`` sets,
+``load_images`` puts the whole dataset on the device and ``DeviceLoader``
+draws augmented batches from it without a DataLoader or host copies.
+"""
+import json
+import os
+
+import numpy as np
+import torch
+from skimage import io
+from torch.utils.data import Dataset
+
+
+DATASET_DIRS = {
+    'cvc': 'data/cvc/images_64/',
+    'glas': 'data/glas/images_64/',
+    'glas_resize': 'data/glas/images_64_resize/',
+    'busi': 'data/busi/images_64/',
+}
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def dataset_dir(dataset, img_size=64):
+    """The image folder of ``dataset`` at ``img_size``, e.g. ``data/cvc/images_128/``."""
+    if dataset not in DATASET_DIRS:
+        raise ValueError('unknown dataset %s, choose from %s' % (dataset, ', '.join(DATASET_DIRS)))
+    return DATASET_DIRS[dataset].replace('images_64', 'images_%d' % img_size)
+
+
+def packed_path(folder):
+    """``data/cvc/images_64/`` -> ``data/cvc/images_64.npy``"""
+    return os.path.normpath(folder) + '.npy'
+
+
+def read_rgb(path):
+    image = io.imread(path)
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    return image[:, :, :3]
+
+
+def pack_folder(folder, path=None):
+    """Write the images of ``folder`` to ``path`` (.npy) and the index next to it (.json)."""
+    path = path or packed_path(folder)
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMG_EXTENSIONS))
+    if not files:
+        raise ValueError('no images in %s' % folder)
+    first = read_rgb(os.path.join(folder, files[0]))
+    images = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(len(files),) + first.shape)
+    for i, f in enumerate(files):
+        image = first if i == 0 else read_rgb(os.path.join(folder, f))
+        if image.shape != first.shape:
+            raise ValueError('%s is %s, expected %s; resize the folder first' % (f, image.shape, first.shape))
+        images[i] = image
+    images.flush()
+    with open(os.path.splitext(path)[0] + '.json', 'w') as fp:
+        json.dump({'source': os.path.normpath(folder), 'shape': list(images.shape), 'dtype': 'uint8',
+                   'files': files}, fp, indent=1)
+    return path
+
+
+class PackedDataset(Dataset):
+    """uint8 (3, H, W) images of a packed .npy, with the (image, label) layout of UnlabeledDataset."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.splitext(path)[0] + '.json') as fp:
+            self.index = json.load(fp)
+        self.images = None  # opened lazily, so every DataLoader worker maps the file itself
+
+    def __len__(self):
+        return self.index['shape'][0]
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self.images = np.load(self.path, mmap_mode='r')
+        image = torch.from_numpy(np.ascontiguousarray(self.images[idx])).permute(2, 0, 1)
+        return image, torch.Tensor([0])
+
+
+def load_packed(path, device):
+    """The whole packed dataset as one uint8 (N, 3, H, W) tensor on ``device``."""
+    images = torch.from_numpy(np.load(path))
+    return images.permute(0, 3, 1, 2).contiguous().to(device)
+
+
+def load_images(folder, device):
+    """
+    A dataset folder as one uint8 (N, 3, H, W) tensor on ``device``, from its
+    packed .npy when there is one, otherwise by decoding the images.
+    """
+    if os.path.exists(packed_path(folder)):
+        return load_packed(packed_path(folder), device)
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMG_EXTENSIONS))
+    images = np.stack([read_rgb(os.path.join(folder, f)) for f in files])
+    return torch.from_numpy(images).permute(0, 3, 1, 2).contiguous().to(device)
+
+
+class DeviceLoader:
+    """
+    Shuffled, augmented batches of a device-resident uint8 dataset, yielded
+    as (images, None) like the DataLoader's (images, labels).
+
+    Every epoch draws one permutation from a generator seeded with
+    ``seed + epoch`` on the device, so all ranks agree on it and take disjoint
+    strided shards, like DistributedSampler with drop_last. The flips use a
+    second generator that differs per rank. Incomplete batches are dropped.
+    """
+
+    def __init__(self, images, batch_size, rank=0, world_size=1, seed=0):
+        self.images = images
+        self.batch_size = batch_size
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self.generator = torch.Generator(device=images.device)
+        self.flip_generator = torch.Generator(device=images.device)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.images.size(0) // self.world_size // self.batch_size
+
+    def __iter__(self):
+        self.generator.manual_seed(self.seed + self.epoch)
+        self.flip_generator.manual_seed(hash((self.seed, self.epoch, self.rank)))
+        perm = torch.randperm(self.images.size(0), device=self.images.device, generator=self.generator)
+        perm = perm[self.rank:self.images.size(0) // self.world_size * self.world_size:self.world_size]
+        for b in range(len(self)):
+            idx = perm[b * self.batch_size:(b + 1) * self.batch_size]
+            yield augment_batch(self.images[idx], self.flip_generator), None
+
+
+def random_flips(x, generator=None):
+    """Independent horizontal and vertical flips with p=0.5 per image of a (B, C, H, W) batch."""
+    flip = torch.rand(2, x.size(0), 1, 1, 1, device=x.device, generator=generator) < 0.5
+    x = torch.where(flip[0], x.flip(3), x)
+    return torch.where(flip[1], x.flip(2), x)
+
+
+def augment_batch(images, generator=None):
+    """uint8 batch -> flipped float batch in [-1, 1], as ToTensor + flips + Normalize(0.5, 0.5)."""
+    x = random_flips(images, generator)
+    return x.float().div_(255).sub_(0.5).div_(0.5)
@@ -5,6 +5,8 @@ import torch.nn.functional as F
 import numpy as np
 from tqdm import tqdm
 
+from Diffusion.Schedules import make_betas, training_target, predict_eps, predict_x0, loss_weight, step_schedule
+
 
 def extract(v, t, x_shape):
     """
@@ -17,14 +19,23 @@ def extract(v, t, x_shape):
 
 
 class GaussianDiffusionTrainer(nn.Module):
-    def __init__(self, model, beta_1, beta_T, T):
+    def __init__(self, model, beta_1, beta_T, T, timestep_sampler=None,
+                 schedule='linear', parameterization='eps', loss_weighting='none', snr_gamma=5.):
         super().__init__()
 
         self.model = model
         self.T = T
+        # see Diffusion.Schedules; the defaults are the original DDPM objective
+        self.parameterization = parameterization
+        self.loss_weighting = loss_weighting
+        self.snr_gamma = snr_gamma
+        # optional torch.Generator for t and noise, e.g. one per DDP rank
+        self.generator = None
+        # optional Diffusion.Timesteps sampler; t ~ U[0, T) without one
+        self.timestep_sampler = timestep_sampler
 
         self.register_buffer(
-            'betas', torch.linspace(beta_1, beta_T, T).double())
+            'betas', make_betas(schedule, T, beta_1, beta_T))
         alphas = 1. - self.betas
         alphas_bar = torch.cumprod(alphas, dim=0)
 
@@ -33,32 +44,51 @@ class GaussianDiffusionTrainer(nn.Module):
             'sqrt_alphas_bar', torch.sqrt(alphas_bar))
         self.register_buffer(
             'sqrt_one_minus_alphas_bar', torch.sqrt(1. - alphas_bar))
+        self.register_buffer(
+            'snr', alphas_bar / (1. - alphas_bar))
 
     def forward(self, x_0):
         """
         Algorithm 1.
         """
-        t = torch.randint(self.T, size=(x_0.shape[0], ), device=x_0.device)
-        noise = torch.randn_like(x_0)
-        x_t = (
-            extract(self.sqrt_alphas_bar, t, x_0.shape) * x_0 +
-            extract(self.sqrt_one_minus_alphas_bar, t, x_0.shape) * noise)
-        loss = F.mse_loss(self.model(x_t, t), noise, reduction='none')
+        if self.timestep_sampler is None:
+            t = torch.randint(self.T, size=(x_0.shape[0], ), device=x_0.device, generator=self.generator)
+        else:
+            t, weights = self.timestep_sampler.sample(x_0.shape[0], x_0.device, self.generator)
+        noise = torch.randn(x_0.shape, dtype=x_0.dtype, device=x_0.device, generator=self.generator)
+        sqrt_alphas_bar = extract(self.sqrt_alphas_bar, t, x_0.shape)
+        sqrt_one_minus_alphas_bar = extract(self.sqrt_one_minus_alphas_bar, t, x_0.shape)
+        x_t = sqrt_alphas_bar * x_0 + sqrt_one_minus_alphas_bar * noise
+        target = training_target(self.parameterization, x_0, noise, sqrt_alphas_bar, sqrt_one_minus_alphas_bar)
+        loss = F.mse_loss(self.model(x_t, t), target, reduction='none')
+        if self.loss_weighting != 'none':
+            snr_weights = loss_weight(self.loss_weighting, self.parameterization, extract(self.snr, t, x_0.shape),
+                                      self.snr_gamma)
+            loss = loss * snr_weights
+        if self.timestep_sampler is not None:
+            self.timestep_sampler.update(t, loss.detach().flatten(1).mean(dim=1))
+            # importance weights keep the expected loss equal to the uniform objective
+            loss = loss * weights.view([-1] + [1] * (loss.dim() - 1)).to(loss.dtype)
         return loss
 
 
 class GaussianDiffusionSampler(nn.Module):
-    def __init__(self, model, beta_1, beta_T, T):
+    def __init__(self, model, beta_1, beta_T, T, schedule='linear', parameterization='eps'):
         super().__init__()
 
         self.model = model
         self.T = T
+        self.parameterization = parameterization
 
-        self.register_buffer('betas', torch.linspace(beta_1, beta_T, T).double())
+        self.register_buffer('betas', make_betas(schedule, T, beta_1, beta_T))
         alphas = 1. - self.betas
         alphas_bar = torch.cumprod(alphas, dim=0)
         alphas_bar_prev = F.pad(alphas_bar, [1, 0], value=1)[:T]
 
+        # to turn x0 / v predictions into eps
+        self.register_buffer('sqrt_alphas_bar', torch.sqrt(alphas_bar))
+        self.register_buffer('sqrt_one_minus_alphas_bar', torch.sqrt(1. - alphas_bar))
+
         self.register_buffer('coeff1', torch.sqrt(1. / alphas))
         self.register_buffer('coeff2', self.coeff1 * (1. - alphas) / torch.sqrt(1. - alphas_bar))
 
@@ -77,6 +107,10 @@ class GaussianDiffusionSampler(nn.Module):
         var = extract(var, t, x_t.shape)
 
         eps = self.model(x_t, t)
+        if self.parameterization != 'eps':
+            eps = predict_eps(self.parameterization, eps, x_t,
+                              extract(self.sqrt_alphas_bar, t, x_t.shape),
+                              extract(self.sqrt_one_minus_alphas_bar, t, x_t.shape))
         xt_prev_mean = self.predict_xt_prev_mean_from_eps(x_t, t, eps=eps)
 
         return xt_prev_mean, var
@@ -98,6 +132,53 @@ class GaussianDiffusionSampler(nn.Module):
             x_t = mean + torch.sqrt(var) * noise
             assert torch.isnan(x_t).int().sum() == 0, "nan in tensor."
         x_0 = x_t
-        return torch.clip(x_0, -1, 1)   
+        return torch.clip(x_0, -1, 1)
 
 
+def ddim_step(x_t, x_0, alphas_bar_t, alphas_bar_prev, sigma=0., noise=None):
+    """
+    One DDIM update from x_t to the earlier timestep with ``alphas_bar_prev``,
+    given the predicted clean image; deterministic for ``sigma == 0``.
+    """
+    eps = (x_t - alphas_bar_t ** 0.5 * x_0) / (1. - alphas_bar_t) ** 0.5
+    x_prev = alphas_bar_prev ** 0.5 * x_0 + (1. - alphas_bar_prev - sigma ** 2) ** 0.5 * eps
+    if noise is not None:
+        x_prev = x_prev + sigma * noise
+    return x_prev
+
+
+class DDIMSampler(nn.Module):
+    """
+    DDIM sampling on ``steps`` timesteps of ``step_schedule(T, steps)``.
+    ``eta`` scales the noise of every step, from deterministic (0) to
+    DDPM-like (1). Also samples the students of Diffusion.Distill, which are
+    trained on the same timesteps.
+    """
+    def __init__(self, model, beta_1, beta_T, T, steps=50, eta=0., schedule='linear', parameterization='eps',
+                 clip_denoised=True):
+        super().__init__()
+
+        self.model = model
+        self.T = T
+        self.steps = steps
+        self.eta = eta
+        self.parameterization = parameterization
+        self.clip_denoised = clip_denoised
+
+        alphas_bar = torch.cumprod(1. - make_betas(schedule, T, beta_1, beta_T), dim=0)
+        self.register_buffer('timesteps', step_schedule(T, steps))
+        # alphas_bar of the timesteps, preceded by 1 for the clean image
+        self.alphas_bar = [1.] + alphas_bar[self.timesteps].tolist()
+
+    def forward(self, x_T):
+        x_t = x_T
+        for i in reversed(range(1, self.steps + 1)):
+            t = x_t.new_ones([x_T.shape[0], ], dtype=torch.long) * self.timesteps[i - 1]
+            a_t, a_prev = self.alphas_bar[i], self.alphas_bar[i - 1]
+            x_0 = predict_x0(self.parameterization, self.model(x_t, t), x_t, a_t ** 0.5, (1. - a_t) ** 0.5)
+            if self.clip_denoised:
+                x_0 = torch.clip(x_0, -1, 1)
+            sigma = self.eta * ((1. - a_prev) / (1. - a_t) * (1. - a_t / a_prev)) ** 0.5
+            noise = torch.randn_like(x_t) if sigma > 0 else None
+            x_t = ddim_step(x_t, x_0, a_t, a_prev, sigma, noise)
+        return torch.clip(x_t, -1, 1)
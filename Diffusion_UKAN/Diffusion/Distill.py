@@ -0,0 +1,191 @@
+"""
+Progressive distillation (Salimans & Ho 2022) of a trained diffusion model
+into few-step DDIM samplers.
+
+Every round trains a student, initialised from its teacher, to match two
+deterministic DDIM steps of the teacher with one step of its own. The
+student's sampler therefore runs on half the timesteps of the teacher's. The
+first teacher is the trained checkpoint on ``distill_start_steps`` timesteps
+(all T of them by default), and rounds continue while the student has at
+least ``distill_final_steps`` steps:
+
+    1000 -> 500 -> 250 -> 125 -> 62 -> 31 -> 15 -> 7
+
+Each student is the model class of the teacher, saved as a plain state_dict
+(``distill_<steps>.pt`` in the weight folder). It loads like any other
+checkpoint and is sampled with ``DDIMSampler(..., steps=<steps>)``.
+Timesteps come from ``step_schedule``: the grid for N steps is the even half
+of the grid for 2N steps. When a round halves an odd count, the teacher is
+queried on the 2N-step grid instead of its own, so it is off by a fraction of
+a step.
+
+Students are trained on their clean-image prediction with the "truncated SNR"
+weight max(SNR, 1). The parameterisation stays that of the teacher. v works
+best, because recovering x0 from an eps output is ill-conditioned at high
+noise.
+"""
+import os
+import copy
+import json
+from typing import Dict
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from tqdm import tqdm
+
+from Diffusion.Diffusion import ddim_step, extract
+from Diffusion.Schedules import make_betas, predict_x0, step_schedule
+from Diffusion.Train import build_dataloader, build_sampler, load_model, prepare_batch
+from Diffusion.Metrics import GenerativeMetrics, InceptionScore, evaluate_stream, sample_batches
+from Diffusion.utils import DeviceLossMeter
+
+
+def distill_rounds(start_steps, final_steps):
+    """Student step counts of the rounds, e.g. (1000, 4) -> [500, 250, 125, 62, 31, 15, 7]."""
+    rounds = []
+    steps = start_steps // 2
+    while steps >= max(final_steps, 1):
+        rounds.append(steps)
+        steps //= 2
+    return rounds
+
+
+def distilled_weight(steps):
+    return 'distill_{}.pt'.format(steps)
+
+
+class ProgressiveDistiller(nn.Module):
+    """Per-pixel loss of ``student`` (``steps`` steps) against two DDIM steps of ``teacher`` (2 * ``steps`` steps)."""
+
+    def __init__(self, teacher, student, beta_1, beta_T, T, steps, schedule='linear', parameterization='eps'):
+        super().__init__()
+
+        self.teacher = teacher
+        self.student = student
+        self.steps = steps
+        self.parameterization = parameterization
+        # optional torch.Generator for timesteps and noise
+        self.generator = None
+        for p in self.teacher.parameters():
+            p.requires_grad_(False)
+
+        alphas_bar = torch.cumprod(1. - make_betas(schedule, T, beta_1, beta_T), dim=0)
+        # position 0 is the clean image (alphas_bar = 1), position i > 0 is timestep i - 1
+        self.register_buffer('alphas_bar', F.pad(alphas_bar, [1, 0], value=1))
+        # the teacher's 2 * steps grid; the student's grid is every second entry
+        self.register_buffer('grid', F.pad(step_schedule(T, 2 * steps) + 1, [1, 0]))
+
+    def denoise(self, model, x_t, pos):
+        alphas_bar = extract(self.alphas_bar, pos, x_t.shape)
+        out = model(x_t, pos - 1)
+        return predict_x0(self.parameterization, out, x_t, alphas_bar.sqrt(), (1. - alphas_bar).sqrt())
+
+    def forward(self, x_0):
+        k = torch.randint(1, self.steps + 1, size=(x_0.shape[0], ), device=x_0.device, generator=self.generator)
+        pos, pos_mid, pos_prev = self.grid[2 * k], self.grid[2 * k - 1], self.grid[2 * k - 2]
+        noise = torch.randn(x_0.shape, dtype=x_0.dtype, device=x_0.device, generator=self.generator)
+        alphas_bar = extract(self.alphas_bar, pos, x_0.shape)
+        x_t = alphas_bar.sqrt() * x_0 + (1. - alphas_bar).sqrt() * noise
+
+        with torch.no_grad():
+            teacher_x0 = self.denoise(self.teacher, x_t, pos)
+            alphas_bar_mid = extract(self.alphas_bar, pos_mid, x_0.shape)
+            x_mid = ddim_step(x_t, teacher_x0, alphas_bar, alphas_bar_mid)
+            teacher_x0 = self.denoise(self.teacher, x_mid, pos_mid)
+            alphas_bar_prev = extract(self.alphas_bar, pos_prev, x_0.shape)
+            x_prev = ddim_step(x_mid, teacher_x0, alphas_bar_mid, alphas_bar_prev)
+            # the clean image from which one DDIM step of x_t lands on x_prev
+            ratio = ((1. - alphas_bar_prev) / (1. - alphas_bar)).sqrt()
+            target = (x_prev - ratio * x_t) / (alphas_bar_prev.sqrt() - ratio * alphas_bar.sqrt())
+
+        student_x0 = self.denoise(self.student, x_t, pos)
+        weights = (alphas_bar / (1. - alphas_bar)).clamp(min=1.)
+        return weights * F.mse_loss(student_x0, target, reduction='none')
+
+
+def distill(modelConfig: Dict):
+    """Run every round from modelConfig["test_load_weight"], saving each student to save_weight_dir."""
+    device = torch.device(modelConfig["device"])
+    data_format = modelConfig.get("data_format", "png")
+    dataloader, _ = build_dataloader(modelConfig, device)
+    teacher = load_model(modelConfig)
+    log_file = open(os.path.join(modelConfig["save_weight_dir"], "distill.csv"), "w")
+    log_file.write("steps,iteration,loss\n")
+
+    for steps in distill_rounds(modelConfig["distill_start_steps"], modelConfig["distill_final_steps"]):
+        student = copy.deepcopy(teacher).train()
+        for p in student.parameters():
+            p.requires_grad_(True)
+        distiller = ProgressiveDistiller(
+            teacher, student, modelConfig["beta_1"], modelConfig["beta_T"], modelConfig["T"], steps,
+            schedule=modelConfig.get("schedule", "linear"), parameterization=modelConfig.get("parameterization", "eps")).to(device)
+        optimizer = torch.optim.Adam(student.parameters(), lr=modelConfig["lr"])
+        # the learning rate decays linearly to 0 within every round
+        scheduler = torch.optim.lr_scheduler.LambdaLR(
+            optimizer, lambda i: 1. - i / modelConfig["distill_iters"])
+        loss_meter = DeviceLossMeter(modelConfig.get("log_every", 20))
+
+        iteration = 0
+        with tqdm(total=modelConfig["distill_iters"], dynamic_ncols=True) as progress:
+            while iteration < modelConfig["distill_iters"]:
+                if data_format == "device":
+                    dataloader.set_epoch(iteration)
+                for images, labels in dataloader:
+                    x_0 = prepare_batch(images, device, data_format)
+                    loss = distiller(x_0).mean()
+                    optimizer.zero_grad()
+                    loss.backward()
+                    torch.nn.utils.clip_grad_norm_(student.parameters(), modelConfig["grad_clip"])
+                    optimizer.step()
+                    scheduler.step()
+                    iteration += 1
+                    progress.update(1)
+                    avg_loss = loss_meter.update(loss)
+                    if avg_loss is not None:
+                        progress.set_postfix(ordered_dict={"steps": steps, "loss: ": avg_loss})
+                        log_file.write("{},{},{:.6f}\n".format(steps, iteration, avg_loss))
+                        log_file.flush()
+                    if iteration == modelConfig["distill_iters"]:
+                        break
+
+        torch.save(student.state_dict(), os.path.join(modelConfig["save_weight_dir"], distilled_weight(steps)))
+        print("distilled {} steps".format(steps))
+        teacher = student.eval()
+    log_file.close()
+
+
+def evaluate_steps(modelConfig: Dict):
+    """
+    FID/KID/IS of every distilled student against its number of sampling
+    steps, next to plain DDIM with the original checkpoint at the same number
+    of steps. Written to distill_metrics.json in the experiment folder.
+    """
+    device = torch.device(modelConfig["device"])
+    metrics = [
+        GenerativeMetrics(modelConfig["dataset"], device, weights=modelConfig.get("fid_weights"), img_size=modelConfig["img_size"]),
+        InceptionScore(device, weights=modelConfig.get("is_weights")),
+    ]
+    rows = []
+    for steps in distill_rounds(modelConfig["distill_start_steps"], modelConfig["distill_final_steps"]):
+        runs = [("distilled", distilled_weight(steps))]
+        if modelConfig.get("distill_eval_baseline", True):
+            runs.append(("ddim", modelConfig["test_load_weight"]))
+        for name, weight in runs:
+            if not os.path.exists(os.path.join(modelConfig["save_weight_dir"], weight)):
+                continue
+            config = dict(modelConfig, sampler="ddim", sample_steps=steps, ddim_eta=0., test_load_weight=weight)
+            for metric in metrics:
+                metric.reset()
+            with torch.no_grad():
+                sampler = build_sampler(load_model(config), config).to(device)
+                batches = sample_batches(sampler, modelConfig["num_eval_samples"], modelConfig["batch_size"],
+                                         modelConfig["img_size"], device)
+                scores = evaluate_stream(batches, metrics, device)
+            rows.append(dict(scores, sampler=name, steps=steps, weight=weight))
+            print('%-9s %4d steps  FID %.3f  KID %.5f +- %.5f  IS %.3f +- %.3f' % (
+                name, steps, scores['fid'], scores['kid'], scores['kid_std'], scores['is'], scores['is_std']))
+
+    with open(os.path.join(os.path.dirname(os.path.normpath(modelConfig["save_weight_dir"])), 'distill_metrics.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+    return rows
@@ -0,0 +1,145 @@
+"""
+Static-shape executor for GaussianDiffusionSampler.
+
+Every one of the T denoising steps is the same fixed-shape model forward plus
+a few elementwise ops. At 64x64 the time goes mostly into kernel launches.
+``SamplingExecutor`` wraps a sampler and runs each step from persistent
+buffers: the image ``x``, the timestep ``t`` and the noise. The per-step
+coefficients come from float32 tables on the device, indexed by ``t``. Two
+modes run the same step function:
+
+    graph  one step (model + update, writing x in place) is captured as a CUDA
+           graph per input shape and replayed; per step the host only fills
+           ``t`` and the noise buffer
+    eager  the same step run directly, still without per-step allocations
+           of t, table concatenation or host syncs
+
+``mode='auto'`` uses graphs on CUDA and falls back to eager if capture fails
+(e.g. a KAN backend that syncs with the host) or on other devices.
+
+A graph is captured lazily, on the first input of each shape. Under
+``Metrics.BatchQueue`` that happens in the producer thread while the
+consumer thread runs the Inception networks, and again for the smaller last
+batch. Capture therefore uses ``capture_error_mode='thread_local'``: with the
+default global mode, CUDA calls of the consumer that are illegal during a
+capture (allocations, synchronizing copies) would invalidate it.
+
+Both modes reproduce ``GaussianDiffusionSampler.forward`` bit for bit: the
+noise is drawn with the same generator calls in the same order, and the
+coefficients are the float32 values ``extract`` produces. The NaN check of
+the sampler runs once at the end instead of every step. No elementwise
+fusion (e.g. torch.compile) is applied, since that would change the rounding.
+"""
+import warnings
+
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+
+from Diffusion.Diffusion import extract
+from Diffusion.Schedules import predict_eps
+
+
+EXECUTOR_MODES = ['auto', 'graph', 'eager']
+
+
+class SamplingExecutor(nn.Module):
+    def __init__(self, sampler, mode='auto', warmup=3, progress=True):
+        super().__init__()
+        if mode not in EXECUTOR_MODES:
+            raise ValueError('unknown executor mode %s, choose from %s' % (mode, ', '.join(EXECUTOR_MODES)))
+        self.sampler = sampler
+        self.mode = mode
+        self.warmup = warmup
+        self.progress = progress
+        self.tables = None
+        # (shape, dtype, device) -> (graph, static x, static t, static noise)
+        self.graphs = {}
+
+    def _build_tables(self, device):
+        s = self.sampler
+        t = torch.arange(s.T, device=s.betas.device)
+
+        def table(v):
+            # gathered by extract() itself: the float32 value the sampler uses at every t
+            return extract(v, t, [s.T]).to(device)
+
+        self.tables = {
+            'coeff1': table(s.coeff1),
+            'coeff2': table(s.coeff2),
+            # torch.sqrt(var) of the sampler: float32 sqrt of the float32 variance, on the sampling device
+            'sigma': torch.sqrt(table(torch.cat([s.posterior_var[1:2], s.betas[1:]]))),
+            'sqrt_alphas_bar': table(s.sqrt_alphas_bar),
+            'sqrt_one_minus_alphas_bar': table(s.sqrt_one_minus_alphas_bar),
+        }
+
+    def step(self, x_t, t, noise):
+        """x_{t-1} from x_t; the op order of GaussianDiffusionSampler.p_mean_variance and forward."""
+        tables = self.tables
+        eps = self.sampler.model(x_t, t)
+        if self.sampler.parameterization != 'eps':
+            eps = predict_eps(self.sampler.parameterization, eps, x_t,
+                              extract(tables['sqrt_alphas_bar'], t, x_t.shape),
+                              extract(tables['sqrt_one_minus_alphas_bar'], t, x_t.shape))
+        mean = extract(tables['coeff1'], t, x_t.shape) * x_t - extract(tables['coeff2'], t, x_t.shape) * eps
+        return mean + extract(tables['sigma'], t, x_t.shape) * noise
+
+    def _capture(self, x_T):
+        static_x = x_T.clone()
+        static_t = torch.full([x_T.shape[0], ], self.sampler.T - 1, dtype=torch.long, device=x_T.device)
+        static_noise = torch.zeros_like(x_T)
+        # warm up on a side stream so that lazy initialisation stays out of the graph
+        stream = torch.cuda.Stream(x_T.device)
+        stream.wait_stream(torch.cuda.current_stream(x_T.device))
+        with torch.cuda.stream(stream):
+            for _ in range(self.warmup):
+                self.step(static_x, static_t, static_noise)
+        torch.cuda.current_stream(x_T.device).wait_stream(stream)
+        graph = torch.cuda.CUDAGraph()
+        # only this thread is restricted during capture, see the module docstring
+        with torch.cuda.graph(graph, capture_error_mode='thread_local'):
+            static_x.copy_(self.step(static_x, static_t, static_noise))
+        return graph, static_x, static_t, static_noise
+
+    def _graph_for(self, x_T):
+        key = (tuple(x_T.shape), x_T.dtype, x_T.device)
+        if key not in self.graphs:
+            try:
+                self.graphs[key] = self._capture(x_T)
+            except RuntimeError as e:
+                if self.mode == 'graph':
+                    raise
+                warnings.warn('CUDA graph capture failed, sampling eagerly: %s' % e)
+                self.graphs[key] = None
+        return self.graphs[key]
+
+    @torch.no_grad()
+    def forward(self, x_T):
+        if self.tables is None or self.tables['coeff1'].device != x_T.device:
+            self._build_tables(x_T.device)
+        graph = None
+        if self.mode != 'eager' and x_T.device.type == 'cuda':
+            graph = self._graph_for(x_T)
+        elif self.mode == 'graph':
+            raise RuntimeError('graph mode needs a CUDA input, got %s' % x_T.device)
+
+        if graph is not None:
+            graph, x_t, t, noise = graph
+            x_t.copy_(x_T)
+        else:
+            x_t = x_T
+            t = torch.empty([x_T.shape[0], ], dtype=torch.long, device=x_T.device)
+            noise = torch.empty_like(x_T)
+        for time_step in tqdm(reversed(range(self.sampler.T)), total=self.sampler.T, disable=not self.progress):
+            t.fill_(time_step)
+            # randn_like(x_t) of the sampler is normal_ on a fresh tensor; no noise when t == 0
+            if time_step > 0:
+                noise.normal_()
+            else:
+                noise.zero_()
+            if graph is not None:
+                graph.replay()
+            else:
+                x_t = self.step(x_t, t, noise)
+        assert not torch.isnan(x_t).any(), "nan in tensor."
+        return torch.clip(x_t, -1, 1)
@@ -0,0 +1,352 @@
+"""
+FID and KID of generated samples against the real training images.
+
+Features are the 2048-d pool3 activations of the pytorch-fid InceptionV3.
+The real-image statistics (mean, covariance and a subset of features for
+KID) are computed once per dataset and cached under ``stats_dir``, keyed by
+the image folder and the preprocessing. Generated images are pushed through
+``GenerativeMetrics.update`` batch by batch, so only running sums and the KID
+subset are kept, never the images.
+
+The Inception weights are always read from a local file (``weights``), so
+pytorch-fid never downloads them; a missing file is an error.
+
+``evaluate_stream`` connects a sampler to the metrics without PNGs: a
+background thread produces the next batch while the current one goes through
+the feature extractors, with a bounded queue in between.
+"""
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision.transforms import ToTensor
+from torchvision.utils import save_image
+
+from Diffusion.Data import IMG_EXTENSIONS, dataset_dir, read_rgb
+
+# inception_score.py is a script folder, not a package
+INCEPTION_SCORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'inception-score-pytorch')
+
+
+class ImageFolder(Dataset):
+    """Images of a folder as float tensors in [0, 1], in sorted file order."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.image_files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMG_EXTENSIONS))
+        self.to_tensor = ToTensor()
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __getitem__(self, idx):
+        return self.to_tensor(read_rgb(os.path.join(self.folder, self.image_files[idx])))
+
+
+@contextmanager
+def local_fid_weights(path):
+    """Make pytorch-fid load its Inception state dict from ``path`` instead of the URL."""
+    import pytorch_fid.inception as fid_inception
+
+    load = fid_inception.load_state_dict_from_url
+    fid_inception.load_state_dict_from_url = lambda *args, **kwargs: torch.load(path, map_location='cpu')
+    try:
+        yield
+    finally:
+        fid_inception.load_state_dict_from_url = load
+
+
+class InceptionFeatures(torch.nn.Module):
+    """Pool features of images in [0, 1]; pytorch-fid resizes them to 299x299."""
+
+    def __init__(self, weights, dims=2048):
+        super().__init__()
+        from pytorch_fid.inception import FID_WEIGHTS_URL, InceptionV3
+
+        if weights is None or not os.path.isfile(weights):
+            raise FileNotFoundError(
+                'FID needs the pytorch-fid Inception weights as a local file (--fid_weights), got %s; '
+                'download them from %s' % (weights, FID_WEIGHTS_URL))
+        block = InceptionV3.BLOCK_INDEX_BY_DIM[dims]
+        with local_fid_weights(weights):
+            self.model = InceptionV3([block])
+        self.dims = dims
+        self.weights = weights
+        self.eval()
+
+    @torch.no_grad()
+    def forward(self, x):
+        return self.model(x)[0].flatten(1)
+
+
+class FeatureStats:
+    """
+    Running mean and covariance of features in float64, plus the first
+    ``max_features`` feature rows for KID.
+    """
+
+    def __init__(self, dims=2048, max_features=10000, device='cpu'):
+        self.n = 0
+        self.sum = torch.zeros(dims, dtype=torch.float64, device=device)
+        self.outer = torch.zeros(dims, dims, dtype=torch.float64, device=device)
+        self.max_features = max_features
+        self.features = []
+        self.kept = 0
+
+    def update(self, features):
+        f = features.double()
+        self.n += f.size(0)
+        self.sum += f.sum(dim=0)
+        self.outer += f.t() @ f
+        if self.kept < self.max_features:
+            keep = f[:self.max_features - self.kept].float().cpu()
+            self.features.append(keep)
+            self.kept += keep.size(0)
+
+    def mean_cov(self):
+        mu = self.sum / self.n
+        sigma = (self.outer - self.n * torch.outer(mu, mu)) / (self.n - 1)
+        return mu.cpu().numpy(), sigma.cpu().numpy()
+
+    def kid_features(self):
+        return torch.cat(self.features).numpy()
+
+    def save(self, path):
+        mu, sigma = self.mean_cov()
+        np.savez(path, mu=mu, sigma=sigma, features=self.kid_features(), n=self.n)
+
+
+def cache_key(dataset, folder, extractor, num_images):
+    """Everything that changes the real-image features, hashed into the cache file name."""
+    preprocessing = {
+        'dataset': dataset,
+        'folder': os.path.normpath(folder),
+        'num_images': num_images,
+        'dims': extractor.dims,
+        'weights': os.path.basename(extractor.weights),
+        'input': 'float [0, 1], bilinear 299x299',
+    }
+    digest = hashlib.sha1(json.dumps(preprocessing, sort_keys=True).encode()).hexdigest()[:10]
+    return '%s_%d_%s' % (dataset, extractor.dims, digest)
+
+
+@torch.no_grad()
+def real_stats(dataset, extractor, device, stats_dir='data/fid_stats', folder=None, batch_size=50,
+               num_workers=4, max_features=10000, img_size=64):
+    """Mean, covariance and KID features of the real images of ``dataset``, cached on disk."""
+    folder = folder or dataset_dir(dataset, img_size)
+    images = ImageFolder(folder)
+    path = os.path.join(stats_dir, cache_key(dataset, folder, extractor, len(images)) + '.npz')
+    if os.path.exists(path):
+        with np.load(path) as f:
+            return f['mu'], f['sigma'], f['features']
+
+    stats = FeatureStats(extractor.dims, max_features, device)
+    loader = DataLoader(images, batch_size=batch_size, num_workers=num_workers,
+                        pin_memory=torch.device(device).type == 'cuda')
+    for batch in loader:
+        stats.update(extractor(batch.to(device, non_blocking=True)))
+    os.makedirs(stats_dir, exist_ok=True)
+    stats.save(path)
+    print('real-image statistics of %s (%d images) => %s' % (dataset, stats.n, path))
+    mu, sigma = stats.mean_cov()
+    return mu, sigma, stats.kid_features()
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2):
+    from pytorch_fid.fid_score import calculate_frechet_distance
+
+    return float(calculate_frechet_distance(mu1, sigma1, mu2, sigma2))
+
+
+def kernel_inception_distance(real, fake, subsets=100, subset_size=1000, seed=0):
+    """
+    Unbiased MMD^2 with the cubic polynomial kernel k(x, y) = (x.y / d + 1)^3,
+    averaged over random subsets. Returns (mean, std) over the subsets.
+    """
+    rng = np.random.RandomState(seed)
+    m = min(len(real), len(fake), subset_size)
+    d = real.shape[1]
+    scores = []
+    for _ in range(subsets):
+        x = fake[rng.choice(len(fake), m, replace=False)].astype(np.float64)
+        y = real[rng.choice(len(real), m, replace=False)].astype(np.float64)
+        kxx = (x @ x.T / d + 1) ** 3
+        kyy = (y @ y.T / d + 1) ** 3
+        kxy = (x @ y.T / d + 1) ** 3
+        mmd = ((kxx.sum() - np.trace(kxx)) + (kyy.sum() - np.trace(kyy))) / (m * (m - 1)) - 2 * kxy.mean()
+        scores.append(mmd)
+    return float(np.mean(scores)), float(np.std(scores))
+
+
+class GenerativeMetrics:
+    """
+    Streaming FID/KID of generated images against cached real statistics.
+
+        metrics = GenerativeMetrics('cvc', device, weights='pt_inception-2015-12-05-6726825d.pth')
+        for images in batches:          # (B, 3, H, W) in [-1, 1]
+            metrics.update(images)
+        metrics.compute()               # {'fid': ..., 'kid': ..., 'kid_std': ...}
+    """
+
+    def __init__(self, dataset, device, weights=None, stats_dir='data/fid_stats', real_folder=None,
+                 max_features=10000, kid_subsets=100, kid_subset_size=1000, num_workers=4, img_size=64):
+        self.device = torch.device(device)
+        self.extractor = InceptionFeatures(weights).to(self.device)
+        self.real_mu, self.real_sigma, self.real_features = real_stats(
+            dataset, self.extractor, self.device, stats_dir, real_folder, num_workers=num_workers,
+            max_features=max_features, img_size=img_size)
+        self.max_features = max_features
+        self.kid_subsets = kid_subsets
+        self.kid_subset_size = kid_subset_size
+        self.reset()
+
+    def reset(self):
+        self.stats = FeatureStats(self.extractor.dims, self.max_features, self.device)
+
+    @torch.no_grad()
+    def update(self, images):
+        """Add a batch of generated images in [-1, 1]."""
+        x = (images.to(self.device).float() * 0.5 + 0.5).clamp(0, 1)
+        self.stats.update(self.extractor(x))
+
+    def compute(self):
+        mu, sigma = self.stats.mean_cov()
+        kid, kid_std = kernel_inception_distance(self.real_features, self.stats.kid_features(),
+                                                 self.kid_subsets, self.kid_subset_size)
+        return {
+            'num_samples': self.stats.n,
+            'fid': frechet_distance(mu, sigma, self.real_mu, self.real_sigma),
+            'kid': kid,
+            'kid_std': kid_std,
+        }
+
+
+class InceptionScore:
+    """
+    Streaming Inception Score with the torchvision Inception v3, using the
+    model and the split-wise KL of inception-score-pytorch/inception_score.py
+    (bilinear resize to 299, float64 softmax).
+    """
+
+    def __init__(self, device, weights=None, splits=10):
+        if INCEPTION_SCORE_DIR not in sys.path:
+            sys.path.append(INCEPTION_SCORE_DIR)
+        from inception_score import inception_probs, load_inception, split_scores
+
+        self.device = torch.device(device)
+        self.model = load_inception(self.device, weights)
+        self.inception_probs = inception_probs
+        self.split_scores = split_scores
+        self.splits = splits
+        self.reset()
+
+    def reset(self):
+        self.preds = []
+
+    @torch.no_grad()
+    def update(self, images):
+        """Add a batch of generated images in [-1, 1]."""
+        self.preds.append(self.inception_probs(self.model, images.to(self.device).float(), resize=True))
+
+    def compute(self):
+        num_samples = sum(p.size(0) for p in self.preds)
+        if num_samples < self.splits:
+            raise ValueError('the Inception Score needs at least one image per split, got %d images for %d splits'
+                             % (num_samples, self.splits))
+        scores = self.split_scores(torch.cat(self.preds), self.splits)
+        return {'is': scores.mean().item(), 'is_std': scores.std(unbiased=False).item()}
+
+
+@torch.no_grad()
+def sample_batches(sampler, num_samples, batch_size, img_size, device):
+    """Generate ``num_samples`` images in [-1, 1] with a GaussianDiffusionSampler, one batch at a time."""
+    done = 0
+    while done < num_samples:
+        n = min(batch_size, num_samples - done)
+        noisyImage = torch.randn(size=[n, 3, img_size, img_size], device=device)
+        yield sampler(noisyImage)
+        done += n
+
+
+class BatchQueue:
+    """
+    Iterate ``batches`` in a background thread, at most ``maxsize`` batches ahead.
+
+    On CUDA the producer runs on its own stream, so the next batch is sampled
+    while the consumer runs the feature extractors on the current one; each
+    batch carries an event the consumer waits on before using it.
+
+    A ``SamplingExecutor`` in graph mode captures a CUDA graph in the producer
+    thread for every new batch shape, including the last partial batch, while
+    the consumer keeps launching work. It captures with a thread-local error
+    mode for this reason; a sampler that captures graphs in the global mode
+    cannot be used here.
+    """
+
+    _done = object()
+
+    def __init__(self, batches, maxsize=2, device='cpu'):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.device = torch.device(device)
+        self.thread = threading.Thread(target=self._produce, args=(batches,), daemon=True)
+        self.thread.start()
+
+    def _produce(self, batches):
+        cuda = self.device.type == 'cuda'
+        stream = torch.cuda.Stream(self.device) if cuda else None
+        try:
+            # grad mode and the current stream are thread-local
+            with torch.no_grad(), torch.cuda.stream(stream) if cuda else nullcontext():
+                for batch in batches:
+                    event = None
+                    if cuda:
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                    self.queue.put((batch, event))
+        except Exception as e:
+            self.queue.put((e, None))
+            return
+        self.queue.put((self._done, None))
+
+    def __iter__(self):
+        while True:
+            batch, event = self.queue.get()
+            if batch is self._done:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            if event is not None:
+                current = torch.cuda.current_stream(self.device)
+                current.wait_event(event)
+                batch.record_stream(current)
+            yield batch
+        self.thread.join()
+
+
+def evaluate_stream(batches, metrics, device, save_dir=None, queue_size=2):
+    """
+    Feed every batch (images in [-1, 1]) to each metric and merge their
+    ``compute()`` results. With ``save_dir`` the images are also written as PNGs.
+    """
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+    count = 0
+    for images in BatchQueue(batches, queue_size, device):
+        for metric in metrics:
+            metric.update(images)
+        if save_dir is not None:
+            for image in images * 0.5 + 0.5:
+                save_image(image, os.path.join(save_dir, 'sample_{}.png'.format(count)))
+                count += 1
+    scores = {}
+    for metric in metrics:
+        scores.update(metric.compute())
+    return scores
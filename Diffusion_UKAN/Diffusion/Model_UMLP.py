@@ -7,282 +7,6 @@ from torch.nn import init
 from torch.nn import functional as F
 from timm.models.layers import DropPath, to_2tuple, trunc_normal_
 
-class KANLinear(torch.nn.Module):
-    def __init__(
-        self,
-        in_features,
-        out_features,
-        grid_size=5,
-        spline_order=3,
-        scale_noise=0.1,
-        scale_base=1.0,
-        scale_spline=1.0,
-        enable_standalone_scale_spline=True,
-        base_activation=torch.nn.SiLU,
-        grid_eps=0.02,
-        grid_range=[-1, 1],
-    ):
-        super(KANLinear, self).__init__()
-        self.in_features = in_features
-        self.out_features = out_features
-        self.grid_size = grid_size
-        self.spline_order = spline_order
-
-        h = (grid_range[1] - grid_range[0]) / grid_size
-        grid = (
-            (
-                torch.arange(-spline_order, grid_size + spline_order + 1) * h
-                + grid_range[0]
-            )
-            .expand(in_features, -1)
-            .contiguous()
-        )
-        self.register_buffer("grid", grid)
-
-        self.base_weight = torch.nn.Parameter(torch.Tensor(out_features, in_features))
-        self.spline_weight = torch.nn.Parameter(
-            torch.Tensor(out_features, in_features, grid_size + spline_order)
-        )
-        if enable_standalone_scale_spline:
-            self.spline_scaler = torch.nn.Parameter(
-                torch.Tensor(out_features, in_features)
-            )
-
-        self.scale_noise = scale_noise
-        self.scale_base = scale_base
-        self.scale_spline = scale_spline
-        self.enable_standalone_scale_spline = enable_standalone_scale_spline
-        self.base_activation = base_activation()
-        self.grid_eps = grid_eps
-
-        self.reset_parameters()
-
-    def reset_parameters(self):
-        torch.nn.init.kaiming_uniform_(self.base_weight, a=math.sqrt(5) * self.scale_base)
-        with torch.no_grad():
-            noise = (
-                (
-                    torch.rand(self.grid_size + 1, self.in_features, self.out_features)
-                    - 1 / 2
-                )
-                * self.scale_noise
-                / self.grid_size
-            )
-            self.spline_weight.data.copy_(
-                (self.scale_spline if not self.enable_standalone_scale_spline else 1.0)
-                * self.curve2coeff(
-                    self.grid.T[self.spline_order : -self.spline_order],
-                    noise,
-                )
-            )
-            if self.enable_standalone_scale_spline:
-                # torch.nn.init.constant_(self.spline_scaler, self.scale_spline)
-                torch.nn.init.kaiming_uniform_(self.spline_scaler, a=math.sqrt(5) * self.scale_spline)
-
-    def b_splines(self, x: torch.Tensor):
-        """
-        Compute the B-spline bases for the given input tensor.
-
-        Args:
-            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
-
-        Returns:
-            torch.Tensor: B-spline bases tensor of shape (batch_size, in_features, grid_size + spline_order).
-        """
-        assert x.dim() == 2 and x.size(1) == self.in_features
-
-        grid: torch.Tensor = (
-            self.grid
-        )  # (in_features, grid_size + 2 * spline_order + 1)
-        x = x.unsqueeze(-1)
-        bases = ((x >= grid[:, :-1]) & (x < grid[:, 1:])).to(x.dtype)
-        for k in range(1, self.spline_order + 1):
-            bases = (
-                (x - grid[:, : -(k + 1)])
-                / (grid[:, k:-1] - grid[:, : -(k + 1)])
-                * bases[:, :, :-1]
-            ) + (
-                (grid[:, k + 1 :] - x)
-                / (grid[:, k + 1 :] - grid[:, 1:(-k)])
-                * bases[:, :, 1:]
-            )
-
-        assert bases.size() == (
-            x.size(0),
-            self.in_features,
-            self.grid_size + self.spline_order,
-        )
-        return bases.contiguous()
-
-    def curve2coeff(self, x: torch.Tensor, y: torch.Tensor):
-        """
-        Compute the coefficients of the curve that interpolates the given points.
-
-        Args:
-            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
-            y (torch.Tensor): Output tensor of shape (batch_size, in_features, out_features).
-
-        Returns:
-            torch.Tensor: Coefficients tensor of shape (out_features, in_features, grid_size + spline_order).
-        """
-        assert x.dim() == 2 and x.size(1) == self.in_features
-        assert y.size() == (x.size(0), self.in_features, self.out_features)
-
-        A = self.b_splines(x).transpose(
-            0, 1
-        )  # (in_features, batch_size, grid_size + spline_order)
-        B = y.transpose(0, 1)  # (in_features, batch_size, out_features)
-        solution = torch.linalg.lstsq(
-            A, B
-        ).solution  # (in_features, grid_size + spline_order, out_features)
-        result = solution.permute(
-            2, 0, 1
-        )  # (out_features, in_features, grid_size + spline_order)
-
-        assert result.size() == (
-            self.out_features,
-            self.in_features,
-            self.grid_size + self.spline_order,
-        )
-        return result.contiguous()
-
-    @property
-    def scaled_spline_weight(self):
-        return self.spline_weight * (
-            self.spline_scaler.unsqueeze(-1)
-            if self.enable_standalone_scale_spline
-            else 1.0
-        )
-
-    def forward(self, x: torch.Tensor):
-        assert x.dim() == 2 and x.size(1) == self.in_features
-
-        base_output = F.linear(self.base_activation(x), self.base_weight)
-        spline_output = F.linear(
-            self.b_splines(x).view(x.size(0), -1),
-            self.scaled_spline_weight.view(self.out_features, -1),
-        )
-        return base_output + spline_output
-
-    @torch.no_grad()
-    def update_grid(self, x: torch.Tensor, margin=0.01):
-        assert x.dim() == 2 and x.size(1) == self.in_features
-        batch = x.size(0)
-
-        splines = self.b_splines(x)  # (batch, in, coeff)
-        splines = splines.permute(1, 0, 2)  # (in, batch, coeff)
-        orig_coeff = self.scaled_spline_weight  # (out, in, coeff)
-        orig_coeff = orig_coeff.permute(1, 2, 0)  # (in, coeff, out)
-        unreduced_spline_output = torch.bmm(splines, orig_coeff)  # (in, batch, out)
-        unreduced_spline_output = unreduced_spline_output.permute(
-            1, 0, 2
-        )  # (batch, in, out)
-
-        # sort each channel individually to collect data distribution
-        x_sorted = torch.sort(x, dim=0)[0]
-        grid_adaptive = x_sorted[
-            torch.linspace(
-                0, batch - 1, self.grid_size + 1, dtype=torch.int64, device=x.device
-            )
-        ]
-
-        uniform_step = (x_sorted[-1] - x_sorted[0] + 2 * margin) / self.grid_size
-        grid_uniform = (
-            torch.arange(
-                self.grid_size + 1, dtype=torch.float32, device=x.device
-            ).unsqueeze(1)
-            * uniform_step
-            + x_sorted[0]
-            - margin
-        )
-
-        grid = self.grid_eps * grid_uniform + (1 - self.grid_eps) * grid_adaptive
-        grid = torch.concatenate(
-            [
-                grid[:1]
-                - uniform_step
-                * torch.arange(self.spline_order, 0, -1, device=x.device).unsqueeze(1),
-                grid,
-                grid[-1:]
-                + uniform_step
-                * torch.arange(1, self.spline_order + 1, device=x.device).unsqueeze(1),
-            ],
-            dim=0,
-        )
-
-        self.grid.copy_(grid.T)
-        self.spline_weight.data.copy_(self.curve2coeff(x, unreduced_spline_output))
-
-    def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):
-        """
-        Compute the regularization loss.
-
-        This is a dumb simulation of the original L1 regularization as stated in the
-        paper, since the original one requires computing absolutes and entropy from the
-        expanded (batch, in_features, out_features) intermediate tensor, which is hidden
-        behind the F.linear function if we want an memory efficient implementation.
-
-        The L1 regularization is now computed as mean absolute value of the spline
-        weights. The authors implementation also includes this term in addition to the
-        sample-based regularization.
-        """
-        l1_fake = self.spline_weight.abs().mean(-1)
-        regularization_loss_activation = l1_fake.sum()
-        p = l1_fake / regularization_loss_activation
-        regularization_loss_entropy = -torch.sum(p * p.log())
-        return (
-            regularize_activation * regularization_loss_activation
-            + regularize_entropy * regularization_loss_entropy
-        )
-
-
-class KAN(torch.nn.Module):
-    def __init__(
-        self,
-        layers_hidden,
-        grid_size=5,
-        spline_order=3,
-        scale_noise=0.1,
-        scale_base=1.0,
-        scale_spline=1.0,
-        base_activation=torch.nn.SiLU,
-        grid_eps=0.02,
-        grid_range=[-1, 1],
-    ):
-        super(KAN, self).__init__()
-        self.grid_size = grid_size
-        self.spline_order = spline_order
-
-        self.layers = torch.nn.ModuleList()
-        for in_features, out_features in zip(layers_hidden, layers_hidden[1:]):
-            self.layers.append(
-                KANLinear(
-                    in_features,
-                    out_features,
-                    grid_size=grid_size,
-                    spline_order=spline_order,
-                    scale_noise=scale_noise,
-                    scale_base=scale_base,
-                    scale_spline=scale_spline,
-                    base_activation=base_activation,
-                    grid_eps=grid_eps,
-                    grid_range=grid_range,
-                )
-            )
-
-    def forward(self, x: torch.Tensor, update_grid=False):
-        for layer in self.layers:
-            if update_grid:
-                layer.update_grid(x)
-            x = layer(x)
-        return x
-
-    def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):
-        return sum(
-            layer.regularization_loss(regularize_activation, regularize_entropy)
-            for layer in self.layers
-        )
-
 
 def conv1x1(in_planes: int, out_planes: int, stride: int = 1) -> nn.Conv2d:
     """1x1 convolution"""
@@ -466,14 +190,14 @@ class kan(nn.Module):
     def forward(self, x, H, W):
         B, N, C = x.shape
 
-        x = self.fc1(x.reshape(B*N,C))
+        x = self.fc1(x.flatten(0, 1))
 
-        x = x.reshape(B,N,C).contiguous()
+        x = x.unflatten(0, (B, N)).contiguous()
 
         return x
 
 class shiftedBlock(nn.Module):
-    def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, sr_ratio=1, version=1, kan_val=False):
+    def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=False, qk_scale=None, drop=0., attn_drop=0., drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, sr_ratio=1, version=1, kan_val=False, tdim=256):
         super().__init__()
 
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
@@ -482,7 +206,7 @@ class shiftedBlock(nn.Module):
 
         self.temb_proj = nn.Sequential(
             Swish(),
-            nn.Linear(256, dim),
+            nn.Linear(tdim, dim),
         )
         # self.mlp = shiftmlp(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, drop=drop)
         self.kan = kan(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, drop=drop, kan_val=kan_val)
@@ -544,7 +268,7 @@ class DW_bn_relu(nn.Module):
         return x
 
 class SingleConv(nn.Module):
-    def __init__(self, in_ch, h_ch):
+    def __init__(self, in_ch, h_ch, tdim=256):
         super(SingleConv, self).__init__()
         self.conv = nn.Sequential(
             nn.GroupNorm(32, in_ch),
@@ -554,14 +278,14 @@ class SingleConv(nn.Module):
 
         self.temb_proj = nn.Sequential(
             Swish(),
-            nn.Linear(256, h_ch),
+            nn.Linear(tdim, h_ch),
         )
     def forward(self, input, temb):
         return self.conv(input) + self.temb_proj(temb)[:,:,None, None]
 
 
 class DoubleConv(nn.Module):
-    def __init__(self, in_ch, h_ch):
+    def __init__(self, in_ch, h_ch, tdim=256):
         super(DoubleConv, self).__init__()
         self.conv = nn.Sequential(
             nn.Conv2d(in_ch, h_ch, 3, padding=1),
@@ -573,14 +297,14 @@ class DoubleConv(nn.Module):
         )
         self.temb_proj = nn.Sequential(
             Swish(),
-            nn.Linear(256, h_ch),
+            nn.Linear(tdim, h_ch),
         )
     def forward(self, input, temb):
         return self.conv(input) + self.temb_proj(temb)[:,:,None, None]
 
 
 class D_SingleConv(nn.Module):
-    def __init__(self, in_ch, h_ch):
+    def __init__(self, in_ch, h_ch, tdim=256):
         super(D_SingleConv, self).__init__()
         self.conv = nn.Sequential(
             nn.GroupNorm(32,in_ch),
@@ -589,14 +313,14 @@ class D_SingleConv(nn.Module):
         )
         self.temb_proj = nn.Sequential(
             Swish(),
-            nn.Linear(256, h_ch),
+            nn.Linear(tdim, h_ch),
         )
     def forward(self, input, temb):
         return self.conv(input) + self.temb_proj(temb)[:,:,None, None]
 
 
 class D_DoubleConv(nn.Module):
-    def __init__(self, in_ch, h_ch):
+    def __init__(self, in_ch, h_ch, tdim=256):
         super(D_DoubleConv, self).__init__()
         self.conv = nn.Sequential(
             nn.Conv2d(in_ch, in_ch, 3, padding=1),
@@ -608,7 +332,7 @@ class D_DoubleConv(nn.Module):
         )
         self.temb_proj = nn.Sequential(
             Swish(),
-            nn.Linear(256, h_ch),
+            nn.Linear(tdim, h_ch),
         )
     def forward(self, input,temb):
         return self.conv(input) + self.temb_proj(temb)[:,:,None, None]
@@ -697,9 +421,11 @@ class ResBlock(nn.Module):
 
 
 class UMLP(nn.Module):
-    def __init__(self, T, ch, ch_mult, attn, num_res_blocks, dropout):
+    def __init__(self, T, ch, ch_mult, attn, num_res_blocks, dropout, img_size=64):
         super().__init__()
         assert all([i < len(ch_mult) for i in attn]), 'attn index h of bound'
+        # len(ch_mult) - 1 downsamplings, then two stride-2 patch embeddings that are upsampled back
+        assert img_size % 2 ** (len(ch_mult) + 1) == 0, 'img_size must be a multiple of %d' % 2 ** (len(ch_mult) + 1)
         tdim = ch * 4
         self.time_embedding = TimeEmbedding(T, ch, tdim)
         attn = []
@@ -738,7 +464,9 @@ class UMLP(nn.Module):
         )
 
         # 
-        embed_dims = [256, 320, 512]
+        # KAN stage widths follow the last conv stage: [256, 320, 512] for ch=64, ch_mult=[1, 2, 3, 4]
+        embed_dims = [ch * ch_mult[-1], ch * ch_mult[-1] + ch, 2 * ch * ch_mult[-1]]
+        kan_size = img_size // 2 ** (len(ch_mult) - 1)
         drop_rate = 0.0
         attn_drop_rate = 0.0
         kan_val = False
@@ -749,8 +477,8 @@ class UMLP(nn.Module):
         qk_scale=None
         norm_layer = nn.LayerNorm
         dpr = [0.0, 0.0, 0.0]
-        self.patch_embed3 = OverlapPatchEmbed(img_size=64 // 4, patch_size=3, stride=2, in_chans=embed_dims[0], embed_dim=embed_dims[1])
-        self.patch_embed4 = OverlapPatchEmbed(img_size=64 // 8, patch_size=3, stride=2, in_chans=embed_dims[1], embed_dim=embed_dims[2])
+        self.patch_embed3 = OverlapPatchEmbed(img_size=kan_size, patch_size=3, stride=2, in_chans=embed_dims[0], embed_dim=embed_dims[1])
+        self.patch_embed4 = OverlapPatchEmbed(img_size=kan_size // 2, patch_size=3, stride=2, in_chans=embed_dims[1], embed_dim=embed_dims[2])
 
         
         self.norm3 = norm_layer(embed_dims[1])
@@ -763,25 +491,25 @@ class UMLP(nn.Module):
         self.kan_block1 = nn.ModuleList([shiftedBlock(
             dim=embed_dims[1], num_heads=num_heads[0], mlp_ratio=1, qkv_bias=qkv_bias, qk_scale=qk_scale,
             drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[0], norm_layer=norm_layer,
-            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val)])
+            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val, tdim=tdim)])
 
         self.kan_block2 = nn.ModuleList([shiftedBlock(
             dim=embed_dims[2], num_heads=num_heads[0], mlp_ratio=1, qkv_bias=qkv_bias, qk_scale=qk_scale,
             drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[1], norm_layer=norm_layer,
-            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val)])
+            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val, tdim=tdim)])
 
         self.kan_dblock1 = nn.ModuleList([shiftedBlock(
             dim=embed_dims[1], num_heads=num_heads[0], mlp_ratio=1, qkv_bias=qkv_bias, qk_scale=qk_scale,
             drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[0], norm_layer=norm_layer,
-            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val)])
+            sr_ratio=sr_ratios[0], version=version, kan_val=kan_val, tdim=tdim)])
 
         # self.kan_dblock2 = nn.ModuleList([shiftedBlock(
         #     dim=embed_dims[0], num_heads=num_heads[0], mlp_ratio=1, qkv_bias=qkv_bias, qk_scale=qk_scale,
         #     drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[1], norm_layer=norm_layer,
         #     sr_ratio=sr_ratios[0], version=version, kan_val=kan_val)])
 
-        self.decoder1 = D_SingleConv(embed_dims[2], embed_dims[1])  
-        self.decoder2 = D_SingleConv(embed_dims[1], embed_dims[0])  
+        self.decoder1 = D_SingleConv(embed_dims[2], embed_dims[1], tdim)  
+        self.decoder2 = D_SingleConv(embed_dims[1], embed_dims[0], tdim)  
 
         self.initialize()
 
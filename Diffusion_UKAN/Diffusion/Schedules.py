@@ -0,0 +1,96 @@
+"""
+Noise schedules, network parameterisations and loss weightings shared by
+GaussianDiffusionTrainer and the samplers.
+
+Schedules (``betas`` in float64):
+
+    linear         beta_1 .. beta_T evenly spaced, the original DDPM schedule
+    scaled_linear  sqrt(beta) evenly spaced, as in latent diffusion
+    cosine         alpha_bar(t) = cos^2((t / T + s) / (1 + s) * pi / 2), Improved DDPM
+
+Parameterisations say what the network predicts: the noise ``eps``, the
+clean image ``x0``, or ``v = sqrt(alpha_bar) * eps - sqrt(1 - alpha_bar) * x0``.
+The samplers convert every prediction back to eps, so the update rules stay
+unchanged.
+
+``step_schedule`` picks the timesteps of a few-step (DDIM or distilled)
+sampler. Its grid for N steps is the even half of its grid for 2N steps, which
+is what progressive distillation relies on.
+
+Loss weighting ``min_snr`` (Hang et al. 2023) clamps the per-timestep weight
+at ``snr_gamma``, expressed for the target of each parameterisation.
+"""
+import math
+
+import torch
+
+
+SCHEDULES = ['linear', 'scaled_linear', 'cosine']
+PARAMETERIZATIONS = ['eps', 'x0', 'v']
+LOSS_WEIGHTINGS = ['none', 'min_snr']
+
+
+def make_betas(schedule, T, beta_1=1e-4, beta_T=0.02, cosine_s=0.008, max_beta=0.999):
+    if schedule == 'linear':
+        return torch.linspace(beta_1, beta_T, T).double()
+    if schedule == 'scaled_linear':
+        return torch.linspace(beta_1 ** 0.5, beta_T ** 0.5, T).double() ** 2
+    if schedule == 'cosine':
+        steps = torch.arange(T + 1, dtype=torch.float64) / T
+        alphas_bar = torch.cos((steps + cosine_s) / (1 + cosine_s) * math.pi / 2) ** 2
+        betas = 1 - alphas_bar[1:] / alphas_bar[:-1]
+        return betas.clamp(max=max_beta)
+    raise ValueError('unknown schedule %s, choose from %s' % (schedule, ', '.join(SCHEDULES)))
+
+
+def step_schedule(T, steps):
+    """The ``steps`` timesteps round(k T / steps) - 1, k = 1..steps, in increasing order; all of 0..T-1 for steps == T."""
+    assert 1 <= steps <= T, 'steps must be in [1, %d], got %d' % (T, steps)
+    k = torch.arange(1, steps + 1, dtype=torch.float64)
+    return torch.round(k * T / steps).long() - 1
+
+
+def training_target(parameterization, x_0, noise, sqrt_alphas_bar, sqrt_one_minus_alphas_bar):
+    """What the network is trained to output at x_t = sqrt(ab) x_0 + sqrt(1 - ab) noise."""
+    if parameterization == 'eps':
+        return noise
+    if parameterization == 'x0':
+        return x_0
+    if parameterization == 'v':
+        return sqrt_alphas_bar * noise - sqrt_one_minus_alphas_bar * x_0
+    raise ValueError('unknown parameterization %s, choose from %s' % (parameterization, ', '.join(PARAMETERIZATIONS)))
+
+
+def predict_eps(parameterization, output, x_t, sqrt_alphas_bar, sqrt_one_minus_alphas_bar):
+    """The noise implied by a network output."""
+    if parameterization == 'eps':
+        return output
+    if parameterization == 'x0':
+        return (x_t - sqrt_alphas_bar * output) / sqrt_one_minus_alphas_bar
+    if parameterization == 'v':
+        return sqrt_one_minus_alphas_bar * x_t + sqrt_alphas_bar * output
+    raise ValueError('unknown parameterization %s, choose from %s' % (parameterization, ', '.join(PARAMETERIZATIONS)))
+
+
+def predict_x0(parameterization, output, x_t, sqrt_alphas_bar, sqrt_one_minus_alphas_bar):
+    """The clean image implied by a network output."""
+    if parameterization == 'x0':
+        return output
+    if parameterization == 'v':
+        return sqrt_alphas_bar * x_t - sqrt_one_minus_alphas_bar * output
+    eps = predict_eps(parameterization, output, x_t, sqrt_alphas_bar, sqrt_one_minus_alphas_bar)
+    return (x_t - sqrt_one_minus_alphas_bar * eps) / sqrt_alphas_bar
+
+
+def loss_weight(weighting, parameterization, snr, snr_gamma=5.):
+    """Per-sample weight of the MSE on the parameterisation's target, given SNR(t) = ab / (1 - ab)."""
+    if weighting == 'none':
+        return torch.ones_like(snr)
+    if weighting == 'min_snr':
+        clamped = snr.clamp(max=snr_gamma)
+        if parameterization == 'eps':
+            return clamped / snr
+        if parameterization == 'v':
+            return clamped / (snr + 1)
+        return clamped
+    raise ValueError('unknown loss weighting %s, choose from %s' % (weighting, ', '.join(LOSS_WEIGHTINGS)))
@@ -0,0 +1,151 @@
+"""
+Timestep samplers for GaussianDiffusionTrainer.
+
+A sampler draws ``t`` for a batch and returns importance weights
+``1 / (T' p(t))``, where T' is the number of timesteps in its range. Scaling
+the per-sample loss by them keeps the expected loss equal to the uniform
+objective over that range, whatever the proposal ``p``:
+
+    uniform     t ~ U[t_min, t_max), the original behaviour
+    stratified  one random offset plus B evenly spaced strata over the range,
+                so every batch covers all noise levels (low discrepancy)
+    importance  p(t) ~ sqrt(E[loss_t^2]) from a per-t moving average, mixed
+                with a little uniform mass, after every t has been seen
+                ``warmup`` times (loss-aware sampling of Improved DDPM)
+
+``t_min``/``t_max`` truncate the range for any sampler. All state lives on the
+device and is updated without host syncs. Under DDP every rank keeps its own
+statistics. ``stats()`` reports the per-t loss averages since the last call,
+binned, for logging.
+"""
+from collections import OrderedDict
+
+import torch
+
+
+class TimestepSampler:
+    def __init__(self, T, t_min=0, t_max=None):
+        self.T = T
+        self.t_min = t_min
+        self.t_max = T if t_max is None else t_max
+        assert 0 <= self.t_min < self.t_max <= T, 'empty timestep range [%d, %d)' % (self.t_min, self.t_max)
+        self.device = None
+
+    def _init_state(self, device):
+        self.device = device
+        self.loss_sum = torch.zeros(self.T, dtype=torch.float64, device=device)
+        self.loss_count = torch.zeros(self.T, dtype=torch.float64, device=device)
+
+    def num_steps(self):
+        return self.t_max - self.t_min
+
+    def probs(self):
+        """Proposal p(t) over all T timesteps, zero outside the range."""
+        p = torch.zeros(self.T, device=self.device)
+        p[self.t_min:self.t_max] = 1. / self.num_steps()
+        return p
+
+    def draw(self, batch_size, device, generator=None):
+        return torch.randint(self.t_min, self.t_max, size=(batch_size, ), device=device, generator=generator)
+
+    def sample(self, batch_size, device, generator=None):
+        """(t, weights) for a batch; weights are 1 for a uniform proposal."""
+        if self.device is None:
+            self._init_state(device)
+        t = self.draw(batch_size, device, generator)
+        return t, torch.ones(batch_size, device=device)
+
+    @torch.no_grad()
+    def update(self, t, losses):
+        """Record the per-sample (unweighted) losses of timesteps ``t``."""
+        losses = losses.detach().double()
+        self.loss_sum.index_add_(0, t, losses)
+        self.loss_count.index_add_(0, t, torch.ones_like(losses))
+
+    def stats(self, bins=10):
+        """Mean loss and proposal mass per bin of timesteps since the last call (one host sync)."""
+        edges = torch.linspace(0, self.T, bins + 1).long().tolist()
+        out = OrderedDict()
+        if self.device is None:
+            return out
+        loss_sum, loss_count, probs = self.loss_sum.cpu(), self.loss_count.cpu(), self.probs().cpu()
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            count = loss_count[lo:hi].sum().item()
+            out['loss_t%d-%d' % (lo, hi - 1)] = loss_sum[lo:hi].sum().item() / count if count else float('nan')
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            out['p_t%d-%d' % (lo, hi - 1)] = probs[lo:hi].sum().item()
+        self.loss_sum.zero_()
+        self.loss_count.zero_()
+        return out
+
+
+class UniformSampler(TimestepSampler):
+    pass
+
+
+class StratifiedSampler(TimestepSampler):
+    def draw(self, batch_size, device, generator=None):
+        # t_i = t_min + floor((i + u) / B * T'), shuffled so strata are not tied to batch positions
+        u = torch.rand(1, device=device, generator=generator)
+        strata = (torch.arange(batch_size, device=device) + u) / batch_size
+        t = self.t_min + (strata * self.num_steps()).long().clamp(max=self.num_steps() - 1)
+        return t[torch.randperm(batch_size, device=device, generator=generator)]
+
+
+class ImportanceSampler(TimestepSampler):
+    def __init__(self, T, t_min=0, t_max=None, warmup=10, decay=0.9, uniform_prob=0.001):
+        super().__init__(T, t_min, t_max)
+        self.warmup = warmup
+        self.decay = decay
+        self.uniform_prob = uniform_prob
+
+    def _init_state(self, device):
+        super()._init_state(device)
+        self.sq_loss = torch.zeros(self.T, dtype=torch.float64, device=device)
+        self.seen = torch.zeros(self.T, dtype=torch.float64, device=device)
+
+    def probs(self):
+        uniform = super().probs()
+        # static slices of the range; a boolean mask index would sync with the host
+        weights = torch.zeros(self.T, device=self.device)
+        weights[self.t_min:self.t_max] = self.sq_loss[self.t_min:self.t_max].sqrt()
+        p = weights / weights.sum().clamp(min=1e-12)
+        p = (1 - self.uniform_prob) * p + self.uniform_prob * uniform
+        # uniform until every timestep of the range has a loss estimate; decided on the device
+        ready = (self.seen[self.t_min:self.t_max] >= self.warmup).all()
+        return torch.where(ready, p, uniform)
+
+    def sample(self, batch_size, device, generator=None):
+        if self.device is None:
+            self._init_state(device)
+        p = self.probs()
+        t = torch.multinomial(p, batch_size, replacement=True, generator=generator)
+        weights = 1. / (self.num_steps() * p[t])
+        return t, weights
+
+    @torch.no_grad()
+    def update(self, t, losses):
+        super().update(t, losses)
+        losses = losses.detach().double()
+        # batch mean of loss^2 per timestep, then one EMA step for the timesteps that occurred
+        batch_sq = torch.zeros_like(self.sq_loss).index_add_(0, t, losses ** 2)
+        batch_count = torch.zeros_like(self.sq_loss).index_add_(0, t, torch.ones_like(losses))
+        hit = batch_count > 0
+        batch_mean = batch_sq / batch_count.clamp(min=1)
+        # the first estimate of a timestep replaces the zero initialisation
+        decay = torch.where(self.seen > 0, torch.full_like(self.sq_loss, self.decay), torch.zeros_like(self.sq_loss))
+        self.sq_loss = torch.where(hit, decay * self.sq_loss + (1 - decay) * batch_mean, self.sq_loss)
+        self.seen += batch_count
+
+
+TIMESTEP_SAMPLERS = OrderedDict([
+    ('uniform', UniformSampler),
+    ('stratified', StratifiedSampler),
+    ('importance', ImportanceSampler),
+])
+
+
+def build_timestep_sampler(name, T, t_min=0, t_max=None, **kwargs):
+    if name not in TIMESTEP_SAMPLERS:
+        raise ValueError('unknown timestep sampler %s, choose from %s' % (name, ', '.join(TIMESTEP_SAMPLERS)))
+    return TIMESTEP_SAMPLERS[name](T, t_min, t_max, **kwargs)
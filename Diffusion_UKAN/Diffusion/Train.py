@@ -1,18 +1,31 @@
 
 import os
+import json
+from contextlib import nullcontext
 from typing import Dict
 import torch
 import torch.optim as optim
 from tqdm import tqdm
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel as DDP
 from torchvision import transforms, transforms
 # from torchvision.datasets import CIFAR10
 from torchvision.utils import save_image
-from Diffusion import GaussianDiffusionSampler, GaussianDiffusionTrainer
+from Diffusion import DDIMSampler, GaussianDiffusionSampler, GaussianDiffusionTrainer
 from Diffusion.UNet import UNet, UNet_Baseline
 from Diffusion.Model_ConvKan import UNet_ConvKan
 from Diffusion.Model_UMLP import UMLP
 from Diffusion.Model_UKAN_Hybrid import UKan_Hybrid
+from Diffusion.utils import AsyncLogFile, DeviceLossMeter
+from kan_core.dist_utils import init_distributed, is_distributed, barrier, scale_lr
+from kan_core.compiler import compile_model
+from kan_core.profiler import StepProfiler
+from Diffusion.kan_utils.kan import kan_init, set_default_backend, set_default_solver
+from Diffusion.Metrics import GenerativeMetrics, InceptionScore, evaluate_stream, sample_batches
+from Diffusion.Timesteps import build_timestep_sampler
+from Diffusion.Executor import SamplingExecutor
+from Diffusion.Data import DATASET_DIRS, DeviceLoader, dataset_dir, PackedDataset, augment_batch, load_images, packed_path
 from Scheduler import GradualWarmupScheduler
 from skimage import io
 import os
@@ -29,6 +42,15 @@ model_dict = {
     'UNet_Baseline': UNet_Baseline,
 }
 
+# models whose KAN stages are sized from the resolution
+RESOLUTION_MODELS = ['UMLP', 'UKan_Hybrid']
+
+
+def build_model(modelConfig: Dict, dropout):
+    kwargs = {"img_size": modelConfig.get("img_size", 64)} if modelConfig["model"] in RESOLUTION_MODELS else {}
+    return model_dict[modelConfig["model"]](T=modelConfig["T"], ch=modelConfig["channel"], ch_mult=modelConfig["channel_mult"], attn=modelConfig["attn"],
+                                            num_res_blocks=modelConfig["num_res_blocks"], dropout=dropout, **kwargs)
+
 class UnlabeledDataset(Dataset):
     def __init__(self, folder, transform=None, repeat_n=1):
         self.folder = folder
@@ -48,97 +70,208 @@ class UnlabeledDataset(Dataset):
         return image, torch.Tensor([0])
 
 
+def build_dataloader(modelConfig: Dict, device, rank=0, world_size=1):
+    # (loader, DistributedSampler or None) for modelConfig["data_format"]; under DDP batch_size is per process
+    data_format = modelConfig.get("data_format", "png")
+    sampler = None
+    if data_format == "device":
+        # the whole uint8 dataset is one device tensor; batches are indexed, flipped and normalised there
+        images = load_images(dataset_dir(modelConfig["dataset"], modelConfig.get("img_size", 64)), device)
+        dataloader = DeviceLoader(images, modelConfig["batch_size"], rank=rank, world_size=world_size, seed=modelConfig["seed"])
+    else:
+        if data_format == "packed":
+            # uint8 images from a memory map; flips and normalisation run per batch on the device
+            dataset = PackedDataset(packed_path(dataset_dir(modelConfig["dataset"], modelConfig.get("img_size", 64))))
+        else:
+            transform = Compose([
+                ToTensor(),
+                transforms.RandomHorizontalFlip(),
+                transforms.RandomVerticalFlip(),
+                Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+                ])
+            dataset = UnlabeledDataset(dataset_dir(modelConfig["dataset"], modelConfig.get("img_size", 64)), transform=transform, repeat_n=modelConfig["dataset_repeat"])
+        if is_distributed():
+            sampler = DistributedSampler(dataset, shuffle=True, drop_last=True, seed=modelConfig["seed"])
+        dataloader = DataLoader(
+            dataset, batch_size=modelConfig["batch_size"], shuffle=sampler is None, sampler=sampler, num_workers=modelConfig.get("num_workers", 4), drop_last=True, pin_memory=True,
+            persistent_workers=modelConfig.get("num_workers", 4) > 0)
+    return dataloader, sampler
+
+
+def prepare_batch(images, device, data_format):
+    # a loader batch as the float [-1, 1] x_0 on the device
+    if data_format == "device":
+        # already on the device and augmented
+        return images
+    x_0 = images.to(device, non_blocking=True)
+    if data_format == "packed":
+        x_0 = augment_batch(x_0)
+    return x_0
+
+
 def train(modelConfig: Dict):
+    rank, local_rank, world_size = init_distributed(modelConfig.get("dist_backend", "nccl"))
+    if modelConfig["device"].startswith("cuda") and world_size > 1:
+        torch.cuda.set_device(local_rank)
+        modelConfig["device"] = "cuda:{}".format(local_rank)
     device = torch.device(modelConfig["device"])
-    log_print = True
+    main_process = rank == 0
+    # only rank 0 logs, checkpoints and samples
+    log_print = main_process
     if log_print:
-        file = open(modelConfig["save_weight_dir"]+'log.txt', "w")
+        # prints are queued and written by a background thread
+        file = AsyncLogFile(open(modelConfig["save_weight_dir"]+'log.txt', "w"))
         sys.stdout = file
-    transform = Compose([
-        ToTensor(),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomVerticalFlip(),
-        Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
-        ])
-
-    if modelConfig["dataset"] == 'cvc':
-        dataset = UnlabeledDataset('data/cvc/images_64/', transform=transform, repeat_n=modelConfig["dataset_repeat"])
-    elif modelConfig["dataset"] == 'glas':
-        dataset = UnlabeledDataset('data/glas/images_64/', transform=transform, repeat_n=modelConfig["dataset_repeat"])
-    elif modelConfig["dataset"] == 'glas_resize':
-        dataset = UnlabeledDataset('data/glas/images_64_resize/', transform=transform, repeat_n=modelConfig["dataset_repeat"])
-    elif modelConfig["dataset"] == 'busi':
-        dataset = UnlabeledDataset('data/busi/images_64/', transform=transform, repeat_n=modelConfig["dataset_repeat"])
-    else:
+
+    if modelConfig["dataset"] not in DATASET_DIRS:
         raise ValueError('dataset not found')
+    data_format = modelConfig.get("data_format", "png")
 
-    print('modelConfig: ')
-    for key, value in modelConfig.items():
-        print(key, ' : ', value)
-        
-    dataloader = DataLoader(
-        dataset, batch_size=modelConfig["batch_size"], shuffle=True, num_workers=4, drop_last=True, pin_memory=True)
+    if main_process:
+        print('modelConfig: ')
+        for key, value in modelConfig.items():
+            print(key, ' : ', value)
+
+    dataloader, sampler = build_dataloader(modelConfig, device, rank, world_size)
     
-    print('Using {}'.format(modelConfig["model"]))
+    if main_process:
+        print('Using {}'.format(modelConfig["model"]))
     # model setup
-    net_model =model_dict[modelConfig["model"]](T=modelConfig["T"], ch=modelConfig["channel"], ch_mult=modelConfig["channel_mult"], attn=modelConfig["attn"],
-                    num_res_blocks=modelConfig["num_res_blocks"], dropout=modelConfig["dropout"]).to(device)
+    set_default_solver(modelConfig.get("kan_solver", "lstsq"))
+    set_default_backend(modelConfig.get("kan_backend", "reference"))
+    with kan_init(modelConfig.get("kan_init", "solve")):
+        net_model = build_model(modelConfig, modelConfig["dropout"]).to(device)
 
     if modelConfig["training_load_weight"] is not None:
         net_model.load_state_dict(torch.load(os.path.join(
             modelConfig["save_weight_dir"], modelConfig["training_load_weight"]), map_location=device))
         
+    # lr is used as given, as in Seg_UKAN/train.py; lr_scaling opts into scaling it to the global batch
+    accumulation_steps = max(modelConfig.get("accumulation_steps", 1), 1)
+    lr = scale_lr(modelConfig["lr"], modelConfig["batch_size"] * accumulation_steps * world_size, modelConfig["batch_size"],
+                  modelConfig.get("lr_scaling", "none"))
     optimizer = torch.optim.AdamW(
-        net_model.parameters(), lr=modelConfig["lr"], weight_decay=1e-4)
+        net_model.parameters(), lr=lr, weight_decay=1e-4)
     cosineScheduler = optim.lr_scheduler.CosineAnnealingLR(
         optimizer=optimizer, T_max=modelConfig["epoch"], eta_min=0, last_epoch=-1)
     warmUpScheduler = GradualWarmupScheduler(
         optimizer=optimizer, multiplier=modelConfig["multiplier"], warm_epoch=modelConfig["epoch"] // 10, after_scheduler=cosineScheduler)
 
+    t_max = modelConfig.get("t_max", -1)
+    timestep_sampler = build_timestep_sampler(modelConfig.get("timestep_sampler", "uniform"), modelConfig["T"],
+                                              modelConfig.get("t_min", 0), t_max if t_max > 0 else None)
     trainer = GaussianDiffusionTrainer(
-        net_model, modelConfig["beta_1"], modelConfig["beta_T"], modelConfig["T"]).to(device)
+        net_model, modelConfig["beta_1"], modelConfig["beta_T"], modelConfig["T"], timestep_sampler=timestep_sampler,
+        schedule=modelConfig.get("schedule", "linear"), parameterization=modelConfig.get("parameterization", "eps"),
+        loss_weighting=modelConfig.get("loss_weighting", "none"), snr_gamma=modelConfig.get("snr_gamma", 5.)).to(device)
+    if is_distributed():
+        # independent timesteps and noise per rank
+        trainer.generator = torch.Generator(device=device).manual_seed(modelConfig["seed"] + rank)
+        # DDP all-reduces gradient buckets while backward is still running
+        trainer = DDP(trainer, device_ids=[local_rank] if device.type == "cuda" else None,
+                      bucket_cap_mb=modelConfig.get("bucket_cap_mb", 25), gradient_as_bucket_view=True)
+    # checkpoints are still saved from net_model, which the DDP / compiled trainer shares
+    if modelConfig.get("compile", False):
+        trainer = compile_model(trainer, modelConfig["compile_mode"], modelConfig["compile_dynamic"])
+
+    profiler = StepProfiler(device, enabled=modelConfig.get("profile", False),
+                            trace_dir=os.path.join(modelConfig["save_weight_dir"], "trace") if main_process else None,
+                            trace_steps=modelConfig.get("profile_trace", 0))
+    if main_process:
+        profile_file = open(os.path.join(modelConfig["save_weight_dir"], "profile.csv"), "w")
+        profile_file.write(",".join(["epoch"] + list(profiler.summary())) + "\n")
+        timestep_file = open(os.path.join(modelConfig["save_weight_dir"], "timesteps.csv"), "w")
+
+    # losses stay on the device and are read back every log_every steps
+    loss_meter = DeviceLossMeter(modelConfig.get("log_every", 20))
 
     # start training
     for e in range(1,modelConfig["epoch"]+1):
-        with tqdm(dataloader, dynamic_ncols=True) as tqdmDataLoader:
-            for images, labels in tqdmDataLoader:
+        if sampler is not None:
+            sampler.set_epoch(e)
+        if data_format == "device":
+            dataloader.set_epoch(e)
+        num_batches = len(dataloader)
+        optimizer.zero_grad()
+        profiler.reset()
+        with tqdm(profiler.iterate(dataloader), total=num_batches, dynamic_ncols=True, disable=not main_process) as tqdmDataLoader:
+            for i, (images, labels) in enumerate(tqdmDataLoader):
                 # train
-                optimizer.zero_grad()
-                x_0 = images.to(device)
-                
-                loss = trainer(x_0).sum() / 1000.
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(
-                    net_model.parameters(), modelConfig["grad_clip"])
-                optimizer.step()
-                tqdmDataLoader.set_postfix(ordered_dict={
-                    "epoch": e,
-                    "loss: ": loss.item(),
-                    "img shape: ": x_0.shape,
-                    "LR": optimizer.state_dict()['param_groups'][0]["lr"]
-                })
-                # print version
-                if log_print:
-                    print("epoch: ", e, "loss: ", loss.item(), "img shape: ", x_0.shape, "LR: ", optimizer.state_dict()['param_groups'][0]["lr"])
+                with profiler.phase("data"):
+                    x_0 = prepare_batch(images, device, data_format)
+                # the last accumulation window of an epoch may hold fewer micro-batches
+                window = min(accumulation_steps, num_batches - i // accumulation_steps * accumulation_steps)
+                step_now = (i + 1) % accumulation_steps == 0 or i + 1 == num_batches
+                # under DDP, only the last micro-batch of a window all-reduces gradients
+                sync_context = trainer.no_sync() if is_distributed() and not step_now else nullcontext()
+
+                with sync_context:
+                    with profiler.phase("forward"):
+                        loss = trainer(x_0).sum() / 1000.
+                    with profiler.phase("backward"):
+                        (loss / window).backward()
+                if step_now:
+                    with profiler.phase("optimizer"):
+                        torch.nn.utils.clip_grad_norm_(
+                            net_model.parameters(), modelConfig["grad_clip"])
+                        optimizer.step()
+                        optimizer.zero_grad()
+                with profiler.phase("metric"):
+                    # only rank 0 reports, the other ranks never sync for the loss
+                    avg_loss = loss_meter.update(loss) if main_process else None
+                    if avg_loss is None and main_process and i + 1 == num_batches:
+                        avg_loss = loss_meter.read()
+                    if avg_loss is not None:
+                        lr = optimizer.param_groups[0]["lr"]
+                        tqdmDataLoader.set_postfix(ordered_dict={
+                            "epoch": e,
+                            "loss: ": avg_loss,
+                            "img shape: ": x_0.shape,
+                            "LR": lr
+                        })
+                        # print version
+                        if log_print:
+                            print("epoch: ", e, "loss: ", avg_loss, "img shape: ", x_0.shape, "LR: ", lr)
+                profiler.step(x_0.shape[0])
         warmUpScheduler.step()
+        if main_process:
+            stats = profiler.summary()
+            print("epoch: ", e, "profile: ", ", ".join("{}: {:.2f}".format(k, v) for k, v in stats.items()))
+            profile_file.write(",".join([str(e)] + ["{:.4f}".format(v) for v in stats.values()]) + "\n")
+            profile_file.flush()
+            # per-t loss of this epoch and the current proposal, in bins of T / 10
+            t_stats = timestep_sampler.stats()
+            if e == 1:
+                timestep_file.write(",".join(["epoch"] + list(t_stats)) + "\n")
+            timestep_file.write(",".join([str(e)] + ["{:.6f}".format(v) for v in t_stats.values()]) + "\n")
+            timestep_file.flush()
         if e % 50 ==0:
-            torch.save(net_model.state_dict(), os.path.join(
-                modelConfig["save_weight_dir"], 'ckpt_' + str(e) + "_.pt"))
-            modelConfig['test_load_weight'] = 'ckpt_{}_.pt'.format(e)
-            eval_tmp(modelConfig, e)
+            if main_process:
+                torch.save(net_model.state_dict(), os.path.join(
+                    modelConfig["save_weight_dir"], 'ckpt_' + str(e) + "_.pt"))
+                modelConfig['test_load_weight'] = 'ckpt_{}_.pt'.format(e)
+                eval_tmp(modelConfig, e)
+            # the other ranks wait while rank 0 samples
+            barrier()
 
-    torch.save(net_model.state_dict(), os.path.join(
-        modelConfig["save_weight_dir"], 'ckpt_' + str(e) + "_.pt"))
+    profiler.close()
+    if main_process:
+        profile_file.close()
+        timestep_file.close()
+        torch.save(net_model.state_dict(), os.path.join(
+            modelConfig["save_weight_dir"], 'ckpt_' + str(e) + "_.pt"))
     if log_print:
-        file.close()
         sys.stdout = sys.__stdout__
+        file.close()
     
 def eval_tmp(modelConfig: Dict, nme: int):
     # load model and evaluate
     with torch.no_grad():
         device = torch.device(modelConfig["device"])
-        model = model_dict[modelConfig["model"]](T=modelConfig["T"], ch=modelConfig["channel"], ch_mult=modelConfig["channel_mult"], attn=modelConfig["attn"],
-                     num_res_blocks=modelConfig["num_res_blocks"], dropout=0.)
+        # the checkpoint overwrites every KAN parameter, so skip the initial spline fit
+        set_default_backend(modelConfig.get("kan_backend", "reference"))
+        with kan_init("skip"):
+            model = build_model(modelConfig, 0.)
         ckpt = torch.load(os.path.join(
             modelConfig["save_weight_dir"], modelConfig["test_load_weight"]), map_location=device)
     
@@ -146,8 +279,7 @@ def eval_tmp(modelConfig: Dict, nme: int):
         
         print("model load weight done.")
         model.eval()
-        sampler = GaussianDiffusionSampler(
-            model, modelConfig["beta_1"], modelConfig["beta_T"], modelConfig["T"]).to(device)
+        sampler = build_sampler(model, modelConfig).to(device)
         # Sampled from standard normal distribution
         noisyImage = torch.randn(
             size=[modelConfig["batch_size"], 3, modelConfig["img_size"], modelConfig["img_size"]], device=device)
@@ -165,22 +297,42 @@ def eval_tmp(modelConfig: Dict, nme: int):
             os.remove(os.path.join(
                 modelConfig["save_weight_dir"], modelConfig["test_load_weight"]))
 
+def build_sampler(model, modelConfig: Dict):
+    # the sampler must use the schedule and parameterization the model was trained with
+    if modelConfig.get("sampler", "ddpm") == "ddim":
+        return DDIMSampler(
+            model, modelConfig.get("beta_1", 1e-4), modelConfig.get("beta_T", 0.02), modelConfig["T"],
+            steps=modelConfig.get("sample_steps", 50), eta=modelConfig.get("ddim_eta", 0.),
+            schedule=modelConfig.get("schedule", "linear"), parameterization=modelConfig.get("parameterization", "eps"))
+    sampler = GaussianDiffusionSampler(
+        model, modelConfig.get("beta_1", 1e-4), modelConfig.get("beta_T", 0.02), modelConfig["T"],
+        schedule=modelConfig.get("schedule", "linear"), parameterization=modelConfig.get("parameterization", "eps"))
+    if modelConfig.get("executor", "none") != "none":
+        # same samples, with the T steps replayed from static buffers (CUDA graphs) or run eagerly
+        sampler = SamplingExecutor(sampler, mode=modelConfig["executor"])
+    return sampler
+
+def load_model(modelConfig: Dict):
+    # build the model and load modelConfig["test_load_weight"] for sampling
+    device = torch.device(modelConfig["device"])
+
+    set_default_backend(modelConfig.get("kan_backend", "reference"))
+    with kan_init("skip"):
+        model = build_model(modelConfig, modelConfig["dropout"]).to(device)
+
+    ckpt = torch.load(os.path.join(
+        modelConfig["save_weight_dir"], modelConfig["test_load_weight"]), map_location=device)
+
+    model.load_state_dict(ckpt)
+    print("model load weight done.")
+    return model.eval()
+
 def eval(modelConfig: Dict):
     # load model and evaluate
     with torch.no_grad():
         device = torch.device(modelConfig["device"])
-
-        model = model_dict[modelConfig["model"]](T=modelConfig["T"], ch=modelConfig["channel"], ch_mult=modelConfig["channel_mult"], attn=modelConfig["attn"],
-                    num_res_blocks=modelConfig["num_res_blocks"], dropout=modelConfig["dropout"]).to(device)
-    
-        ckpt = torch.load(os.path.join(
-            modelConfig["save_weight_dir"], modelConfig["test_load_weight"]), map_location=device)
-
-        model.load_state_dict(ckpt)
-        print("model load weight done.")
-        model.eval()
-        sampler = GaussianDiffusionSampler(
-            model, modelConfig["beta_1"], modelConfig["beta_T"], modelConfig["T"]).to(device)
+        model = load_model(modelConfig)
+        sampler = build_sampler(model, modelConfig).to(device)
         # Sampled from standard normal distribution
         noisyImage = torch.randn(
             size=[modelConfig["batch_size"], 3, modelConfig["img_size"], modelConfig["img_size"]], device=device)     
@@ -193,3 +345,24 @@ def eval(modelConfig: Dict):
         for i, image in enumerate(sampledImgs):
     
             save_image(image, os.path.join(modelConfig["sampled_dir"],  modelConfig["sampledImgName"].replace('.png','_{}.png').format(i)), nrow=modelConfig["nrow"])
+
+def eval_metrics(modelConfig: Dict):
+    # sample modelConfig["num_eval_samples"] images straight into IS/FID/KID, without PNGs unless eval_save_images
+    with torch.no_grad():
+        device = torch.device(modelConfig["device"])
+        model = load_model(modelConfig)
+        sampler = build_sampler(model, modelConfig).to(device)
+        metrics = [
+            GenerativeMetrics(modelConfig["dataset"], device, weights=modelConfig.get("fid_weights"), img_size=modelConfig["img_size"]),
+            InceptionScore(device, weights=modelConfig.get("is_weights")),
+        ]
+        batches = sample_batches(sampler, modelConfig["num_eval_samples"], modelConfig["batch_size"],
+                                 modelConfig["img_size"], device)
+        save_dir = modelConfig["sampled_dir"] if modelConfig.get("eval_save_images", False) else None
+        scores = evaluate_stream(batches, metrics, device, save_dir=save_dir)
+
+    print('FID %.3f  KID %.5f +- %.5f  IS %.3f +- %.3f  (%d images)' % (
+        scores['fid'], scores['kid'], scores['kid_std'], scores['is'], scores['is_std'], scores['num_samples']))
+    with open(os.path.join(os.path.dirname(os.path.normpath(modelConfig["sampled_dir"])), 'metrics.json'), 'w') as f:
+        json.dump(dict(scores, test_load_weight=modelConfig["test_load_weight"]), f, indent=2)
+    return scores
@@ -1,4 +1,6 @@
 import argparse
+import queue
+import threading
 import torch.nn as nn
 
 class qkv_transform(nn.Conv1d):
@@ -34,3 +36,88 @@ class AverageMeter(object):
         self.sum += val * n
         self.count += n
         self.avg = self.sum / self.count
+
+
+class DeviceLossMeter(object):
+    """Sums losses on their device and reads them back only every ``sync_every`` updates.
+
+    ``update`` returns the mean loss since the last read when it syncs and
+    None otherwise, so the training step never waits on ``.item()``.
+    """
+
+    def __init__(self, sync_every=20):
+        self.sync_every = max(sync_every, 1)
+        self.reset()
+
+    def reset(self):
+        self.sum = None
+        self.count = 0
+
+    def update(self, loss):
+        loss = loss.detach()
+        self.sum = loss.clone() if self.sum is None else self.sum.add_(loss)
+        self.count += 1
+        if self.count >= self.sync_every:
+            return self.read()
+        return None
+
+    def read(self):
+        """Mean of the pending losses (one host sync), None if there are none."""
+        if self.count == 0:
+            return None
+        avg = self.sum.item() / self.count
+        self.reset()
+        return avg
+
+
+class AsyncLogFile(object):
+    """File-like wrapper whose writes are done by a background thread.
+
+    ``write`` only appends to a queue, so ``print`` to a redirected stdout does
+    not block the training loop on disk I/O. The file is flushed every
+    ``flush_every`` writes and after a second without writes; ``close``
+    drains the queue.
+    """
+
+    def __init__(self, file, flush_every=50):
+        self.file = file
+        self.flush_every = flush_every
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        pending = 0
+        while True:
+            try:
+                text = self.queue.get(timeout=1.)
+            except queue.Empty:
+                # idle: make what was written so far visible
+                if pending:
+                    self.file.flush()
+                    pending = 0
+                continue
+            if text is None:
+                break
+            self.file.write(text)
+            pending += 1
+            if pending >= self.flush_every:
+                self.file.flush()
+                pending = 0
+        self.file.flush()
+
+    def write(self, text):
+        self.queue.put(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
@@ -1,4 +1,5 @@
-from Diffusion.Train import train, eval
+from Diffusion.Train import train, eval, eval_metrics
+from kan_core.dist_utils import is_main_process, cleanup
 import os
 import argparse
 import torch
@@ -10,11 +11,20 @@ def main(model_config = None):
         modelConfig = model_config
     if modelConfig["state"] == "train":
         train(modelConfig)
+        # final sampling runs on rank 0 only
+        if not is_main_process():
+            cleanup()
+            return
         modelConfig['batch_size'] = 64
         modelConfig['test_load_weight'] = 'ckpt_{}_.pt'.format(modelConfig['epoch'])
+        if modelConfig["eval_metrics"]:
+            eval_metrics(modelConfig)
+            return
         for i in range(32):
             modelConfig["sampledImgName"] = "sampledImgName{}.png".format(i)
             eval(modelConfig)
+    elif modelConfig["eval_metrics"]:
+        eval_metrics(modelConfig)
     else:
         for i in range(32):
             modelConfig["sampledImgName"] = "sampledImgName{}.png".format(i)
@@ -40,13 +50,47 @@ if __name__ == '__main__':
     parser.add_argument('--num_res_blocks', type=int, default=2)
     parser.add_argument('--dropout', type=float, default=0.15)
     parser.add_argument('--lr', type=float, default=2e-4)
-    parser.add_argument('--img_size', type=float, default=64) 
+    parser.add_argument('--img_size', type=int, default=64) # 64, 128, 256: trains on data/<dataset>/images_<img_size>
     parser.add_argument('--dataset_repeat', type=int, default=1) # did not use
     parser.add_argument('--seed', type=int, default=0) # did not use
     parser.add_argument('--model', type=str, default='UKAN_Hybrid')
     parser.add_argument('--exp_nme', type=str, default='UKAN_Hybrid')
     parser.add_argument('--save_root', type=str, default='./Output/') 
+    parser.add_argument('--compile', action='store_true') # torch.compile the training step
+    parser.add_argument('--compile_mode', type=str, default='default') # default, reduce-overhead, max-autotune
+    parser.add_argument('--compile_dynamic', type=str, default='auto') # auto, true, false
+    parser.add_argument('--device', type=str, default='cuda') # cuda or cpu
+    parser.add_argument('--dist_backend', type=str, default='nccl') # nccl, or gloo for CPU runs under torchrun
+    parser.add_argument('--lr_scaling', type=str, default='none') # none, linear or sqrt: lr vs. global batch (batch_size * accumulation_steps * processes)
+    parser.add_argument('--accumulation_steps', type=int, default=1) # micro-batches per optimizer step
+    parser.add_argument('--kan_init', type=str, default='solve') # solve (lstsq fit) or analytic (same fit, one pseudo-inverse)
+    parser.add_argument('--kan_solver', type=str, default='lstsq') # lstsq or cholesky, for KANLinear init
+    parser.add_argument('--kan_backend', type=str, default='reference') # KANLinear forward: reference, uniform, fused or sparse (inference only)
+    parser.add_argument('--profile', action='store_true') # time data/forward/backward/optimizer phases, writes profile.csv
+    parser.add_argument('--profile_trace', type=int, default=0) # steps of torch.profiler trace, 0 disables
+    parser.add_argument('--data_format', type=str, default='png') # png, packed (data/<dataset>/images_<img_size>.npy from tools/pack_dataset.py) or device (whole dataset on the device)
+    parser.add_argument('--num_workers', type=int, default=4) # DataLoader processes
+    parser.add_argument('--timestep_sampler', type=str, default='uniform') # uniform, stratified or importance (loss-aware)
+    parser.add_argument('--t_min', type=int, default=0) # train on timesteps [t_min, t_max) only
+    parser.add_argument('--t_max', type=int, default=-1) # -1 for T
+    parser.add_argument('--schedule', type=str, default='linear') # noise schedule: linear, scaled_linear or cosine
+    parser.add_argument('--parameterization', type=str, default='eps') # network target: eps, x0 or v
+    parser.add_argument('--executor', type=str, default='none') # ddpm sampling: none, auto, graph (CUDA graphs) or eager
+    parser.add_argument('--sampler', type=str, default='ddpm') # ddpm (T steps) or ddim
+    parser.add_argument('--sample_steps', type=int, default=50) # steps of the ddim sampler; a distilled checkpoint needs its own count
+    parser.add_argument('--ddim_eta', type=float, default=0.) # 0 for deterministic ddim, 1 for ddpm-like noise
+    parser.add_argument('--loss_weighting', type=str, default='none') # none or min_snr
+    parser.add_argument('--snr_gamma', type=float, default=5.) # clamp of the min_snr weighting
+    parser.add_argument('--log_every', type=int, default=20) # steps between loss read-backs (host syncs) and log lines
+    parser.add_argument('--eval_metrics', action='store_true') # evaluate by streaming samples into IS/FID/KID instead of writing 32 batches of PNGs
+    parser.add_argument('--num_eval_samples', type=int, default=2048) # 32 batches of 64, as the PNG evaluation
+    parser.add_argument('--eval_save_images', action='store_true') # with --eval_metrics, also write the samples to Gens
+    parser.add_argument('--fid_weights', type=str, default=None) # local pt_inception-2015-12-05 state dict, required by --eval_metrics
+    parser.add_argument('--is_weights', type=str, default=None) # local torchvision inception_v3 state dict
     args = parser.parse_args()
+    if args.eval_metrics and args.fid_weights is None:
+        # checked here so a training run does not fail only at its final evaluation
+        parser.error('--eval_metrics requires --fid_weights (a local pt_inception-2015-12-05 state dict)')
 
     save_root = args.save_root
     if args.seed != 0:
@@ -67,9 +111,9 @@ if __name__ == '__main__':
         "multiplier": 2.,
         "beta_1": 1e-4,
         "beta_T": 0.02,
-        "img_size": 64,
+        "img_size": args.img_size,
         "grad_clip": 1.,
-        "device": "cuda", ### MAKE SURE YOU HAVE A GPU !!!
+        "device": args.device, ### MAKE SURE YOU HAVE A GPU !!!
         "training_load_weight": None,
         "save_weight_dir": os.path.join(save_root, args.exp_nme, "Weights"),
         "sampled_dir": os.path.join(save_root, args.exp_nme, "Gens"),
@@ -82,6 +126,36 @@ if __name__ == '__main__':
         "dataset_repeat": args.dataset_repeat,
         "seed": args.seed,
         "save_root": args.save_root,
+        "compile": args.compile,
+        "compile_mode": args.compile_mode,
+        "compile_dynamic": args.compile_dynamic,
+        "dist_backend": args.dist_backend,
+        "lr_scaling": args.lr_scaling,
+        "accumulation_steps": args.accumulation_steps,
+        "kan_init": args.kan_init,
+        "kan_solver": args.kan_solver,
+        "kan_backend": args.kan_backend,
+        "profile": args.profile,
+        "profile_trace": args.profile_trace,
+        "data_format": args.data_format,
+        "num_workers": args.num_workers,
+        "timestep_sampler": args.timestep_sampler,
+        "t_min": args.t_min,
+        "t_max": args.t_max,
+        "schedule": args.schedule,
+        "parameterization": args.parameterization,
+        "loss_weighting": args.loss_weighting,
+        "sampler": args.sampler,
+        "sample_steps": args.sample_steps,
+        "ddim_eta": args.ddim_eta,
+        "executor": args.executor,
+        "snr_gamma": args.snr_gamma,
+        "log_every": args.log_every,
+        "eval_metrics": args.eval_metrics,
+        "num_eval_samples": args.num_eval_samples,
+        "eval_save_images": args.eval_save_images,
+        "fid_weights": args.fid_weights,
+        "is_weights": args.is_weights,
         }
 
     os.makedirs(modelConfig["save_weight_dir"], exist_ok=True)
@@ -89,7 +163,9 @@ if __name__ == '__main__':
 
     # backup 
     import shutil
-    shutil.copy("Diffusion/Model_UKAN_Hybrid.py", os.path.join(save_root, args.exp_nme))
-    shutil.copy("Diffusion/Train.py", os.path.join(save_root, args.exp_nme))
+    if int(os.environ.get('RANK', 0)) == 0:
+        shutil.copy("Diffusion/Model_UKAN_Hybrid.py", os.path.join(save_root, args.exp_nme))
+        shutil.copy("Diffusion/Train.py", os.path.join(save_root, args.exp_nme))
 
     main(modelConfig)
+    cleanup()
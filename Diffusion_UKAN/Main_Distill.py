@@ -0,0 +1,87 @@
+from Diffusion.Distill import distill, evaluate_steps
+import os
+import argparse
+import torch
+import numpy as np
+
+
+def seed_all(args):
+    torch.manual_seed(args.seed)
+    torch.cuda.manual_seed_all(args.seed)
+    np.random.seed(args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state', type=str, default='train') # train (distill, then evaluate) or eval
+    parser.add_argument('--dataset', type=str, default='cvc') # busi, glas, cvc
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--lr', type=float, default=1e-4) # per round, decayed linearly to 0
+    parser.add_argument('--distill_iters', type=int, default=5000) # optimizer steps per round
+    parser.add_argument('--distill_start_steps', type=int, default=1000) # sampling steps of the first teacher
+    parser.add_argument('--distill_final_steps', type=int, default=4) # stop before a student would have fewer steps
+    parser.add_argument('--no_baseline', action='store_true') # skip plain DDIM with the teacher checkpoint in the evaluation
+    parser.add_argument('--num_eval_samples', type=int, default=2048)
+    parser.add_argument('--eval_batch_size', type=int, default=64)
+    parser.add_argument('--fid_weights', type=str, required=True) # local pt_inception-2015-12-05 state dict
+    parser.add_argument('--is_weights', type=str, default=None) # local torchvision inception_v3 state dict
+    parser.add_argument('--data_format', type=str, default='png') # png, packed or device, as in Main.py
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--log_every', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--seed', type=int, default=0)
+    # teacher checkpoint, as in Main.py
+    parser.add_argument('--model', type=str, default='UKan_Hybrid')
+    parser.add_argument('--save_root', type=str, default='./Output/')
+    parser.add_argument('--exp_nme', type=str, default='UKAN_Hybrid')
+    parser.add_argument('--test_load_weight', type=str, default='ckpt_1000_.pt')
+    parser.add_argument('--T', type=int, default=1000)
+    parser.add_argument('--channel', type=int, default=64)
+    parser.add_argument('--num_res_blocks', type=int, default=2)
+    parser.add_argument('--dropout', type=float, default=0.)
+    parser.add_argument('--img_size', type=int, default=64)
+    parser.add_argument('--schedule', type=str, default='linear') # linear, scaled_linear, cosine
+    parser.add_argument('--parameterization', type=str, default='eps') # eps, x0, v
+    parser.add_argument('--kan_backend', type=str, default='reference')
+    args = parser.parse_args()
+
+    seed_all(args)
+    modelConfig = {
+        "dataset": args.dataset,
+        "batch_size": args.batch_size,
+        "lr": args.lr,
+        "grad_clip": 1.,
+        "distill_iters": args.distill_iters,
+        "distill_start_steps": args.distill_start_steps,
+        "distill_final_steps": args.distill_final_steps,
+        "distill_eval_baseline": not args.no_baseline,
+        "num_eval_samples": args.num_eval_samples,
+        "fid_weights": args.fid_weights,
+        "is_weights": args.is_weights,
+        "data_format": args.data_format,
+        "num_workers": args.num_workers,
+        "dataset_repeat": 1,
+        "log_every": args.log_every,
+        "device": args.device,
+        "seed": args.seed,
+        "model": args.model,
+        "T": args.T,
+        "channel": args.channel,
+        "channel_mult": [1, 2, 3, 4],
+        "attn": [2],
+        "num_res_blocks": args.num_res_blocks,
+        "dropout": args.dropout,
+        "beta_1": 1e-4,
+        "beta_T": 0.02,
+        "img_size": args.img_size,
+        "schedule": args.schedule,
+        "parameterization": args.parameterization,
+        "kan_backend": args.kan_backend,
+        "save_weight_dir": os.path.join(args.save_root, args.exp_nme, "Weights"),
+        "test_load_weight": args.test_load_weight,
+    }
+
+    if args.state == 'train':
+        distill(modelConfig)
+    modelConfig["batch_size"] = args.eval_batch_size
+    evaluate_steps(modelConfig)
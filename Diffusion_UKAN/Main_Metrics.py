@@ -0,0 +1,100 @@
+from Diffusion.Train import build_sampler, load_model
+from Diffusion.Metrics import GenerativeMetrics, ImageFolder, InceptionScore, evaluate_stream, sample_batches
+from torch.utils.data import DataLoader
+import os
+import json
+import argparse
+import torch
+
+
+def folder_batches(folder, batch_size, num_workers):
+    loader = DataLoader(ImageFolder(folder), batch_size=batch_size, num_workers=num_workers)
+    for batch in loader:
+        yield batch * 2 - 1  # [0 ~ 1] -> [-1 ~ 1], as the sampler outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, default='cvc') # busi, glas, cvc
+    parser.add_argument('--gen_dir', type=str, default=None) # folder of generated images; samples from the checkpoint if not given
+    parser.add_argument('--num_samples', type=int, default=2048) # samples drawn from the checkpoint
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--fid_weights', type=str, required=True) # local pt_inception-2015-12-05 state dict
+    parser.add_argument('--stats_dir', type=str, default='data/fid_stats') # cache of real-image statistics
+    parser.add_argument('--kid_subsets', type=int, default=100)
+    parser.add_argument('--kid_subset_size', type=int, default=1000)
+    parser.add_argument('--inception_score', action='store_true') # also compute IS
+    parser.add_argument('--is_weights', type=str, default=None) # local torchvision inception_v3 state dict
+    parser.add_argument('--is_splits', type=int, default=10)
+    parser.add_argument('--save_dir', type=str, default=None) # also write the checkpoint samples as PNGs here
+    parser.add_argument('--queue_size', type=int, default=2) # batches sampled ahead of the metrics
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--out', type=str, default=None) # json file for the scores
+    parser.add_argument('--device', type=str, default='cuda')
+    # checkpoint, as in Main.py
+    parser.add_argument('--model', type=str, default='UKan_Hybrid')
+    parser.add_argument('--save_root', type=str, default='./Output/')
+    parser.add_argument('--exp_nme', type=str, default='UKAN_Hybrid')
+    parser.add_argument('--test_load_weight', type=str, default='ckpt_1000_.pt')
+    parser.add_argument('--T', type=int, default=1000)
+    parser.add_argument('--img_size', type=int, default=64) # also selects the real images_<img_size> set
+    parser.add_argument('--beta_1', type=float, default=1e-4)
+    parser.add_argument('--beta_T', type=float, default=0.02)
+    parser.add_argument('--schedule', type=str, default='linear') # linear, scaled_linear, cosine
+    parser.add_argument('--parameterization', type=str, default='eps') # eps, x0, v
+    parser.add_argument('--channel', type=int, default=64)
+    parser.add_argument('--num_res_blocks', type=int, default=2)
+    parser.add_argument('--dropout', type=float, default=0.15)
+    parser.add_argument('--executor', type=str, default='none') # ddpm sampling: none, auto, graph (CUDA graphs) or eager
+    parser.add_argument('--sampler', type=str, default='ddpm') # ddpm (T steps) or ddim
+    parser.add_argument('--sample_steps', type=int, default=50) # steps of the ddim sampler; a distilled checkpoint needs its own count
+    parser.add_argument('--ddim_eta', type=float, default=0.) # 0 for deterministic ddim, 1 for ddpm-like noise
+    parser.add_argument('--kan_backend', type=str, default='reference')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    metrics = [GenerativeMetrics(args.dataset, args.device, weights=args.fid_weights, stats_dir=args.stats_dir,
+                                 kid_subsets=args.kid_subsets, kid_subset_size=args.kid_subset_size,
+                                 num_workers=args.num_workers, img_size=args.img_size)]
+    if args.inception_score:
+        metrics.append(InceptionScore(args.device, weights=args.is_weights, splits=args.is_splits))
+
+    save_dir = None
+    if args.gen_dir is not None:
+        batches = folder_batches(args.gen_dir, args.batch_size, args.num_workers)
+    else:
+        modelConfig = {
+            "model": args.model,
+            "T": args.T,
+            "img_size": args.img_size,
+            "beta_1": args.beta_1,
+            "beta_T": args.beta_T,
+            "schedule": args.schedule,
+            "parameterization": args.parameterization,
+            "channel": args.channel,
+            "channel_mult": [1, 2, 3, 4],
+            "attn": [2],
+            "num_res_blocks": args.num_res_blocks,
+            "dropout": args.dropout,
+            "device": args.device,
+            "save_weight_dir": os.path.join(args.save_root, args.exp_nme, "Weights"),
+            "test_load_weight": args.test_load_weight,
+            "kan_backend": args.kan_backend,
+            "sampler": args.sampler,
+            "sample_steps": args.sample_steps,
+            "ddim_eta": args.ddim_eta,
+            "executor": args.executor,
+        }
+        sampler = build_sampler(load_model(modelConfig), modelConfig).to(args.device)
+        batches = sample_batches(sampler, args.num_samples, args.batch_size, args.img_size, args.device)
+        save_dir = args.save_dir
+
+    scores = evaluate_stream(batches, metrics, args.device, save_dir=save_dir, queue_size=args.queue_size)
+    line = 'FID %.3f  KID %.5f +- %.5f' % (scores['fid'], scores['kid'], scores['kid_std'])
+    if args.inception_score:
+        line += '  IS %.3f +- %.3f' % (scores['is'], scores['is_std'])
+    print(line + '  (%d images)' % scores['num_samples'])
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(dict(scores, dataset=args.dataset, gen_dir=args.gen_dir), f, indent=2)
@@ -40,7 +40,7 @@ if __name__ == '__main__':
     parser.add_argument('--num_res_blocks', type=int, default=2)
     parser.add_argument('--dropout', type=float, default=0.15)
     parser.add_argument('--lr', type=float, default=1e-4)
-    parser.add_argument('--img_size', type=float, default=64) # 64 or 128
+    parser.add_argument('--img_size', type=int, default=64) # 64 or 128
     parser.add_argument('--dataset_repeat', type=int, default=1) # didnot use
     parser.add_argument('--seed', type=int, default=0) 
     parser.add_argument('--model', type=str, default='UKan_Hybrid')
@@ -70,7 +70,7 @@ if __name__ == '__main__':
         "multiplier": 2.,
         "beta_1": 1e-4,
         "beta_T": 0.02,
-        "img_size": 64,
+        "img_size": args.img_size,
         "grad_clip": 1.,
         "device": "cuda", ### MAKE SURE YOU HAVE A GPU !!!
         "training_load_weight": None,
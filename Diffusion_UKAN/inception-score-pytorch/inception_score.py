@@ -1,82 +1,102 @@
 import torch
-from torch import nn
-from torch.autograd import Variable
 from torch.nn import functional as F
 import torch.utils.data
 from torchvision.models.inception import inception_v3
 import os
 from skimage import io
-import cv2
-import os
-import numpy as np
-from scipy.stats import entropy
-import torchvision.datasets as dset
 import torchvision.transforms as transforms
 
 import argparse
-def inception_score(imgs, cuda=True, batch_size=32, resize=False, splits=32):
+
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def load_inception(device='cuda', weights=None):
+    """Inception v3 in eval mode.
+
+    weights -- path to a local torchvision inception_v3 state dict; the
+               torchvision ImageNet weights are downloaded when None
+    """
+    if weights is None:
+        model = inception_v3(weights='IMAGENET1K_V1', transform_input=False)
+    else:
+        model = inception_v3(weights=None, aux_logits=True, transform_input=False, init_weights=False)
+        model.load_state_dict(torch.load(weights, map_location='cpu'))
+    return model.to(device).eval()
+
+
+@torch.no_grad()
+def inception_probs(model, x, resize=False):
+    """Class probabilities (float64) of a batch of images in [-1, 1]."""
+    if resize:
+        x = F.interpolate(x, size=(299, 299), mode='bilinear', align_corners=False)
+    return F.softmax(model(x), dim=1).double()
+
+
+def split_scores(preds, splits):
+    """exp(E[KL(p(y|x) || p(y))]) of each split of the (N, 1000) predictions.
+
+    Like the scipy version this drops the last N % splits predictions and
+    renormalizes p(y|x) and p(y) before taking the KL.
+    """
+    n = preds.size(0) // splits
+    part = preds[:splits * n].view(splits, n, -1)
+    pyx = part / part.sum(dim=2, keepdim=True)
+    py = part.mean(dim=1, keepdim=True)
+    py = py / py.sum(dim=2, keepdim=True)
+    kl = (torch.special.xlogy(pyx, pyx) - torch.special.xlogy(pyx, py)).sum(dim=2)
+    return kl.mean(dim=1).exp()
+
+
+def inception_score(imgs, cuda=True, batch_size=32, resize=False, splits=32, device=None,
+                    num_workers=4, weights=None):
     """Computes the inception score of the generated images imgs
 
     imgs -- Torch dataset of (3xHxW) numpy images normalized in the range [-1, 1]
-    cuda -- whether or not to run on GPU
+    cuda -- whether or not to run on GPU, ignored if device is given
     batch_size -- batch size for feeding into Inception v3
     splits -- number of splits
+    device -- torch device, e.g. 'cpu' or 'cuda:1'
+    num_workers -- loader processes that decode the next batches while Inception runs
+    weights -- local inception_v3 state dict, see load_inception
     """
     N = len(imgs)
 
     assert batch_size > 0
     assert N > batch_size
 
-    # Set up dtype
-    if cuda:
-        dtype = torch.cuda.FloatTensor
-    else:
-        if torch.cuda.is_available():
-            print("WARNING: You have a CUDA device, so you should probably set cuda=True")
-        dtype = torch.FloatTensor
+    if device is None:
+        device = 'cuda' if cuda else 'cpu'
+    device = torch.device(device)
+    if device.type == 'cpu' and torch.cuda.is_available():
+        print("WARNING: You have a CUDA device, so you should probably set cuda=True")
 
     # Set up dataloader
-    dataloader = torch.utils.data.DataLoader(imgs, batch_size=batch_size)
+    dataloader = torch.utils.data.DataLoader(
+        imgs, batch_size=batch_size, num_workers=num_workers, pin_memory=device.type == 'cuda',
+        prefetch_factor=2 if num_workers > 0 else None)
 
     # Load inception model
-    inception_model = inception_v3(pretrained=True, transform_input=False).type(dtype)
-    inception_model.eval();
-    up = nn.Upsample(size=(299, 299), mode='bilinear').type(dtype)
-    def get_pred(x):
-        if resize:
-            x = up(x)
-        x = inception_model(x)
-        return F.softmax(x).data.cpu().numpy()
+    inception_model = load_inception(device, weights)
 
     # Get predictions
-    preds = np.zeros((N, 1000))
-
-    for i, batch in enumerate(dataloader, 0):
-        batch = batch.type(dtype)
-        batchv = Variable(batch)
-        batch_size_i = batch.size()[0]
-
-        preds[i*batch_size:i*batch_size + batch_size_i] = get_pred(batchv)
+    preds = torch.zeros((N, 1000), dtype=torch.float64, device=device)
+    start = 0
+    for batch in dataloader:
+        batch = batch.to(device, torch.float32, non_blocking=True)
+        preds[start:start + batch.size(0)] = inception_probs(inception_model, batch, resize)
+        start += batch.size(0)
 
     # Now compute the mean kl-div
-    split_scores = []
+    scores = split_scores(preds, splits)
 
-    for k in range(splits):
-        part = preds[k * (N // splits): (k+1) * (N // splits), :]
-        py = np.mean(part, axis=0)
-        scores = []
-        for i in range(part.shape[0]):
-            pyx = part[i, :]
-            scores.append(entropy(pyx, py))
-        split_scores.append(np.exp(np.mean(scores)))
-
-    return np.mean(split_scores), np.std(split_scores)
+    return scores.mean().item(), scores.std(unbiased=False).item()
 
 class UnlabeledDataset(torch.utils.data.Dataset):
     def __init__(self, folder, transform=None):
         self.folder = folder
         self.transform = transform
-        self.image_files = os.listdir(folder)
+        self.image_files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMG_EXTENSIONS))
 
     def __len__(self):
         return len(self.image_files)
@@ -89,7 +109,7 @@ class UnlabeledDataset(torch.utils.data.Dataset):
         if self.transform:
             image = self.transform(image)
         return image
-    
+
 class IgnoreLabelDataset(torch.utils.data.Dataset):
     def __init__(self, orig):
         self.orig = orig
@@ -120,12 +140,16 @@ if __name__ == '__main__':
     # set args
     parser = argparse.ArgumentParser()
     parser.add_argument('--data-root', type=str, default='/data/wyli/code/TinyDDPM/Output/unet_busi/Gens/')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--splits', type=int, default=10)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--weights', type=str, default=None, help='local inception_v3 state dict (no download)')
 
     args = parser.parse_args()
 
     dataset = UnlabeledDataset(args.data_root, transform=transform)
-    
-    print ("Calculating Inception Score...")
-    print (inception_score(dataset, cuda=True, batch_size=1, resize=True, splits=10))
-
 
+    print ("Calculating Inception Score...")
+    print (inception_score(dataset, batch_size=args.batch_size, resize=True, splits=args.splits,
+                           device=args.device, num_workers=args.num_workers, weights=args.weights))
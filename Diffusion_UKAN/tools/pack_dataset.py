@@ -0,0 +1,47 @@
+"""Pack a folder of equally sized images into one uint8 .npy + .json index for
+``Main.py --data_format packed``. Run from the Diffusion_UKAN folder:
+
+    python tools/pack_dataset.py --dataset cvc
+    python tools/pack_dataset.py --dataset cvc --img_size 128
+    python tools/pack_dataset.py --src data/glas/images_64/ --dst data/glas/images_64.npy
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from Diffusion.Data import DATASET_DIRS, dataset_dir, pack_folder, packed_path  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', type=str, default=None) # cvc, glas, glas_resize, busi, or all
+    parser.add_argument('--img_size', type=int, default=64) # packs data/<dataset>/images_<img_size>/
+    parser.add_argument('--src', type=str, default=None) # image folder, instead of --dataset
+    parser.add_argument('--dst', type=str, default=None) # .npy path, next to the folder by default
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.src is not None:
+        jobs = [(args.src, args.dst or packed_path(args.src))]
+    elif args.dataset == 'all':
+        dirs = [dataset_dir(d, args.img_size) for d in DATASET_DIRS]
+        jobs = [(d, packed_path(d)) for d in dirs if os.path.isdir(d)]
+    elif args.dataset in DATASET_DIRS:
+        folder = dataset_dir(args.dataset, args.img_size)
+        jobs = [(folder, packed_path(folder))]
+    else:
+        raise ValueError('give --src or --dataset from %s or all' % ', '.join(DATASET_DIRS))
+
+    for src, dst in jobs:
+        pack_folder(src, dst)
+        images = np.load(dst, mmap_mode='r')
+        print('%s: %d images %s, %.1f MB => %s' % (src, images.shape[0], images.shape[1:], images.nbytes / 2 ** 20, dst))
+
+
+if __name__ == '__main__':
+    main()
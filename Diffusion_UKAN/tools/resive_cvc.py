@@ -2,10 +2,15 @@ import os
 from skimage import io, transform
 from skimage.util import img_as_ubyte
 import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=64) # 64, 128 or 256; the crop is 288 x 288
+args = parser.parse_args()
 
 # Define the source and destination directories
 src_dir = '/data/wyli/data/CVC-ClinicDB/Original/'
-dst_dir = '/data/wyli/data/cvc/images_64/'
+dst_dir = '/data/wyli/data/cvc/images_{}/'.format(args.size)
 
 os.makedirs(dst_dir, exist_ok=True)
 
@@ -16,7 +21,7 @@ image_files = [f for f in os.listdir(src_dir) if os.path.isfile(os.path.join(src
 crop_size = np.array([288 ,288])
 
 # Define the size of the resized image
-resize_size = (64, 64)
+resize_size = (args.size, args.size)
 
 for image_file in image_files:
     # Load the image
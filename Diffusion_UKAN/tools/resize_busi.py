@@ -2,10 +2,15 @@ import os
 from skimage import io, transform
 from skimage.util import img_as_ubyte
 import numpy as np
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=64) # 64, 128 or 256; the crop is 400 x 400
+args = parser.parse_args()
 
 # Define the source and destination directories
 src_dir = '/data/wyli/data/busi/images/'
-dst_dir = '/data/wyli/data/busi/images_64/'
+dst_dir = '/data/wyli/data/busi/images_{}/'.format(args.size)
 
 os.makedirs(dst_dir, exist_ok=True)
 
@@ -17,7 +22,7 @@ crop_size = np.array([400 ,400])
 
 # Define the size of the resized image
 # resize_size = (64, 64)
-resize_size = (64, 64)
+resize_size = (args.size, args.size)
 
 for image_file in image_files:
     # Load the image
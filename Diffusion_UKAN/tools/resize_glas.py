@@ -3,10 +3,15 @@ from skimage import io, transform
 from skimage.util import img_as_ubyte
 import numpy as np
 import random
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=64) # side of the random crops: 64, 128 or 256
+args = parser.parse_args()
 
 # Define the source and destination directories
 src_dir = '/data/wyli/data/glas/images/'
-dst_dir = '/data/wyli/data/glas/images_64/'
+dst_dir = '/data/wyli/data/glas/images_{}/'.format(args.size)
 
 os.makedirs(dst_dir, exist_ok=True)
 
@@ -14,7 +19,7 @@ os.makedirs(dst_dir, exist_ok=True)
 image_files = [f for f in os.listdir(src_dir) if os.path.isfile(os.path.join(src_dir, f))]
 
 # Define the size of the crop box
-crop_size = np.array([64, 64])
+crop_size = np.array([args.size, args.size])
 
 # Define the number of crops per image
 K = 5
@@ -129,16 +129,18 @@ class KANLayer(nn.Module):
 
     def forward(self, x, H, W):
         # pdb.set_trace()
+        # flatten/unflatten keep the token count symbolic under torch.compile,
+        # so a new H, W does not force a recompile with dynamic shapes
         B, N, C = x.shape
 
-        x = self.fc1(x.reshape(B*N,C))
-        x = x.reshape(B,N,C).contiguous()
+        x = self.fc1(x.flatten(0, 1))
+        x = x.unflatten(0, (B, N)).contiguous()
         x = self.dwconv_1(x, H, W)
-        x = self.fc2(x.reshape(B*N,C))
-        x = x.reshape(B,N,C).contiguous()
+        x = self.fc2(x.flatten(0, 1))
+        x = x.unflatten(0, (B, N)).contiguous()
         x = self.dwconv_2(x, H, W)
-        x = self.fc3(x.reshape(B*N,C))
-        x = x.reshape(B,N,C).contiguous()
+        x = self.fc3(x.flatten(0, 1))
+        x = x.unflatten(0, (B, N)).contiguous()
         x = self.dwconv_3(x, H, W)
 
         # # TODO
@@ -284,6 +286,19 @@ class D_ConvLayer(nn.Module):
         return self.conv(input)
 
 
+def checkpoint_no_kan(state_dict, no_kan=True):
+    """
+    The no_kan setting that matches the KANLayers of a UKAN state_dict.
+
+    UKAN used to ignore no_kan, so checkpoints trained with --no_kan hold
+    KANLinear weights (base_weight, spline_weight, ...) rather than nn.Linear
+    ones. Build such a model with no_kan=False so that it loads strictly.
+    """
+    if no_kan and any(k.endswith('.spline_weight') for k in state_dict):
+        print('=> checkpoint has KANLinear layers despite no_kan, building them (old no_kan checkpoint)')
+        return False
+    return no_kan
+
 
 class UKAN(nn.Module):
     def __init__(self, num_classes, input_channels=3, deep_supervision=False, img_size=224, patch_size=16, in_chans=3, embed_dims=[256, 320, 512], no_kan=False,
@@ -306,22 +321,22 @@ class UKAN(nn.Module):
 
         self.block1 = nn.ModuleList([KANBlock(
             dim=embed_dims[1], 
-            drop=drop_rate, drop_path=dpr[0], norm_layer=norm_layer
+            drop=drop_rate, drop_path=dpr[0], norm_layer=norm_layer, no_kan=no_kan
             )])
 
         self.block2 = nn.ModuleList([KANBlock(
             dim=embed_dims[2],
-            drop=drop_rate, drop_path=dpr[1], norm_layer=norm_layer
+            drop=drop_rate, drop_path=dpr[1], norm_layer=norm_layer, no_kan=no_kan
             )])
 
         self.dblock1 = nn.ModuleList([KANBlock(
             dim=embed_dims[1], 
-            drop=drop_rate, drop_path=dpr[0], norm_layer=norm_layer
+            drop=drop_rate, drop_path=dpr[0], norm_layer=norm_layer, no_kan=no_kan
             )])
 
         self.dblock2 = nn.ModuleList([KANBlock(
             dim=embed_dims[0], 
-            drop=drop_rate, drop_path=dpr[1], norm_layer=norm_layer
+            drop=drop_rate, drop_path=dpr[1], norm_layer=norm_layer, no_kan=no_kan
             )])
 
         self.patch_embed3 = PatchEmbed(img_size=img_size // 4, patch_size=3, stride=2, in_chans=embed_dims[0], embed_dim=embed_dims[1])
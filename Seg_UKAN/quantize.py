@@ -0,0 +1,306 @@
+import argparse
+import copy
+import io
+import os
+import random
+import time
+from glob import glob
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import yaml
+from albumentations import Resize
+from albumentations.augmentations import transforms
+from albumentations.core.composition import Compose
+from sklearn.model_selection import train_test_split
+from torch.ao.quantization import (QuantWrapper, convert, fuse_modules,
+                                   get_default_qconfig, prepare)
+from tqdm import tqdm
+
+import archs
+from archs import ConvLayer, D_ConvLayer, KANLayer, PatchEmbed
+from dataset import Dataset
+from kan import KANLinear, kan_init
+from kan_core.profiler import cpu_peak_memory
+from metrics import iou_score
+from utils import AverageMeter
+
+
+SPLINE_MODES = ['fp32', 'per_basis']
+
+
+class QuantKANLinear(nn.Module):
+    """Post-training quantized KANLinear.
+
+    The base branch (SiLU followed by a linear map) runs as a statically
+    quantized int8 linear layer. The spline branch keeps the B-spline basis in
+    fp32; its weights are either kept in fp32 (``fp32``) or stored as int8 with
+    one scale per output feature and basis function (``per_basis``).
+    """
+
+    def __init__(self, layer, spline_mode='fp32'):
+        super().__init__()
+        assert spline_mode in SPLINE_MODES
+        self.in_features = layer.in_features
+        self.out_features = layer.out_features
+        self.grid_size = layer.grid_size
+        self.spline_order = layer.spline_order
+        self.spline_mode = spline_mode
+        self.register_buffer('grid', layer.grid.detach().clone())
+        self.base_activation = copy.deepcopy(layer.base_activation)
+
+        base = nn.Linear(self.in_features, self.out_features, bias=False)
+        base.weight.data.copy_(layer.base_weight.detach())
+        self.base = QuantWrapper(base)
+
+        spline_weight = layer.scaled_spline_weight.detach()  # (out, in, coeff)
+        if spline_mode == 'fp32':
+            self.register_buffer('spline_weight', spline_weight.reshape(self.out_features, -1).clone())
+        else:
+            scale = spline_weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-12) / 127.
+            self.register_buffer('spline_scale', scale)  # (out, 1, coeff)
+            self.register_buffer(
+                'spline_weight_int8',
+                torch.round(spline_weight / scale).clamp(-127, 127).to(torch.int8))
+
+    def b_splines(self, x):
+        return KANLinear.b_splines(self, x)
+
+    def dequantized_spline_weight(self):
+        if self.spline_mode == 'fp32':
+            return self.spline_weight
+        return (self.spline_weight_int8.float() * self.spline_scale).reshape(self.out_features, -1)
+
+    def forward(self, x):
+        base_output = self.base(self.base_activation(x))
+        spline_output = F.linear(
+            self.b_splines(x).view(x.size(0), -1),
+            self.dequantized_spline_weight(),
+        )
+        return base_output + spline_output
+
+
+def prepare_ukan(model, backend='fbgemm', spline_mode='fp32'):
+    """Fuse and wrap the quantizable parts of a UKAN model in place.
+
+    Covers ConvLayer/D_ConvLayer (Conv-BN-ReLU fused), the projections of the
+    patch embeds, and the linear parts of every KANLayer. Everything else
+    (LayerNorms, depth-wise convs, upsampling, the final 1x1 conv) stays fp32.
+    Returns the model with observers inserted, ready for calibration.
+    """
+    qconfig = get_default_qconfig(backend)
+    model.eval()
+
+    for name, module in list(model.named_children()):
+        if isinstance(module, (ConvLayer, D_ConvLayer)):
+            fuse_modules(module.conv, [['0', '1', '2'], ['3', '4', '5']], inplace=True)
+            wrapped = QuantWrapper(module)
+            wrapped.qconfig = qconfig
+            setattr(model, name, wrapped)
+
+    for module in model.modules():
+        if isinstance(module, PatchEmbed):
+            module.proj = QuantWrapper(module.proj)
+            module.proj.qconfig = qconfig
+        elif isinstance(module, KANLayer):
+            for fc_name in ['fc1', 'fc2', 'fc3']:
+                fc = getattr(module, fc_name)
+                if isinstance(fc, KANLinear):
+                    fc = QuantKANLinear(fc, spline_mode)
+                    fc.base.qconfig = qconfig
+                else:
+                    fc = QuantWrapper(fc)
+                    fc.qconfig = qconfig
+                setattr(module, fc_name, fc)
+
+    return prepare(model)
+
+
+def calibrate(model, loader, num_samples):
+    model.eval()
+    seen = 0
+    with torch.no_grad():
+        for input, _, _ in tqdm(loader, desc='calibrate'):
+            model(input)
+            seen += input.size(0)
+            if seen >= num_samples:
+                break
+    return seen
+
+
+def quantize_ukan(model, calib_loader, num_samples=256, backend='fbgemm', spline_mode='fp32'):
+    """Return an int8 copy of a fp32 UKAN calibrated on ``calib_loader``."""
+    torch.backends.quantized.engine = backend
+    qmodel = prepare_ukan(copy.deepcopy(model).cpu(), backend, spline_mode)
+    calibrate(qmodel, calib_loader, num_samples)
+    return convert(qmodel)
+
+
+def evaluate(model, loader):
+    iou_avg_meter = AverageMeter()
+    dice_avg_meter = AverageMeter()
+
+    model.eval()
+    with torch.no_grad():
+        for input, target, _ in tqdm(loader, desc='evaluate'):
+            output = model(input)
+            iou, dice, _ = iou_score(output, target)
+            iou_avg_meter.update(iou, input.size(0))
+            dice_avg_meter.update(dice, input.size(0))
+
+    return iou_avg_meter.avg, dice_avg_meter.avg
+
+
+def measure_latency(model, input_shape, iters=20, warmup=5):
+    """Median CPU latency in milliseconds of a single forward pass."""
+    x = torch.randn(*input_shape)
+    times = []
+    model.eval()
+    with torch.no_grad():
+        for i in range(warmup + iters):
+            start = time.perf_counter()
+            model(x)
+            if i >= warmup:
+                times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times))
+
+
+def measure_peak_memory(model, input_shape):
+    """Peak CPU memory in MB that torch allocates during a single forward pass, on top of the weights."""
+    x = torch.randn(*input_shape)
+    model.eval()
+    with torch.no_grad():
+        model(x)
+        return cpu_peak_memory(lambda: model(x)) / 1024 ** 2
+
+
+def model_size_mb(model):
+    """Size of the serialized state dict, which is what gets deployed."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1024 ** 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--name', default=None, help='model name')
+    parser.add_argument('--output_dir', default='outputs', help='ouput dir')
+    parser.add_argument('--calib_samples', default=256, type=int,
+                        help='number of training images used for calibration')
+    parser.add_argument('--backend', default='fbgemm', choices=['fbgemm', 'qnnpack'])
+    parser.add_argument('--spline_mode', default='fp32', choices=SPLINE_MODES,
+                        help='precision of the KAN spline weights')
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_threads', default=None, type=int,
+                        help='torch intra-op threads used for the latency measurement')
+    parser.add_argument('--latency_iters', default=20, type=int)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def seed_torch(seed=1029):
+    random.seed(seed)
+    os.environ['PYTHONHASHSEED'] = str(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def main():
+    seed_torch()
+    args = parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    with open(f'{args.output_dir}/{args.name}/config.yml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    ckpt = torch.load(f'{args.output_dir}/{args.name}/best_model.pth', map_location='cpu')
+    with kan_init('skip'):
+        model = archs.__dict__[config['arch']](config['num_classes'], config['input_channels'], config['deep_supervision'],
+                                               embed_dims=config['input_list'],
+                                               no_kan=archs.checkpoint_no_kan(ckpt, config.get('no_kan', False)))
+    model.load_state_dict(ckpt)
+    model.eval()
+
+    dataset_name = config['dataset']
+    img_ext = '.png'
+
+    if dataset_name == 'busi':
+        mask_ext = '_mask.png'
+    elif dataset_name == 'glas':
+        mask_ext = '.png'
+    elif dataset_name == 'cvc':
+        mask_ext = '.png'
+
+    img_ids = sorted(glob(os.path.join(config['data_dir'], config['dataset'], 'images', '*' + img_ext)))
+    img_ids = [os.path.splitext(os.path.basename(p))[0] for p in img_ids]
+
+    train_img_ids, val_img_ids = train_test_split(img_ids, test_size=0.2, random_state=config['dataseed'])
+
+    # calibration uses un-augmented training images so the val split stays unseen
+    transform = Compose([
+        Resize(config['input_h'], config['input_w']),
+        transforms.Normalize(),
+    ])
+
+    def make_loader(ids, shuffle):
+        dataset = Dataset(
+            img_ids=ids,
+            img_dir=os.path.join(config['data_dir'], config['dataset'], 'images'),
+            mask_dir=os.path.join(config['data_dir'], config['dataset'], 'masks'),
+            img_ext=img_ext,
+            mask_ext=mask_ext,
+            num_classes=config['num_classes'],
+            transform=transform)
+        return torch.utils.data.DataLoader(
+            dataset,
+            batch_size=args.batch_size,
+            shuffle=shuffle,
+            num_workers=config['num_workers'],
+            drop_last=False)
+
+    calib_loader = make_loader(train_img_ids, shuffle=True)
+    val_loader = make_loader(val_img_ids, shuffle=False)
+
+    qmodel = quantize_ukan(model, calib_loader, args.calib_samples, args.backend, args.spline_mode)
+
+    input_shape = (1, config['input_channels'], config['input_h'], config['input_w'])
+    report = {}
+    for key, m in [('fp32', model), ('int8', qmodel)]:
+        iou, dice = evaluate(m, val_loader)
+        report[key] = {
+            'iou': float(iou),
+            'dice': float(dice),
+            'latency_ms': measure_latency(m, input_shape, iters=args.latency_iters),
+            'peak_mem_mb': measure_peak_memory(m, input_shape),
+            'size_mb': model_size_mb(m),
+        }
+    report['delta'] = {k: report['int8'][k] - report['fp32'][k] for k in report['fp32']}
+    report['settings'] = {
+        'backend': args.backend,
+        'spline_mode': args.spline_mode,
+        'calib_samples': args.calib_samples,
+        'num_threads': torch.get_num_threads(),
+    }
+
+    print('-' * 20)
+    print('%-6s %8s %8s %12s %10s %14s' % ('', 'IoU', 'Dice', 'latency(ms)', 'size(MB)', 'peak mem(MB)'))
+    for key in ['fp32', 'int8', 'delta']:
+        r = report[key]
+        print('%-6s %8.4f %8.4f %12.2f %10.2f %14.2f' % (key, r['iou'], r['dice'], r['latency_ms'], r['size_mb'],
+                                                      r['peak_mem_mb']))
+    print('-' * 20)
+
+    with open(f'{args.output_dir}/{args.name}/quant_report.yml', 'w') as f:
+        yaml.dump(report, f)
+    torch.save(qmodel.state_dict(), f'{args.output_dir}/{args.name}/model_int8_{args.spline_mode}.pth')
+
+
+if __name__ == '__main__':
+    main()
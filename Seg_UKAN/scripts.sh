@@ -2,6 +2,14 @@ dataset=busi
 input_size=256
 python train.py --arch UKAN --dataset ${dataset} --input_w ${input_size} --input_h ${input_size} --name ${dataset}_UKAN  --data_dir [YOUR_DATA_DIR]
 python val.py --name ${dataset}_UKAN 
+# int8 post-training quantization (CPU), reports IoU/Dice, latency and size against fp32
+python quantize.py --name ${dataset}_UKAN --calib_samples 256 --spline_mode fp32
+# DDP on 4 GPUs (--batch_size is per process); for a CPU check use --device cpu --dist_backend gloo
+# torchrun --nproc_per_node 4 train.py --arch UKAN --dataset ${dataset} --input_w ${input_size} --input_h ${input_size} --name ${dataset}_UKAN_ddp --data_dir [YOUR_DATA_DIR] --sync_bn True
+# per-phase step times, samples/sec and peak memory in log.csv / TensorBoard, plus a 10-step torch.profiler trace
+# python train.py --arch UKAN --dataset ${dataset} --input_w ${input_size} --input_h ${input_size} --name ${dataset}_UKAN_profile --data_dir [YOUR_DATA_DIR] --epochs 1 --profile True --profile_trace 10
+# refit the KAN grids to the observed activations every 500 steps during the first 5000
+# python train.py --arch UKAN --dataset ${dataset} --input_w ${input_size} --input_h ${input_size} --name ${dataset}_UKAN_grid --data_dir [YOUR_DATA_DIR] --grid_update_every 500 --grid_update_until 5000
 
 dataset=glas
 input_size=512
@@ -1,6 +1,7 @@
 import argparse
 import os
 from collections import OrderedDict
+from contextlib import nullcontext
 from glob import glob
 import random
 import numpy as np
@@ -11,6 +12,8 @@ import torch.backends.cudnn as cudnn
 import torch.nn as nn
 import torch.optim as optim
 import yaml
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data.distributed import DistributedSampler
 
 from albumentations.augmentations import transforms
 from albumentations.augmentations import geometric
@@ -22,13 +25,19 @@ from tqdm import tqdm
 from albumentations import RandomRotate90, Resize
 
 import archs
+from kan import (BACKENDS, INIT_MODES, SOLVERS, GridUpdate, kan_init, set_chunking, set_default_backend,
+                 set_default_solver)
 
 import losses
 from dataset import Dataset
 
 from metrics import iou_score, indicators
 
+from kan_core.compiler import compile_model
+from kan_core.profiler import StepProfiler
 from utils import AverageMeter, str2bool
+from kan_core.dist_utils import (ShardSampler, all_reduce_meters, cleanup, init_distributed,
+                                 is_distributed, is_main_process)
 
 from tensorboardX import SummaryWriter
 
@@ -244,6 +253,10 @@ def parse_args():
                         metavar='LR', help='initial learning rate')
     parser.add_argument('--kan_weight_decay', default=1e-4, type=float,
                         help='weight decay')
+    parser.add_argument('--accumulation_steps', default=0, type=int,
+                        help='micro-batches per optimizer step, 0 or 1 disables')
+    parser.add_argument('--clip_grad', default=0., type=float,
+                        help='max gradient norm applied at each optimizer step, 0 disables')
 
     # scheduler
     parser.add_argument('--scheduler', default='CosineAnnealingLR',
@@ -260,6 +273,49 @@ def parse_args():
     parser.add_argument('--num_workers', default=4, type=int)
 
     parser.add_argument('--no_kan', action='store_true')
+    parser.add_argument('--kan_solver', default='lstsq', choices=SOLVERS,
+                        help='least-squares solver of KANLinear init and grid refits')
+    parser.add_argument('--kan_init', default='solve', choices=INIT_MODES[:2],
+                        help='solve: lstsq fit of the initial splines, analytic: same fit from one pseudo-inverse')
+    parser.add_argument('--kan_backend', default='reference', choices=list(BACKENDS),
+                        help='KANLinear forward implementation, see benchmarks/bench_kan.py')
+    parser.add_argument('--kan_chunk_size', default=0, type=int,
+                        help='tokens per KANLinear call, 0 runs all B*H*W tokens at once')
+    parser.add_argument('--kan_memory_mb', default=0, type=float,
+                        help='size the KANLinear token slabs to this many MB of temporaries (ignored with --kan_chunk_size)')
+    parser.add_argument('--kan_recompute', default=False, type=str2bool,
+                        help='recompute the spline bases of each slab in backward instead of storing them')
+    parser.add_argument('--grid_update_every', default=0, type=int,
+                        help='refit the KAN grids to the data every N optimizer steps, 0 disables')
+    parser.add_argument('--grid_update_until', default=-1, type=int,
+                        help='last optimizer step that may start a grid update, -1 for no limit')
+    parser.add_argument('--grid_update_steps', default=10, type=int,
+                        help='training steps observed before each grid update')
+    parser.add_argument('--grid_sample_size', default=4096, type=int,
+                        help='tokens kept per KANLinear for a grid update')
+
+    # torch.compile
+    parser.add_argument('--compile', action='store_true',
+                        help='run training and validation through torch.compile')
+    parser.add_argument('--compile_mode', default='default',
+                        choices=['default', 'reduce-overhead', 'max-autotune'])
+    parser.add_argument('--compile_dynamic', default='auto', choices=['auto', 'true', 'false'],
+                        help='dynamic shape handling of torch.compile (default: auto)')
+
+    # device / distributed (launch with torchrun to enable DDP)
+    parser.add_argument('--device', default='cuda', choices=['cuda', 'cpu'])
+    parser.add_argument('--dist_backend', default='nccl', choices=['nccl', 'gloo'],
+                        help='use gloo for multi-process training on CPU')
+    parser.add_argument('--sync_bn', default=False, type=str2bool,
+                        help='convert BatchNorm to SyncBatchNorm under DDP (CUDA only)')
+
+    # profiling
+    parser.add_argument('--profile', default=False, type=str2bool,
+                        help='time data/forward/backward/optimizer/metric phases (synchronizes the device)')
+    parser.add_argument('--profile_trace', default=0, type=int,
+                        help='record a torch.profiler trace of this many steps, 0 disables')
+    parser.add_argument('--profile_trace_wait', default=5, type=int,
+                        help='steps to skip before the traced window')
 
 
 
@@ -268,41 +324,64 @@ def parse_args():
     return config
 
 
-def train(config, train_loader, model, criterion, optimizer):
+def train(config, train_loader, model, criterion, optimizer, device, profiler, grid_update=None):
     avg_meters = {'loss': AverageMeter(),
                   'iou': AverageMeter()}
 
     model.train()
 
-    pbar = tqdm(total=len(train_loader))
-    for input, target, _ in train_loader:
-        input = input.cuda()
-        target = target.cuda()
+    accumulation_steps = max(config['accumulation_steps'], 1)
+    num_batches = len(train_loader)
 
-        # compute output
-        if config['deep_supervision']:
-            outputs = model(input)
-            loss = 0
-            for output in outputs:
-                loss += criterion(output, target)
-            loss /= len(outputs)
-
-            iou, dice, _ = iou_score(outputs[-1], target)
-            iou_, dice_, hd_, hd95_, recall_, specificity_, precision_ = indicators(outputs[-1], target)
-            
-        else:
-            output = model(input)
-            loss = criterion(output, target)
+    optimizer.zero_grad()
+    profiler.reset()
+    pbar = tqdm(total=len(train_loader), disable=not is_main_process())
+    for i, (input, target, _) in enumerate(profiler.iterate(train_loader)):
+        with profiler.phase('data'):
+            input = input.to(device)
+            target = target.to(device)
+
+        # the last accumulation window of an epoch may hold fewer micro-batches
+        window = min(accumulation_steps, num_batches - i // accumulation_steps * accumulation_steps)
+        step_now = (i + 1) % accumulation_steps == 0 or i + 1 == num_batches
+        # under DDP, only the last micro-batch of a window all-reduces gradients
+        sync_context = model.no_sync() if is_distributed() and not step_now else nullcontext()
+
+        with sync_context:
+            # compute output
+            with profiler.phase('forward'):
+                if config['deep_supervision']:
+                    outputs = model(input)
+                    loss = 0
+                    for output in outputs:
+                        loss += criterion(output, target)
+                    loss /= len(outputs)
+                    output = outputs[-1]
+                else:
+                    output = model(input)
+                    loss = criterion(output, target)
+
+            # compute gradient
+            with profiler.phase('backward'):
+                (loss / window).backward()
+
+        # do optimizing step once per window
+        if step_now:
+            with profiler.phase('optimizer'):
+                if config['clip_grad'] > 0:
+                    nn.utils.clip_grad_norm_(model.parameters(), config['clip_grad'])
+                optimizer.step()
+                optimizer.zero_grad()
+            if grid_update is not None:
+                grid_update.step()
+
+        with profiler.phase('metric'):
             iou, dice, _ = iou_score(output, target)
             iou_, dice_, hd_, hd95_, recall_, specificity_, precision_ = indicators(output, target)
 
-        # compute gradient and do optimizing step
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-
-        avg_meters['loss'].update(loss.item(), input.size(0))
-        avg_meters['iou'].update(iou, input.size(0))
+            avg_meters['loss'].update(loss.item(), input.size(0))
+            avg_meters['iou'].update(iou, input.size(0))
+        profiler.step(input.size(0))
 
         postfix = OrderedDict([
             ('loss', avg_meters['loss'].avg),
@@ -312,11 +391,14 @@ def train(config, train_loader, model, criterion, optimizer):
         pbar.update(1)
     pbar.close()
 
+    all_reduce_meters(avg_meters, device)
+
     return OrderedDict([('loss', avg_meters['loss'].avg),
-                        ('iou', avg_meters['iou'].avg)])
+                        ('iou', avg_meters['iou'].avg)] +
+                       list(profiler.summary().items()))
 
 
-def validate(config, val_loader, model, criterion):
+def validate(config, val_loader, model, criterion, device):
     avg_meters = {'loss': AverageMeter(),
                   'iou': AverageMeter(),
                    'dice': AverageMeter()}
@@ -325,10 +407,10 @@ def validate(config, val_loader, model, criterion):
     model.eval()
 
     with torch.no_grad():
-        pbar = tqdm(total=len(val_loader))
+        pbar = tqdm(total=len(val_loader), disable=not is_main_process())
         for input, target, _ in val_loader:
-            input = input.cuda()
-            target = target.cuda()
+            input = input.to(device)
+            target = target.to(device)
 
             # compute output
             if config['deep_supervision']:
@@ -356,6 +438,8 @@ def validate(config, val_loader, model, criterion):
             pbar.update(1)
         pbar.close()
 
+    # every rank validates a disjoint shard; sum the meters so all ranks agree
+    all_reduce_meters(avg_meters, device)
 
     return OrderedDict([('loss', avg_meters['loss'].avg),
                         ('iou', avg_meters['iou'].avg),
@@ -376,10 +460,21 @@ def main():
     seed_torch()
     config = vars(parse_args())
 
+    rank, local_rank, world_size = init_distributed(config['dist_backend'])
+    config['world_size'] = world_size
+    config['effective_batch_size'] = config['batch_size'] * max(config['accumulation_steps'], 1) * world_size
+    if config['device'] == 'cuda':
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        device = torch.device('cpu')
+    # logging, checkpoints and TensorBoard are written by rank 0 only
+    main_process = is_main_process()
+
     exp_name = config.get('name')
     output_dir = config.get('output_dir')
 
-    my_writer = SummaryWriter(f'{output_dir}/{exp_name}')
+    my_writer = SummaryWriter(f'{output_dir}/{exp_name}') if main_process else None
 
     if config['name'] is None:
         if config['deep_supervision']:
@@ -387,29 +482,56 @@ def main():
         else:
             config['name'] = '%s_%s_woDS' % (config['dataset'], config['arch'])
     
-    os.makedirs(f'{output_dir}/{exp_name}', exist_ok=True)
+    if main_process:
+        os.makedirs(f'{output_dir}/{exp_name}', exist_ok=True)
 
-    print('-' * 20)
-    for key in config:
-        print('%s: %s' % (key, config[key]))
-    print('-' * 20)
+        print('-' * 20)
+        for key in config:
+            print('%s: %s' % (key, config[key]))
+        print('-' * 20)
 
-    with open(f'{output_dir}/{exp_name}/config.yml', 'w') as f:
-        yaml.dump(config, f)
+        with open(f'{output_dir}/{exp_name}/config.yml', 'w') as f:
+            yaml.dump(config, f)
 
     # define loss function (criterion)
     if config['loss'] == 'BCEWithLogitsLoss':
-        criterion = nn.BCEWithLogitsLoss().cuda()
+        criterion = nn.BCEWithLogitsLoss().to(device)
     else:
-        criterion = losses.__dict__[config['loss']]().cuda()
+        criterion = losses.__dict__[config['loss']]().to(device)
 
     cudnn.benchmark = True
 
     # create model
-    model = archs.__dict__[config['arch']](config['num_classes'], config['input_channels'], config['deep_supervision'], embed_dims=config['input_list'], no_kan=config['no_kan'])
-
-    model = model.cuda()
-
+    set_default_solver(config['kan_solver'])
+    set_default_backend(config['kan_backend'])
+    with kan_init(config['kan_init']):
+        model = archs.__dict__[config['arch']](config['num_classes'], config['input_channels'], config['deep_supervision'], embed_dims=config['input_list'], no_kan=config['no_kan'])
+    set_chunking(model, config['kan_chunk_size'], config['kan_memory_mb'], config['kan_recompute'])
+
+    if is_distributed() and config['sync_bn']:
+        if config['device'] != 'cuda':
+            raise ValueError('--sync_bn requires --device cuda')
+        model = nn.SyncBatchNorm.convert_sync_batchnorm(model)
+
+    model = model.to(device)
+
+    grid_update = None
+    if config['grid_update_every'] > 0:
+        grid_update = GridUpdate(model, every=config['grid_update_every'],
+                                 until=config['grid_update_until'] if config['grid_update_until'] >= 0 else None,
+                                 observe_steps=config['grid_update_steps'], sample_size=config['grid_sample_size'])
+
+    # the DDP / compiled wrappers share parameters with model; checkpoints are saved from model.
+    # validation runs on the bare module, since val shards are uneven and a DDP forward
+    # would try to sync buffers across ranks
+    train_model = model
+    if is_distributed():
+        train_model = DDP(model, device_ids=[local_rank] if config['device'] == 'cuda' else None)
+    if config['compile']:
+        train_model = compile_model(train_model, config['compile_mode'], config['compile_dynamic'])
+    eval_model = model
+    if config['compile']:
+        eval_model = compile_model(model, config['compile_mode'], config['compile_dynamic']) if is_distributed() else train_model
 
     param_groups = []
 
@@ -449,8 +571,9 @@ def main():
     else:
         raise NotImplementedError
 
-    shutil.copy2('train.py', f'{output_dir}/{exp_name}/')
-    shutil.copy2('archs.py', f'{output_dir}/{exp_name}/')
+    if main_process:
+        shutil.copy2('train.py', f'{output_dir}/{exp_name}/')
+        shutil.copy2('archs.py', f'{output_dir}/{exp_name}/')
 
     dataset_name = config['dataset']
     img_ext = '.png'
@@ -499,19 +622,31 @@ def main():
         num_classes=config['num_classes'],
         transform=val_transform)
 
+    # under DDP --batch_size is per process
+    train_sampler = DistributedSampler(train_dataset, shuffle=True, drop_last=True) if is_distributed() else None
+    val_sampler = ShardSampler(val_dataset) if is_distributed() else None
+
     train_loader = torch.utils.data.DataLoader(
         train_dataset,
         batch_size=config['batch_size'],
-        shuffle=True,
+        shuffle=train_sampler is None,
+        sampler=train_sampler,
         num_workers=config['num_workers'],
         drop_last=True)
     val_loader = torch.utils.data.DataLoader(
         val_dataset,
         batch_size=config['batch_size'],
         shuffle=False,
+        sampler=val_sampler,
         num_workers=config['num_workers'],
         drop_last=False)
 
+    # traces go next to the TensorBoard events of rank 0
+    profiler = StepProfiler(device, enabled=config['profile'],
+                            trace_dir=f'{output_dir}/{exp_name}/trace' if main_process else None,
+                            trace_steps=config['profile_trace'], trace_wait=config['profile_trace_wait'])
+    profile_keys = list(profiler.summary())
+
     log = OrderedDict([
         ('epoch', []),
         ('lr', []),
@@ -520,28 +655,28 @@ def main():
         ('val_loss', []),
         ('val_iou', []),
         ('val_dice', []),
-    ])
+    ] + [(k, []) for k in profile_keys])
 
 
     best_iou = 0
     best_dice= 0
     trigger = 0
     for epoch in range(config['epochs']):
-        print('Epoch [%d/%d]' % (epoch, config['epochs']))
+        if main_process:
+            print('Epoch [%d/%d]' % (epoch, config['epochs']))
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
 
         # train for one epoch
-        train_log = train(config, train_loader, model, criterion, optimizer)
+        train_log = train(config, train_loader, train_model, criterion, optimizer, device, profiler, grid_update)
         # evaluate on validation set
-        val_log = validate(config, val_loader, model, criterion)
+        val_log = validate(config, val_loader, eval_model, criterion, device)
 
         if config['scheduler'] == 'CosineAnnealingLR':
             scheduler.step()
         elif config['scheduler'] == 'ReduceLROnPlateau':
             scheduler.step(val_log['loss'])
 
-        print('loss %.4f - iou %.4f - val_loss %.4f - val_iou %.4f'
-              % (train_log['loss'], train_log['iou'], val_log['loss'], val_log['iou']))
-
         log['epoch'].append(epoch)
         log['lr'].append(config['lr'])
         log['loss'].append(train_log['loss'])
@@ -549,35 +684,45 @@ def main():
         log['val_loss'].append(val_log['loss'])
         log['val_iou'].append(val_log['iou'])
         log['val_dice'].append(val_log['dice'])
+        for k in profile_keys:
+            log[k].append(train_log[k])
+
+        if main_process:
+            print('loss %.4f - iou %.4f - val_loss %.4f - val_iou %.4f'
+                  % (train_log['loss'], train_log['iou'], val_log['loss'], val_log['iou']))
 
-        pd.DataFrame(log).to_csv(f'{output_dir}/{exp_name}/log.csv', index=False)
+            pd.DataFrame(log).to_csv(f'{output_dir}/{exp_name}/log.csv', index=False)
 
-        # 🎨 リアルタイム可視化を追加（ここに挿入！）
-        plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
+            # 🎨 リアルタイム可視化を追加（ここに挿入！）
+            plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
 
-        my_writer.add_scalar('train/loss', train_log['loss'], global_step=epoch)
-        my_writer.add_scalar('train/iou', train_log['iou'], global_step=epoch)
-        my_writer.add_scalar('val/loss', val_log['loss'], global_step=epoch)
-        my_writer.add_scalar('val/iou', val_log['iou'], global_step=epoch)
-        my_writer.add_scalar('val/dice', val_log['dice'], global_step=epoch)
+            my_writer.add_scalar('train/loss', train_log['loss'], global_step=epoch)
+            my_writer.add_scalar('train/iou', train_log['iou'], global_step=epoch)
+            my_writer.add_scalar('val/loss', val_log['loss'], global_step=epoch)
+            my_writer.add_scalar('val/iou', val_log['iou'], global_step=epoch)
+            my_writer.add_scalar('val/dice', val_log['dice'], global_step=epoch)
 
-        my_writer.add_scalar('val/best_iou_value', best_iou, global_step=epoch)
-        my_writer.add_scalar('val/best_dice_value', best_dice, global_step=epoch)
+            my_writer.add_scalar('val/best_iou_value', best_iou, global_step=epoch)
+            my_writer.add_scalar('val/best_dice_value', best_dice, global_step=epoch)
+            for k in profile_keys:
+                my_writer.add_scalar('profile/%s' % k, train_log[k], global_step=epoch)
 
         trigger += 1
 
+        # val metrics are all-reduced, so every rank takes the same branches below
         if val_log['iou'] > best_iou:
-            torch.save(model.state_dict(), f'{output_dir}/{exp_name}/best_model.pth')  # best.pthに変更
             best_iou = val_log['iou']
             best_dice = val_log['dice']
-            print(f"=> saved best model (epoch {epoch}, IoU: {best_iou:.4f})")
             trigger = 0
-            
-            # 🏆 最良モデル保存時は必ず可視化更新
-            plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
+            if main_process:
+                torch.save(model.state_dict(), f'{output_dir}/{exp_name}/best_model.pth')  # best.pthに変更
+                print(f"=> saved best model (epoch {epoch}, IoU: {best_iou:.4f})")
+
+                # 🏆 最良モデル保存時は必ず可視化更新
+                plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
 
         # 最終エポックでの保存を追加
-        if epoch == config['epochs'] - 1:
+        if epoch == config['epochs'] - 1 and main_process:
             torch.save(model.state_dict(), f'{output_dir}/{exp_name}/last_model.pth')  # last_model.pthに変更
             print("=> saved last model")
 
@@ -586,12 +731,18 @@ def main():
 
         # early stopping
         if config['early_stopping'] >= 0 and trigger >= config['early_stopping']:
-            print("=> early stopping")
-            # Early stopping時も可視化更新
-            plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
+            if main_process:
+                print("=> early stopping")
+                # Early stopping時も可視化更新
+                plot_progress_realtime(log, output_dir, exp_name, epoch, best_iou, best_dice)
             break
 
         torch.cuda.empty_cache()
-            
+
+    profiler.close()
+    if main_process:
+        my_writer.close()
+    cleanup()
+
 if __name__ == '__main__':
     main()
@@ -16,6 +16,7 @@ from tqdm import tqdm
 from collections import OrderedDict
 
 import archs
+from kan import BACKENDS, kan_init, set_backend, set_chunking
 
 from dataset import Dataset
 from metrics import iou_score
@@ -30,6 +31,10 @@ def parse_args():
 
     parser.add_argument('--name', default=None, help='model name')
     parser.add_argument('--output_dir', default='outputs', help='ouput dir')
+    parser.add_argument('--kan_backend', default=None, choices=list(BACKENDS),
+                        help='KANLinear forward implementation, the training one by default')
+    parser.add_argument('--kan_memory_mb', default=None, type=float,
+                        help='size the KANLinear token slabs to this many MB, the training setting by default')
             
     args = parser.parse_args()
 
@@ -60,7 +65,11 @@ def main():
 
     cudnn.benchmark = True
 
-    model = archs.__dict__[config['arch']](config['num_classes'], config['input_channels'], config['deep_supervision'], embed_dims=config['input_list'])
+    ckpt = torch.load(f'{args.output_dir}/{args.name}/best_model.pth')
+
+    # every parameter comes from the checkpoint (missing keys raise below), so skip the spline init
+    with kan_init('skip'):
+        model = archs.__dict__[config['arch']](config['num_classes'], config['input_channels'], config['deep_supervision'], embed_dims=config['input_list'], no_kan=archs.checkpoint_no_kan(ckpt, config.get('no_kan', False)))
 
     model = model.cuda()
 
@@ -81,11 +90,9 @@ def main():
 
     _, val_img_ids = train_test_split(img_ids, test_size=0.2, random_state=config['dataseed'])
 
-    ckpt = torch.load(f'{args.output_dir}/{args.name}/best_model.pth')
-
     try:        
         model.load_state_dict(ckpt)
-    except:
+    except RuntimeError:
         print("Pretrained model keys:", ckpt.keys())
         print("Current model keys:", model.state_dict().keys())
 
@@ -97,8 +104,17 @@ def main():
         for key in diff_keys:
             print(f"Key: {key}")
 
-        model.load_state_dict(ckpt, strict=False)
-        
+        # never evaluate a partly random model: any missing or unexpected key is an error
+        result = model.load_state_dict(ckpt, strict=False)
+        if result.missing_keys or result.unexpected_keys:
+            raise RuntimeError('checkpoint does not match %s: missing keys %s, unexpected keys %s' % (
+                config['arch'], result.missing_keys, result.unexpected_keys))
+
+    set_backend(model, args.kan_backend or config.get('kan_backend', 'reference'))
+    if args.kan_memory_mb is not None:
+        set_chunking(model, memory_mb=args.kan_memory_mb)
+    else:
+        set_chunking(model, config.get('kan_chunk_size', 0), config.get('kan_memory_mb', 0))
     model.eval()
 
     val_transform = Compose([
@@ -0,0 +1,297 @@
+"""Micro-benchmarks for the KANLinear kernels.
+
+Times ``b_splines``, ``forward``, forward+backward, ``update_grid``,
+``curve2coeff``, ``regularization_loss`` and ``reset_parameters`` (the
+construction cost) over in/out features, grid size,
+spline order and token counts. Every op has a ``reference`` implementation
+(the method on ``kan_core.KANLinear``); alternatives are added with ``register``
+and are checked against the reference on the same inputs before they are
+timed, so a faster but wrong implementation shows up as ``FAIL``:
+
+    python benchmarks/bench_kan.py --features 128,256,512 --tokens 1024,4096 --out bench_kan.json
+    python benchmarks/bench_kan.py --ops b_splines,forward --grid_sizes 5,10 --impls reference,uniform
+
+Every ``kan_core`` backend is registered for ``forward`` (and
+``forward_backward`` if it supports autograd). ``--check`` skips the timing
+and exits with status 1 if any implementation is outside ``--tolerance``,
+which makes a quick equivalence check before switching backends:
+
+    python benchmarks/bench_kan.py --check --ops b_splines,forward,forward_backward --tokens 256
+
+``update_grid`` and ``curve2coeff`` build a (tokens, in, out) target, so they
+use at most ``--fit_tokens`` tokens.
+"""
+import argparse
+import copy
+import json
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from common import list_type, time_fn
+from kan_core import BACKENDS, GridSketch, KANLinear, uniform_b_splines
+from kan_core.backends import grid_is_uniform
+
+OPS = ['b_splines', 'forward', 'forward_backward', 'update_grid', 'curve2coeff', 'regularization_loss',
+       'reset_parameters']
+FIT_OPS = ['update_grid', 'curve2coeff']
+# ops whose cost does not depend on the token count
+STATIC_OPS = ['regularization_loss', 'reset_parameters']
+
+# op -> name -> (fn, condition); fn(layer, *inputs) returns the tensors compared
+# against the reference, condition(layer) says whether the implementation applies
+IMPLEMENTATIONS = OrderedDict((op, OrderedDict()) for op in OPS)
+
+
+def register(op, name, condition=None):
+    def decorator(fn):
+        IMPLEMENTATIONS[op][name] = (fn, condition)
+        return fn
+    return decorator
+
+
+@register('b_splines', 'reference')
+def b_splines_reference(layer, x):
+    return layer.b_splines(x)
+
+
+@register('forward', 'reference')
+def forward_reference(layer, x):
+    with torch.no_grad():
+        return layer(x)
+
+
+@register('forward_backward', 'reference')
+def forward_backward_reference(layer, x):
+    layer.zero_grad(set_to_none=True)
+    x = x.detach().requires_grad_()
+    layer(x).sum().backward()
+    return x.grad, layer.base_weight.grad, layer.spline_weight.grad
+
+
+@register('update_grid', 'reference')
+def update_grid_reference(layer, x):
+    layer.update_grid(x)
+    return layer.grid, layer.spline_weight
+
+
+@register('update_grid', 'sketch')
+def update_grid_sketch(layer, x):
+    # a reservoir as large as the batch keeps every token, so this matches the reference
+    sketch = GridSketch(layer.in_features, size=x.size(0), device=x.device)
+    sketch.update(x)
+    layer.update_grid_from_sketch(sketch)
+    return layer.grid, layer.spline_weight
+
+
+@register('curve2coeff', 'reference')
+def curve2coeff_reference(layer, x, y):
+    with torch.no_grad():
+        return layer.curve2coeff(x, y)
+
+
+@register('update_grid', 'cholesky')
+def update_grid_cholesky(layer, x):
+    layer.solver = 'cholesky'
+    layer.update_grid(x)
+    return layer.grid, layer.spline_weight
+
+
+@register('curve2coeff', 'cholesky')
+def curve2coeff_cholesky(layer, x, y):
+    with torch.no_grad():
+        return layer.curve2coeff(x, y, solver='cholesky')
+
+
+@register('reset_parameters', 'reference')
+def reset_parameters_reference(layer, x):
+    torch.manual_seed(0)
+    layer.solver = 'lstsq'
+    layer.reset_parameters()
+    return layer.spline_weight.detach().clone()
+
+
+@register('reset_parameters', 'analytic')
+def reset_parameters_analytic(layer, x):
+    torch.manual_seed(0)
+    layer.init = 'analytic'
+    layer.reset_parameters()
+    return layer.spline_weight.detach().clone()
+
+
+@register('reset_parameters', 'cholesky')
+def reset_parameters_cholesky(layer, x):
+    torch.manual_seed(0)
+    layer.solver = 'cholesky'
+    layer.reset_parameters()
+    return layer.spline_weight.detach().clone()
+
+
+@register('regularization_loss', 'reference')
+def regularization_loss_reference(layer, x):
+    with torch.no_grad():
+        return layer.regularization_loss()
+
+
+def is_uniform(layer):
+    return grid_is_uniform(layer.grid)
+
+
+@register('b_splines', 'uniform', condition=is_uniform)
+def b_splines_uniform(layer, x):
+    return uniform_b_splines(layer.grid, x, layer.spline_order)
+
+
+def register_backends():
+    """A forward (and, where it has autograd, forward_backward) impl per kan_core backend."""
+    for name in BACKENDS:
+        if name == 'reference':
+            continue
+
+        def forward(layer, x, name=name):
+            layer.backend = name
+            return forward_reference(layer, x)
+
+        def forward_backward(layer, x, name=name):
+            layer.backend = name
+            return forward_backward_reference(layer, x)
+
+        # backends that need uniform knots fall back to the reference otherwise,
+        # which would only time the reference again
+        condition = None if name == 'fused' else is_uniform
+        register('forward', name, condition)(forward)
+        if name != 'sparse':
+            register('forward_backward', name, condition)(forward_backward)
+
+
+register_backends()
+
+
+def as_tuple(output):
+    return output if isinstance(output, tuple) else (output,)
+
+
+def max_error(reference, output):
+    """Largest absolute error relative to the largest reference magnitude."""
+    worst = 0.
+    for r, o in zip(as_tuple(reference), as_tuple(output)):
+        scale = r.abs().max().clamp(min=1e-12)
+        worst = max(worst, float((r.double() - o.double()).abs().max() / scale))
+    return worst
+
+
+def make_inputs(op, layer, tokens, device):
+    # inputs slightly wider than the grid range so the extended knots are hit
+    x = (torch.rand(tokens, layer.in_features, device=device) * 2 - 1) * 1.2
+    if op == 'curve2coeff':
+        with torch.no_grad():
+            y = torch.einsum('bik,oik->bio', layer.b_splines(x), layer.scaled_spline_weight)
+        return x, y + 0.01 * torch.randn_like(y)
+    return (x,)
+
+
+def bench_op(op, impls, layer, tokens, args):
+    inputs = make_inputs(op, layer, tokens, args.device)
+    reference = IMPLEMENTATIONS[op]['reference'][0](copy.deepcopy(layer), *inputs)
+
+    rows = []
+    for name in impls:
+        if name not in IMPLEMENTATIONS[op]:
+            continue
+        fn, condition = IMPLEMENTATIONS[op][name]
+        if condition is not None and not condition(layer):
+            continue
+        target = copy.deepcopy(layer)
+        error = max_error(reference, fn(copy.deepcopy(layer), *inputs))
+        if args.check:
+            times = [float('nan')]
+        else:
+            times = time_fn(lambda: fn(target, *inputs), args.iters, args.warmup, args.device)
+        rows.append(OrderedDict([
+            ('impl', name),
+            ('ms', float(np.median(times))),
+            ('max_rel_err', error),
+            ('ok', error <= args.tolerance),
+        ]))
+    ref_ms = [row['ms'] for row in rows if row['impl'] == 'reference']
+    for row in rows:
+        row['speedup'] = ref_ms[0] / row['ms'] if ref_ms else float('nan')
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--ops', type=lambda s: list_type(s, str), default=OPS)
+    parser.add_argument('--impls', type=lambda s: list_type(s, str), default=None,
+                        help='implementations to run, all registered ones by default')
+    parser.add_argument('--features', type=list_type, default=[128, 160, 256, 512],
+                        help='in_features; out_features is the same unless --out_features is given')
+    parser.add_argument('--out_features', type=list_type, default=None)
+    parser.add_argument('--grid_sizes', type=list_type, default=[5])
+    parser.add_argument('--spline_orders', type=list_type, default=[3])
+    parser.add_argument('--tokens', type=list_type, default=[1024, 4096],
+                        help='rows of the flattened (batch * H * W, C) KANLayer input')
+    parser.add_argument('--fit_tokens', default=512, type=int,
+                        help='token cap for update_grid and curve2coeff')
+    parser.add_argument('--tolerance', default=1e-4, type=float,
+                        help='max error relative to the reference magnitude')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--num_threads', default=None, type=int)
+    parser.add_argument('--iters', default=20, type=int)
+    parser.add_argument('--warmup', default=3, type=int)
+    parser.add_argument('--check', action='store_true',
+                        help='only compare against the reference and exit 1 on any failure')
+    parser.add_argument('--out', default=None, help='write the results as JSON')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    torch.manual_seed(0)
+
+    results = []
+    failures = 0
+    print('%-20s %-12s %5s %5s %4s %5s %6s %10s %8s %10s' % (
+        'op', 'impl', 'in', 'out', 'grid', 'order', 'tokens', 'ms', 'speedup', 'rel err'))
+    for in_features in args.features:
+        for out_features in args.out_features or [in_features]:
+            for grid_size in args.grid_sizes:
+                for spline_order in args.spline_orders:
+                    layer = KANLinear(in_features, out_features, grid_size=grid_size,
+                                      spline_order=spline_order).to(args.device)
+                    for op in args.ops:
+                        impls = args.impls or list(IMPLEMENTATIONS[op])
+                        if op in FIT_OPS:
+                            token_list = sorted(set(min(t, args.fit_tokens) for t in args.tokens))
+                        elif op in STATIC_OPS:
+                            token_list = args.tokens[:1]
+                        else:
+                            token_list = args.tokens
+                        for tokens in token_list:
+                            for row in bench_op(op, impls, layer, tokens, args):
+                                row.update(op=op, in_features=in_features, out_features=out_features,
+                                           grid_size=grid_size, spline_order=spline_order, tokens=tokens)
+                                results.append(row)
+                                failures += not row['ok']
+                                print('%-20s %-12s %5d %5d %4d %5d %6d %10.3f %8.2f %10.2e %s' % (
+                                    op, row['impl'], in_features, out_features, grid_size, spline_order,
+                                    tokens, row['ms'], row['speedup'], row['max_rel_err'],
+                                    '' if row['ok'] else 'FAIL'))
+
+    print('%d implementation(s) outside tolerance' % failures)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'device': args.device, 'num_threads': torch.get_num_threads(),
+                       'torch': torch.__version__, 'results': results}, f, indent=2)
+        print('=> %s' % args.out)
+    return 1 if args.check and failures > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Latency, throughput and peak memory of the Seg and diffusion architectures.
+
+``run`` sweeps models x resolutions x batch sizes for a forward pass (eval,
+no_grad) and a forward+backward pass (train), and writes one JSON file.
+``compare`` matches two such files and flags regressions:
+
+    python benchmarks/bench_models.py run --out base.json
+    python benchmarks/bench_models.py run --out new.json
+    python benchmarks/bench_models.py compare base.json new.json --threshold 0.1
+
+Configurations that fail (out of memory, unsupported resolution) are
+recorded with their error instead of stopping the sweep.
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+
+from common import MODELS, build_model, example_inputs, list_type, time_fn
+from kan_core import INIT_MODES, set_chunking
+from kan_core.profiler import cpu_peak_memory
+
+MODES = ['fwd', 'fwd_bwd']
+
+
+def peak_memory_mb(fn, device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return (torch.cuda.max_memory_allocated(device) - base) / 1024 ** 2
+    return cpu_peak_memory(fn) / 1024 ** 2
+
+
+def bench_config(model, name, mode, img_size, batch_size, args):
+    inputs = example_inputs(name, batch_size, img_size, args.device)
+
+    if mode == 'fwd':
+        model.eval()
+
+        def step():
+            with torch.no_grad():
+                model(*inputs)
+    else:
+        model.train()
+
+        def step():
+            model.zero_grad(set_to_none=True)
+            output = model(*inputs)
+            output.float().mean().backward()
+
+    times = time_fn(step, args.iters, args.warmup, args.device)
+    latency = float(np.median(times))
+    return {
+        'latency_ms': latency,
+        'latency_p90_ms': float(np.percentile(times, 90)),
+        'throughput': batch_size * 1000. / latency,
+        'peak_mem_mb': peak_memory_mb(step, args.device),
+    }
+
+
+def run(args):
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    torch.manual_seed(0)
+
+    results = []
+    for name in args.models:
+        for img_size in args.sizes:
+            try:
+                start = time.perf_counter()
+                model = build_model(name, img_size, kan_init=args.kan_init)
+                build_ms = (time.perf_counter() - start) * 1000
+                set_chunking(model, memory_mb=args.kan_memory_mb, recompute=args.kan_recompute)
+                model = model.to(args.device)
+            except Exception as e:
+                results.append({'model': name, 'img_size': img_size, 'error': repr(e)})
+                print('%-14s %4d  build failed: %r' % (name, img_size, e))
+                continue
+            params = sum(p.numel() for p in model.parameters())
+            for batch_size in args.batch_sizes:
+                for mode in args.modes:
+                    entry = {'model': name, 'img_size': img_size, 'batch_size': batch_size,
+                             'mode': mode, 'params': params, 'build_ms': build_ms}
+                    try:
+                        entry.update(bench_config(model, name, mode, img_size, batch_size, args))
+                        print('%-14s %4d bs %-3d %-8s %10.2f ms %10.1f img/s %10.1f MB'
+                              % (name, img_size, batch_size, mode, entry['latency_ms'],
+                                 entry['throughput'], entry['peak_mem_mb']))
+                    except Exception as e:
+                        entry['error'] = repr(e)
+                        print('%-14s %4d bs %-3d %-8s failed: %r' % (name, img_size, batch_size, mode, e))
+                        if torch.device(args.device).type == 'cuda':
+                            torch.cuda.empty_cache()
+                    results.append(entry)
+            del model
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'device': args.device,
+            'device_name': torch.cuda.get_device_name(args.device) if args.device.startswith('cuda') else platform.processor(),
+            'num_threads': torch.get_num_threads(),
+            'torch': torch.__version__,
+            'python': platform.python_version(),
+            'iters': args.iters,
+            'warmup': args.warmup,
+            'kan_init': args.kan_init,
+            'kan_memory_mb': args.kan_memory_mb,
+            'kan_recompute': args.kan_recompute,
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('=> %s' % args.out)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    def key(r):
+        return r['model'], r['img_size'], r.get('batch_size'), r.get('mode')
+
+    base_results = {key(r): r for r in base['results'] if 'error' not in r}
+    if base['meta']['device'] != new['meta']['device'] or base['meta']['num_threads'] != new['meta']['num_threads']:
+        print('warning: runs used different devices or thread counts')
+
+    regressions = 0
+    print('%-14s %4s %4s %-8s %10s %10s %8s %10s %10s %8s' % (
+        'model', 'size', 'bs', 'mode', 'base ms', 'new ms', 'ratio', 'base MB', 'new MB', 'ratio'))
+    for r in new['results']:
+        b = base_results.get(key(r))
+        if b is None or 'error' in r:
+            continue
+        t_ratio = r['latency_ms'] / b['latency_ms']
+        m_ratio = r['peak_mem_mb'] / b['peak_mem_mb'] if b['peak_mem_mb'] > 0 else 1.
+        flag = ''
+        if t_ratio > 1 + args.threshold or m_ratio > 1 + args.threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif t_ratio < 1 - args.threshold:
+            flag = 'faster'
+        print('%-14s %4d %4d %-8s %10.2f %10.2f %8.2f %10.1f %10.1f %8.2f %s' % (
+            r['model'], r['img_size'], r['batch_size'], r['mode'], b['latency_ms'], r['latency_ms'], t_ratio,
+            b['peak_mem_mb'], r['peak_mem_mb'], m_ratio, flag))
+    print('%d regression(s) above %.0f%%' % (regressions, args.threshold * 100))
+    return 1 if regressions > 0 else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('run')
+    p.add_argument('--models', type=lambda s: list_type(s, str), default=MODELS)
+    p.add_argument('--sizes', type=list_type, default=[64, 128, 256, 512])
+    p.add_argument('--batch_sizes', type=list_type, default=[1, 8])
+    p.add_argument('--modes', type=lambda s: list_type(s, str), default=MODES)
+    p.add_argument('--device', default='cpu')
+    p.add_argument('--num_threads', default=None, type=int)
+    p.add_argument('--iters', default=10, type=int)
+    p.add_argument('--warmup', default=3, type=int)
+    p.add_argument('--kan_init', default='solve', choices=INIT_MODES[:2],
+                   help='KANLinear init used when building the models (build_ms)')
+    p.add_argument('--kan_memory_mb', default=0, type=float,
+                   help='run KANLinear over token slabs of this many MB, 0 disables')
+    p.add_argument('--kan_recompute', action='store_true',
+                   help='recompute the slab bases in backward (fwd_bwd)')
+    p.add_argument('--out', default='bench_models.json')
+
+    p = subparsers.add_parser('compare')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', default=0.1, type=float,
+                   help='relative latency or memory increase reported as a regression')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
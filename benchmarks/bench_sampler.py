@@ -0,0 +1,119 @@
+"""Diffusion sampling: GaussianDiffusionSampler against Diffusion.Executor.
+
+Every executor mode is first run from the same seed and noise as the
+``reference`` sampler, and its samples are compared bit for bit, before it
+is timed. This is repeated for every noise schedule and parameterization
+(all of them unless ``--schedules``/``--parameterizations`` are given).
+``--check`` skips the timing and exits with status 1 on any mismatch. It
+runs on CPU with a few timesteps:
+
+    python benchmarks/bench_sampler.py --check --T 10 --batch_size 2
+    python benchmarks/bench_sampler.py --device cuda --T 100 --batch_size 64 --schedules linear --parameterizations eps --out bench_sampler.json
+
+Timings are per denoising step; ``graph`` needs CUDA.
+"""
+import argparse
+import json
+import sys
+
+import torch
+
+from common import DIFFUSION_MODELS, build_model, list_type, time_fn
+
+
+def build_samplers(model, args, schedule, parameterization):
+    from Diffusion.Diffusion import GaussianDiffusionSampler
+    from Diffusion.Executor import SamplingExecutor
+
+    reference = GaussianDiffusionSampler(model, 1e-4, 0.02, args.T, schedule=schedule,
+                                         parameterization=parameterization).to(args.device)
+    samplers = {'reference': reference}
+    for mode in args.modes:
+        if mode == 'graph' and torch.device(args.device).type != 'cuda':
+            continue
+        samplers[mode] = SamplingExecutor(reference, mode=mode, progress=False)
+    return samplers
+
+
+def sample(sampler, args, seed):
+    torch.manual_seed(seed)
+    x_T = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    return sampler(x_T)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--models', type=lambda s: list_type(s, str), default=['UKan_Hybrid'])
+    parser.add_argument('--modes', type=lambda s: list_type(s, str), default=['eager', 'graph'],
+                        help='executor modes compared with the reference sampler')
+    parser.add_argument('--T', type=int, default=10, help='sampling steps (at most the 1000 of the model)')
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--img_size', type=int, default=64)
+    parser.add_argument('--schedules', type=lambda s: list_type(s, str), default=None,
+                        help='noise schedules to run, all by default')
+    parser.add_argument('--parameterizations', type=lambda s: list_type(s, str), default=None,
+                        help='network parameterizations to run, all by default')
+    parser.add_argument('--kan_init', default='analytic')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--num_threads', default=None, type=int)
+    parser.add_argument('--iters', default=3, type=int)
+    parser.add_argument('--warmup', default=1, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--check', action='store_true',
+                        help='only compare against the reference and exit 1 on any mismatch')
+    parser.add_argument('--out', default=None, help='write the results as JSON')
+
+    return parser.parse_args()
+
+
+def main():
+    from Diffusion.Schedules import PARAMETERIZATIONS, SCHEDULES
+
+    args = parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    results = []
+    failures = 0
+    print('%-12s %-13s %-5s %-10s %6s %12s %8s %s' % (
+        'model', 'schedule', 'param', 'mode', 'T', 'ms/step', 'speedup', 'match'))
+    for name in args.models:
+        if name not in DIFFUSION_MODELS:
+            raise ValueError('unknown diffusion model %s, choose from %s' % (name, ', '.join(DIFFUSION_MODELS)))
+        torch.manual_seed(args.seed)
+        model = build_model(name, args.img_size, kan_init=args.kan_init).to(args.device).eval()
+        for schedule in args.schedules or SCHEDULES:
+            for parameterization in args.parameterizations or PARAMETERIZATIONS:
+                samplers = build_samplers(model, args, schedule, parameterization)
+                with torch.no_grad():
+                    expected = sample(samplers['reference'], args, args.seed)
+                ref_ms = None
+                for mode, sampler in samplers.items():
+                    with torch.no_grad():
+                        match = torch.equal(sample(sampler, args, args.seed), expected)
+                    failures += not match
+                    row = {'model': name, 'schedule': schedule, 'parameterization': parameterization, 'mode': mode,
+                           'T': args.T, 'batch_size': args.batch_size, 'img_size': args.img_size, 'match': match}
+                    if not args.check:
+                        with torch.no_grad():
+                            times = time_fn(lambda: sample(sampler, args, args.seed), args.iters, args.warmup, args.device)
+                        row['ms_per_step'] = sum(times) / len(times) / args.T
+                        ref_ms = ref_ms or row['ms_per_step']
+                        row['speedup'] = ref_ms / row['ms_per_step']
+                    results.append(row)
+                    print('%-12s %-13s %-5s %-10s %6d %12.3f %8.2f %s' % (
+                        name, schedule, parameterization, mode, args.T, row.get('ms_per_step', float('nan')),
+                        row.get('speedup', float('nan')), 'ok' if match else 'MISMATCH'))
+
+    print('%d run(s) differ from the reference sampler' % failures)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump({'device': args.device, 'num_threads': torch.get_num_threads(),
+                       'torch': torch.__version__, 'results': results}, f, indent=2)
+        print('=> %s' % args.out)
+    return 1 if args.check and failures > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Model registry shared by the benchmark and cost scripts.
+
+Both projects are flat script folders, so they are put on ``sys.path`` here
+instead of being installed. Seg_UKAN modules are imported top-level
+(``archs``), the diffusion models through the ``Diffusion`` package and the
+KAN layers of both from ``kan_core`` at the repository root.
+"""
+import os
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEG_DIR = os.path.join(ROOT, 'Seg_UKAN')
+DIFFUSION_DIR = os.path.join(ROOT, 'Diffusion_UKAN')
+
+for path in [ROOT, SEG_DIR, DIFFUSION_DIR]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+SEG_MODELS = {
+    'UKAN': dict(no_kan=False),
+    'UKAN_nokan': dict(no_kan=True),
+}
+DIFFUSION_MODELS = ['UKan_Hybrid', 'UMLP', 'UNet', 'UNet_Baseline']
+MODELS = list(SEG_MODELS) + DIFFUSION_MODELS
+
+
+def is_diffusion(name):
+    return name in DIFFUSION_MODELS
+
+
+def build_model(name, img_size, seg_embed_dims=(128, 160, 256), diffusion_ch=64, kan_init='solve'):
+    """Build a model with the default training configuration of its project."""
+    from kan_core import kan_init as init_context
+    if name in SEG_MODELS:
+        import archs
+        with init_context(kan_init):
+            return archs.UKAN(1, 3, False, img_size=img_size, embed_dims=list(seg_embed_dims), **SEG_MODELS[name])
+    if name in DIFFUSION_MODELS:
+        from Diffusion.Train import RESOLUTION_MODELS, model_dict
+        # the KAN stages of UKan_Hybrid and UMLP are sized for img_size
+        kwargs = dict(img_size=img_size) if name in RESOLUTION_MODELS else {}
+        with init_context(kan_init):
+            return model_dict[name](T=1000, ch=diffusion_ch, ch_mult=[1, 2, 3, 4], attn=[2],
+                                    num_res_blocks=2, dropout=0.15, **kwargs)
+    raise ValueError('unknown model %s, choose from %s' % (name, ', '.join(MODELS)))
+
+
+def example_inputs(name, batch_size, img_size, device='cpu'):
+    """Positional forward arguments: ``(x,)`` for Seg, ``(x, t)`` for diffusion."""
+    x = torch.randn(batch_size, 3, img_size, img_size, device=device)
+    if is_diffusion(name):
+        t = torch.randint(1000, (batch_size,), device='cpu').to(device)
+        return x, t
+    return (x,)
+
+
+def list_type(s, cast=int):
+    return [cast(a) for a in s.split(',')]
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, iters=10, warmup=3, device='cpu'):
+    """Wall-clock times in ms of ``iters`` calls of ``fn`` after ``warmup`` calls."""
+    times = []
+    for i in range(warmup + iters):
+        synchronize(device)
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        if i >= warmup:
+            times.append((time.perf_counter() - start) * 1000)
+    return times
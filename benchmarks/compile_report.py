@@ -0,0 +1,127 @@
+"""Graph-break, recompile and step-time report for torch.compile on the
+training step of a Seg or diffusion model.
+
+The compiled module is the one the train scripts compile: the UKAN network
+under BCEDiceLoss for Seg, GaussianDiffusionTrainer around the network for
+diffusion. Several input sizes provoke recompiles:
+
+    python benchmarks/compile_report.py --model UKAN --sizes 256,320,512 --compile_dynamic true --device cuda
+    python benchmarks/compile_report.py --model UKan_Hybrid --sizes 64,128
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from common import MODELS, build_model, is_diffusion, list_type, time_fn
+from kan_core import INIT_MODES
+from kan_core.compiler import DYNAMIC, compile_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model', default='UKAN', choices=MODELS)
+    parser.add_argument('--sizes', type=list_type, default=None,
+                        help='input resolutions used to provoke recompiles, 256,320,512 for Seg and 64,128 for diffusion')
+    parser.add_argument('--batch_size', default=None, type=int, help='2 for Seg and 8 for diffusion')
+    parser.add_argument('--compile_mode', default='default',
+                        choices=['default', 'reduce-overhead', 'max-autotune'])
+    parser.add_argument('--compile_dynamic', default='auto', choices=list(DYNAMIC))
+    parser.add_argument('--kan_init', default='analytic', choices=INIT_MODES)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--warmup', default=3, type=int)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+
+    args = parser.parse_args()
+    diffusion = is_diffusion(args.model)
+    if args.sizes is None:
+        args.sizes = [64, 128] if diffusion else [256, 320, 512]
+    if args.batch_size is None:
+        args.batch_size = 8 if diffusion else 2
+    return args
+
+
+def build_train_module(args):
+    """The module the train script compiles, and the training loss of its output for an input x."""
+    model = build_model(args.model, args.sizes[0], kan_init=args.kan_init)
+    if is_diffusion(args.model):
+        from Diffusion import GaussianDiffusionTrainer
+        trainer = GaussianDiffusionTrainer(model, 1e-4, 0.02, 1000).to(args.device)
+        return trainer, lambda out, x: out.sum() / 1000.
+
+    import losses
+    criterion = losses.BCEDiceLoss()
+    # any fixed binary mask of the input size will do
+    return model.to(args.device), lambda out, x: criterion(out, (x[:, :1] > 0).float())
+
+
+def graph_breaks(module, x):
+    """Number of graphs, graph breaks and their reasons for one forward."""
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(module)(x)
+    return explanation.graph_count, explanation.graph_break_count, [str(r.reason) for r in explanation.break_reasons]
+
+
+def count_recompiles(module, loss_fn, inputs, dynamic):
+    """Graphs compiled for every input of a forward/backward step, in order."""
+    counts = {'graphs': 0}
+
+    def counting_backend(gm, example_inputs):
+        counts['graphs'] += 1
+        return gm.forward
+
+    torch._dynamo.reset()
+    counted = torch.compile(module, backend=counting_backend, dynamic=DYNAMIC[dynamic])
+    per_input = []
+    for x in inputs:
+        before = counts['graphs']
+        loss_fn(counted(x), x).backward()
+        per_input.append(counts['graphs'] - before)
+    return per_input
+
+
+def step_time(module, loss_fn, x, args):
+    """Median time in ms of a forward/backward/optimizer step."""
+    optimizer = torch.optim.Adam(module.parameters(), lr=1e-4)
+
+    def step():
+        loss = loss_fn(module(x), x)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    return float(np.median(time_fn(step, args.iters, args.warmup, args.device)))
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(0)
+
+    module, loss_fn = build_train_module(args)
+    module.train()
+    inputs = [torch.randn(args.batch_size, 3, s, s, device=args.device) for s in args.sizes]
+
+    graphs, breaks, reasons = graph_breaks(module, inputs[0])
+    per_input = count_recompiles(module, loss_fn, inputs, args.compile_dynamic)
+
+    eager_ms = step_time(module, loss_fn, inputs[0], args)
+    torch._dynamo.reset()
+    compiled = compile_model(module, args.compile_mode, args.compile_dynamic)
+    compiled_ms = step_time(compiled, loss_fn, inputs[0], args)
+
+    print('-' * 20)
+    print('%s graphs: %d, graph breaks: %d' % (args.model, graphs, breaks))
+    for r in reasons:
+        print('  break: %s' % r)
+    print('graphs compiled per input size (dynamic=%s):' % args.compile_dynamic)
+    for s, n in zip(args.sizes, per_input):
+        print('  %dx%d: %d' % (s, s, n))
+    print('recompiles after the first size: %d' % sum(per_input[1:]))
+    print('train step at %dx%d: eager %.2f ms, compiled %.2f ms (x%.2f)'
+          % (args.sizes[0], args.sizes[0], eager_ms, compiled_ms, eager_ms / compiled_ms))
+    print('-' * 20)
+
+
+if __name__ == '__main__':
+    main()
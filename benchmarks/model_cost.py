@@ -0,0 +1,292 @@
+"""Per-module FLOPs, activation memory and parameters for the UKAN models.
+
+Forward hooks on the leaf modules record output shapes, and FLOPs are derived
+from those shapes. KANLinear is treated as a leaf and split into three rows:
+the base branch (SiLU + GEMM), the B-spline basis construction of
+``b_splines`` and the spline GEMM. Activation memory is the size of each
+module output (for the basis rows, the (tokens, in, grid + order) basis that
+autograd keeps for backward), which approximates what training has to hold.
+
+GEMMs and convolutions count 2 FLOPs per multiply-accumulate; element-wise
+ops use the rough per-element costs in ``ELEMENTWISE``. Functional ops that
+are not modules (attention matmuls, interpolation, residual adds) are not
+attributed to a row; when ``torch.utils.flop_counter`` is available the
+aten-level matmul/conv total is printed as a cross-check.
+
+The tables are sorted in module order with fixed formatting, so they can be
+compared with ``diff`` across architectures or commits:
+
+    python benchmarks/model_cost.py --models UKAN,UKAN_nokan --img_size 256 --out_dir cost
+    python benchmarks/model_cost.py --models UKan_Hybrid,UMLP,UNet --img_size 64 --device meta
+"""
+import argparse
+import os
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from common import MODELS, build_model, example_inputs, list_type
+from kan_core import KANLinear
+
+ELEMENTWISE = {
+    'ReLU': 1, 'ReLU6': 1, 'LeakyReLU': 1, 'Hardswish': 3,
+    'SiLU': 4, 'Swish': 4, 'Sigmoid': 4, 'Tanh': 4, 'GELU': 8,
+    'BatchNorm1d': 4, 'BatchNorm2d': 4, 'SyncBatchNorm': 4,
+    'LayerNorm': 5, 'GroupNorm': 5, 'Softmax': 5,
+    'Upsample': 1,
+}
+ZERO_COST = ['Dropout', 'Identity', 'Embedding', 'DropPath', 'Flatten']
+
+
+def is_kan_linear(module):
+    return isinstance(module, KANLinear)
+
+
+def numel(t):
+    if isinstance(t, torch.Tensor):
+        return t.numel()
+    if isinstance(t, (tuple, list)):
+        return sum(numel(x) for x in t)
+    return 0
+
+
+def nbytes(t):
+    if isinstance(t, torch.Tensor):
+        return t.numel() * t.element_size()
+    if isinstance(t, (tuple, list)):
+        return sum(nbytes(x) for x in t)
+    return 0
+
+
+def shape_str(t):
+    if isinstance(t, torch.Tensor):
+        return 'x'.join(str(s) for s in t.shape)
+    if isinstance(t, (tuple, list)):
+        return ','.join(shape_str(x) for x in t if isinstance(x, torch.Tensor))
+    return ''
+
+
+def own_params(module):
+    return sum(p.numel() for p in module.parameters(recurse=False))
+
+
+def kan_linear_rows(module, inputs, output):
+    """FLOPs of one KANLinear call, split into base, basis and spline GEMM."""
+    x = inputs[0]
+    n = x.numel() // module.in_features
+    i, o = module.in_features, module.out_features
+    g, k = module.grid_size, module.spline_order
+    coeff = g + k
+
+    # order 0: two comparisons and an AND per interval; order j: two
+    # numerators, two divisions, two multiplications and a sum per basis
+    basis_flops = 3 * n * i * (g + 2 * k)
+    for j in range(1, k + 1):
+        basis_flops += 7 * n * i * (g + 2 * k - j)
+    spline_flops = 2 * n * i * coeff * o + n * o
+    if getattr(module, 'enable_standalone_scale_spline', False):
+        spline_flops += o * i * coeff
+    spline_params = module.spline_weight.numel()
+    if getattr(module, 'enable_standalone_scale_spline', False):
+        spline_params += module.spline_scaler.numel()
+    element_size = x.element_size()
+
+    return [
+        ('base', n * i * ELEMENTWISE['SiLU'] + 2 * n * i * o, module.base_weight.numel(),
+         n * o * element_size, '%dx%d' % (n, o)),
+        ('b_splines', basis_flops, 0,
+         n * i * coeff * element_size, '%dx%dx%d' % (n, i, coeff)),
+        ('spline_gemm', spline_flops, spline_params,
+         nbytes(output), shape_str(output)),
+    ]
+
+
+def leaf_flops(module, inputs, output):
+    name = type(module).__name__
+    if isinstance(module, (nn.Conv1d, nn.Conv2d, nn.ConvTranspose2d)):
+        kernel = 1
+        for s in module.kernel_size:
+            kernel *= s
+        if isinstance(module, nn.ConvTranspose2d):
+            # every input element is scattered into out_channels * kernel outputs
+            flops = 2 * numel(inputs[0]) * module.out_channels // module.groups * kernel
+        else:
+            flops = 2 * numel(output) * module.in_channels // module.groups * kernel
+        if module.bias is not None:
+            flops += numel(output)
+        return flops
+    if isinstance(module, nn.Linear):
+        flops = 2 * module.in_features * numel(output)
+        if module.bias is not None:
+            flops += numel(output)
+        return flops
+    if isinstance(module, (nn.MaxPool2d, nn.AvgPool2d)):
+        kernel = module.kernel_size if isinstance(module.kernel_size, int) else module.kernel_size[0]
+        return numel(output) * kernel * kernel
+    if name in ZERO_COST:
+        return 0
+    return ELEMENTWISE.get(name, 0) * numel(output)
+
+
+def profile_modules(model, inputs):
+    """Run one forward pass and return the per-module rows in module order."""
+    records = OrderedDict()
+    handles = []
+    skip = set()
+
+    for name, module in model.named_modules():
+        if id(module) in skip:
+            continue
+        if is_kan_linear(module):
+            skip.update(id(m) for m in module.modules())
+        elif len(list(module.children())) > 0:
+            continue
+        records[name] = []
+
+        def hook(m, inp, out, name=name):
+            records[name].append((m, inp, out))
+        handles.append(module.register_forward_hook(hook))
+
+    with torch.no_grad():
+        model(*inputs)
+    for h in handles:
+        h.remove()
+
+    rows = []
+    for name, calls in records.items():
+        for call_idx, (module, inp, out) in enumerate(calls):
+            # modules called more than once (shared activations) get one row per call
+            suffix = '' if len(calls) == 1 else '#%d' % call_idx
+            params = own_params(module) if call_idx == 0 else 0
+            if is_kan_linear(module):
+                for part, flops, part_params, act, shape in kan_linear_rows(module, inp, out):
+                    rows.append(OrderedDict([
+                        ('module', '%s%s.%s' % (name, suffix, part)),
+                        ('type', 'KANLinear.%s' % part),
+                        ('out_shape', shape),
+                        ('params', part_params if call_idx == 0 else 0),
+                        ('flops', flops),
+                        ('act_bytes', act),
+                    ]))
+            else:
+                rows.append(OrderedDict([
+                    ('module', name + suffix),
+                    ('type', type(module).__name__),
+                    ('out_shape', shape_str(out)),
+                    ('params', params),
+                    ('flops', leaf_flops(module, inp, out)),
+                    ('act_bytes', nbytes(out)),
+                ]))
+    return rows
+
+
+def group_rows(rows, depth):
+    """Sum the rows per module-name prefix of ``depth`` components."""
+    if depth <= 0:
+        return rows
+    grouped = OrderedDict()
+    for row in rows:
+        key = '.'.join(row['module'].split('.')[:depth])
+        if key not in grouped:
+            grouped[key] = OrderedDict([('module', key), ('type', '-'), ('out_shape', ''),
+                                        ('params', 0), ('flops', 0), ('act_bytes', 0)])
+        for col in ['params', 'flops', 'act_bytes']:
+            grouped[key][col] += row[col]
+    return list(grouped.values())
+
+
+def aten_flops(model, inputs):
+    """Matmul/conv FLOPs seen by torch's own counter, None if unavailable."""
+    try:
+        from torch.utils.flop_counter import FlopCounterMode
+    except ImportError:
+        return None
+    counter = FlopCounterMode(display=False)
+    with torch.no_grad(), counter:
+        model(*inputs)
+    return counter.get_total_flops()
+
+
+def summarize(rows):
+    total_flops = sum(r['flops'] for r in rows)
+    kan_flops = sum(r['flops'] for r in rows if r['type'] in ['KANLinear.b_splines', 'KANLinear.spline_gemm'])
+    return OrderedDict([
+        ('params_m', sum(r['params'] for r in rows) / 1e6),
+        ('gflops', total_flops / 1e9),
+        ('basis_gflops', sum(r['flops'] for r in rows if r['type'] == 'KANLinear.b_splines') / 1e9),
+        ('spline_share', kan_flops / total_flops if total_flops else 0.),
+        ('act_mb', sum(r['act_bytes'] for r in rows) / 1024 ** 2),
+    ])
+
+
+def format_table(rows, fmt):
+    header = ['module', 'type', 'out_shape', 'params', 'mflops', 'act_mb']
+    lines = []
+    values = [[r['module'], r['type'], r['out_shape'], '%d' % r['params'],
+               '%.3f' % (r['flops'] / 1e6), '%.3f' % (r['act_bytes'] / 1024 ** 2)] for r in rows]
+    if fmt == 'csv':
+        lines.append(','.join(header))
+        lines.extend(','.join(v) for v in values)
+    else:
+        lines.append('| ' + ' | '.join(header) + ' |')
+        lines.append('|' + '---|' * len(header))
+        lines.extend('| ' + ' | '.join(v) + ' |' for v in values)
+    return '\n'.join(lines) + '\n'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--models', type=lambda s: list_type(s, str), default=['UKAN', 'UKAN_nokan'],
+                        help='comma separated, from %s' % ', '.join(MODELS))
+    parser.add_argument('--img_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--input_list', type=list_type, default=[128, 160, 256],
+                        help='embed dims of the Seg UKAN models')
+    parser.add_argument('--channel', default=64, type=int, help='base channels of the diffusion models')
+    parser.add_argument('--depth', default=0, type=int,
+                        help='aggregate rows to this many module-name components, 0 keeps leaves')
+    parser.add_argument('--format', default='md', choices=['md', 'csv'])
+    parser.add_argument('--device', default='cpu', choices=['cpu', 'meta'],
+                        help='meta only propagates shapes, which is fast for large inputs')
+    parser.add_argument('--out_dir', default=None,
+                        help='write one table per model here instead of printing it')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    summaries = OrderedDict()
+
+    for name in args.models:
+        model = build_model(name, args.img_size, args.input_list, args.channel).to(args.device).eval()
+        inputs = example_inputs(name, args.batch_size, args.img_size, args.device)
+        rows = profile_modules(model, inputs)
+        summaries[name] = summarize(rows)
+        summaries[name]['aten_gflops'] = aten_flops(model, inputs) if args.device == 'cpu' else None
+
+        table = format_table(group_rows(rows, args.depth), args.format)
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+            path = os.path.join(args.out_dir, '%s_%d.%s' % (name, args.img_size, args.format))
+            with open(path, 'w') as f:
+                f.write(table)
+            print('=> %s' % path)
+        else:
+            print('## %s (%dx%d, batch %d)' % (name, args.img_size, args.img_size, args.batch_size))
+            print(table)
+
+    print('-' * 20)
+    print('%-14s %10s %10s %12s %12s %10s %12s' % ('model', 'params(M)', 'GFLOPs', 'basis GFLOPs',
+                                                 'spline share', 'act(MB)', 'aten GFLOPs'))
+    for name, s in summaries.items():
+        aten = '%12.3f' % (s['aten_gflops'] / 1e9) if s['aten_gflops'] is not None else '%12s' % '-'
+        print('%-14s %10.3f %10.3f %12.3f %12.3f %10.2f %s' % (name, s['params_m'], s['gflops'], s['basis_gflops'],
+                                                              s['spline_share'], s['act_mb'], aten))
+    print('-' * 20)
+
+
+if __name__ == '__main__':
+    main()
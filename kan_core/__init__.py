@@ -0,0 +1,31 @@
+"""
+Shared KAN layers for Seg_UKAN and Diffusion_UKAN.
+
+``Seg_UKAN/kan.py`` and ``Diffusion_UKAN/Diffusion/kan_utils/kan.py`` re-export
+this package, so existing imports and checkpoints keep working.
+``kan_core.profiler``, ``kan_core.compiler`` and ``kan_core.dist_utils`` hold
+the step profiler, the torch.compile wrapper and the DDP helpers of both train
+scripts.
+"""
+from .backends import BACKENDS, register_backend, uniform_b_splines
+from .kan import (INIT_MODES, KAN, SOLVERS, GridSketch, GridUpdate, KANLinear,
+                  kan_init, set_backend, set_chunking, set_default_backend,
+                  set_default_solver, solve_normal_equations)
+
+__all__ = [
+    "BACKENDS",
+    "INIT_MODES",
+    "SOLVERS",
+    "GridSketch",
+    "GridUpdate",
+    "KAN",
+    "KANLinear",
+    "kan_init",
+    "register_backend",
+    "set_backend",
+    "set_chunking",
+    "set_default_backend",
+    "set_default_solver",
+    "solve_normal_equations",
+    "uniform_b_splines",
+]
@@ -0,0 +1,150 @@
+"""
+Forward implementations of KANLinear.
+
+Every backend is a function ``forward(layer, x)`` returning the same
+(batch, out_features) result as the reference; ``KANLinear.backend`` picks
+one by name. Backends that only apply in some cases (uniform knots, no
+autograd) fall back to the reference instead of failing, so a backend can be
+set globally and still be correct everywhere.
+"""
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
+
+BACKENDS = OrderedDict()
+
+
+def register_backend(name):
+    def decorator(fn):
+        BACKENDS[name] = fn
+        return fn
+
+    return decorator
+
+
+def grid_is_uniform(grid: torch.Tensor):
+    if grid.is_meta:
+        return False
+    step = grid[:, 1:] - grid[:, :-1]
+    return bool(torch.allclose(step, step[:, :1].expand_as(step), rtol=1e-4, atol=1e-6))
+
+
+def uniform_b_splines(grid: torch.Tensor, x: torch.Tensor, spline_order):
+    """
+    Cox-de Boor recursion on equally spaced knots.
+
+    With u = (x - t_0) / h every denominator of the recursion is k, so the
+    per-feature knot differences and divisions of ``KANLinear.b_splines``
+    drop out.
+
+    Args:
+        grid (torch.Tensor): Uniform knots of shape (in_features, grid_size + 2 * spline_order + 1).
+        x (torch.Tensor): Input tensor of shape (batch_size, in_features).
+
+    Returns:
+        torch.Tensor: B-spline bases tensor of shape (batch_size, in_features, grid_size + spline_order).
+    """
+    u = (x.unsqueeze(-1) - grid[:, :1]) / (grid[:, 1:2] - grid[:, :1])  # (batch, in, 1)
+    i = torch.arange(grid.size(1) - 1, device=x.device, dtype=x.dtype)
+    bases = ((u >= i) & (u < i + 1)).to(x.dtype)
+    for k in range(1, spline_order + 1):
+        i = i[:-1]
+        bases = ((u - i) * bases[:, :, :-1] + (i + (k + 1) - u) * bases[:, :, 1:]) / k
+    return bases.contiguous()
+
+
+def local_uniform_b_splines(grid: torch.Tensor, x: torch.Tensor, spline_order):
+    """
+    The ``spline_order + 1`` non-zero bases of every input on uniform knots.
+
+    Returns:
+        values (torch.Tensor): Basis values of shape (batch_size, in_features, spline_order + 1),
+            zero where the basis does not exist (inputs outside the grid).
+        index (torch.Tensor): Their index along the grid_size + spline_order axis, same shape.
+    """
+    coeff = grid.size(1) - spline_order - 1
+    u = (x - grid[:, 0]) / (grid[:, 1] - grid[:, 0])  # (batch, in)
+    j = torch.floor(u)
+    t = u - j
+    # local de Boor: values[r] is the basis starting at knot j - d + r
+    values = [torch.ones_like(t)]
+    for d in range(1, spline_order + 1):
+        new_values = []
+        for r in range(d + 1):
+            v = torch.zeros_like(t)
+            if r >= 1:
+                v = v + (t + (d - r)) / d * values[r - 1]
+            if r < d:
+                v = v + ((r + 1) - t) / d * values[r]
+            new_values.append(v)
+        values = new_values
+    values = torch.stack(values, dim=-1)
+    index = j.long().unsqueeze(-1) - spline_order + torch.arange(spline_order + 1, device=x.device)
+    valid = (index >= 0) & (index < coeff)
+    return values * valid, index.clamp(0, coeff - 1)
+
+
+def _bases(layer, x):
+    if getattr(layer, "uniform_grid", False):
+        return uniform_b_splines(layer.grid, x, layer.spline_order)
+    return layer.b_splines(x)
+
+
+@register_backend("reference")
+def reference_forward(layer, x):
+    base_output = F.linear(layer.base_activation(x), layer.base_weight)
+    spline_output = F.linear(
+        layer.b_splines(x).flatten(1),
+        layer.scaled_spline_weight.view(layer.out_features, -1),
+    )
+    return base_output + spline_output
+
+
+@register_backend("uniform")
+def uniform_forward(layer, x):
+    """Reference forward with the closed-form bases while the grid is uniform."""
+    base_output = F.linear(layer.base_activation(x), layer.base_weight)
+    spline_output = F.linear(
+        _bases(layer, x).flatten(1),
+        layer.scaled_spline_weight.view(layer.out_features, -1),
+    )
+    return base_output + spline_output
+
+
+@register_backend("fused")
+def fused_forward(layer, x):
+    """Base and spline branch as one GEMM over concatenated features and weights."""
+    features = torch.cat([layer.base_activation(x), _bases(layer, x).flatten(1)], dim=1)
+    weight = torch.cat(
+        [layer.base_weight, layer.scaled_spline_weight.view(layer.out_features, -1)], dim=1
+    )
+    return F.linear(features, weight)
+
+
+@register_backend("sparse")
+def sparse_forward(layer, x):
+    """
+    Spline branch as a CSR x dense product.
+
+    Only ``spline_order + 1`` of the ``grid_size + spline_order`` bases of an
+    input are non-zero, so the basis matrix is stored in CSR form. Inference
+    only: with autograd enabled or a non-uniform grid it runs the reference.
+    """
+    if torch.is_grad_enabled() or not getattr(layer, "uniform_grid", False):
+        return reference_forward(layer, x)
+
+    batch = x.size(0)
+    coeff = layer.grid_size + layer.spline_order
+    values, index = local_uniform_b_splines(layer.grid, x, layer.spline_order)
+    columns = index + coeff * torch.arange(layer.in_features, device=x.device).unsqueeze(-1)
+    row_nnz = layer.in_features * (layer.spline_order + 1)
+    crow = torch.arange(0, batch * row_nnz + 1, row_nnz, device=x.device)
+    bases = torch.sparse_csr_tensor(
+        crow, columns.reshape(-1), values.reshape(-1), size=(batch, layer.in_features * coeff)
+    )
+
+    base_output = F.linear(layer.base_activation(x), layer.base_weight)
+    spline_output = torch.sparse.mm(bases, layer.scaled_spline_weight.view(layer.out_features, -1).t())
+    return base_output + spline_output
@@ -0,0 +1,18 @@
+import torch
+
+
+# --compile_dynamic of both train scripts -> torch.compile(dynamic=...)
+DYNAMIC = {'auto': None, 'true': True, 'false': False}
+
+
+def compile_model(model, mode='default', dynamic='auto'):
+    """Wrap ``model`` with torch.compile.
+
+    ``dynamic`` is 'auto' (specialize first, mark shapes dynamic on the first
+    recompile), 'true' (symbolic shapes from the start) or 'false' (always
+    specialize). The returned module shares parameters with ``model``, so
+    checkpoints should still be saved from ``model``.
+    """
+    if not hasattr(torch, 'compile'):
+        raise RuntimeError('torch.compile requires torch>=2.0, found %s' % torch.__version__)
+    return torch.compile(model, mode=mode, dynamic=DYNAMIC[dynamic])
@@ -0,0 +1,104 @@
+import math
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='nccl'):
+    """Initialise the default process group when launched with torchrun.
+
+    Returns (rank, local_rank, world_size); a plain ``python train.py`` or
+    ``python Main.py`` run returns (0, 0, 1) and leaves torch.distributed untouched.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size <= 1:
+        return 0, 0, 1
+
+    rank = int(os.environ['RANK'])
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend, rank=rank, world_size=world_size)
+    return rank, local_rank, world_size
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def scale_lr(lr, global_batch, base_batch, rule='linear'):
+    """Learning rate for ``global_batch`` given one tuned for ``base_batch``.
+
+    ``linear`` follows Goyal et al. (lr grows with the batch), ``sqrt`` grows
+    it with the square root, ``none`` keeps ``lr`` unchanged.
+    """
+    ratio = global_batch / base_batch
+    if rule == 'linear':
+        return lr * ratio
+    elif rule == 'sqrt':
+        return lr * math.sqrt(ratio)
+    elif rule == 'none':
+        return lr
+    raise ValueError('unknown lr scaling rule: {}'.format(rule))
+
+
+def all_reduce_meters(meters, device):
+    """Sum the totals of a dict of AverageMeters over all processes.
+
+    Afterwards every rank holds the global average, weighted by the number of
+    samples each rank has seen.
+    """
+    if not is_distributed():
+        return meters
+
+    names = list(meters)
+    stats = torch.tensor([[float(meters[k].sum), float(meters[k].count)] for k in names],
+                         dtype=torch.float64, device=device)
+    dist.all_reduce(stats)
+    for k, (total, count) in zip(names, stats.tolist()):
+        meters[k].sum = total
+        meters[k].count = count
+        meters[k].avg = total / count if count > 0 else 0
+    return meters
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """Deterministic, non-padded split of a dataset over processes.
+
+    Unlike DistributedSampler with shuffle=False, no sample is repeated to
+    even out the shards, so all-reduced validation metrics cover every image
+    exactly once.
+    """
+
+    def __init__(self, dataset, rank=None, world_size=None):
+        self.dataset = dataset
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.world_size))
@@ -0,0 +1,625 @@
+import torch
+import math
+from contextlib import contextmanager
+
+from torch.utils.checkpoint import checkpoint
+
+from .backends import BACKENDS, grid_is_uniform
+
+
+try:
+    from torch.compiler import is_compiling
+except ImportError:  # torch < 2.3
+    try:
+        from torch._dynamo import is_compiling
+    except ImportError:  # torch < 2.0
+        def is_compiling():
+            return False
+
+
+SOLVERS = ["lstsq", "cholesky"]
+_default_solver = "lstsq"
+INIT_MODES = ["solve", "analytic", "skip"]
+_default_init = "solve"
+_default_backend = "reference"
+
+
+def set_default_solver(solver):
+    """Solver used by ``curve2coeff`` of KANLinear layers built with ``solver=None``."""
+    global _default_solver
+    assert solver in SOLVERS
+    _default_solver = solver
+
+
+def set_default_backend(backend):
+    """Forward backend of KANLinear layers built with ``backend=None``."""
+    global _default_backend
+    assert backend in BACKENDS, "unknown KAN backend %s, choose from %s" % (backend, list(BACKENDS))
+    _default_backend = backend
+
+
+def set_backend(module, backend):
+    """Switch every KANLinear in ``module``, e.g. after loading a checkpoint."""
+    assert backend in BACKENDS, "unknown KAN backend %s, choose from %s" % (backend, list(BACKENDS))
+    for m in module.modules():
+        if isinstance(m, KANLinear):
+            m.backend = backend
+    return module
+
+
+def set_chunking(module, chunk_size=0, memory_mb=0, recompute=False):
+    """
+    Run every KANLinear in ``module`` over its tokens in slabs.
+
+    The B-spline basis of a slab is ``(grid_size + spline_order)`` times its
+    input, so one call over all tokens of a high-resolution stage dominates
+    peak memory. With ``chunk_size`` tokens per slab, or a slab size derived
+    from ``memory_mb`` of temporaries, only one slab's basis is alive at a time.
+    Under autograd each slab keeps its basis for backward unless ``recompute``
+    is set, in which case it is checkpointed and rebuilt during backward.
+    ``chunk_size=0, memory_mb=0`` restores the single call.
+    """
+    for m in module.modules():
+        if isinstance(m, KANLinear):
+            m.chunk_size = chunk_size
+            m.memory_mb = memory_mb
+            m.recompute = recompute
+    return module
+
+
+@contextmanager
+def kan_init(mode):
+    """
+    Build the KANLinear layers created inside the block with another init mode.
+
+    "solve" fits the initial splines with ``curve2coeff`` (the original
+    behaviour), "analytic" gets the same minimum-norm fit from one small
+    pseudo-inverse, and "skip" leaves all KANLinear parameters uninitialized
+    for when a checkpoint is loaded right after construction::
+
+        with kan_init("skip"):
+            model = UKAN(...)
+        model.load_state_dict(torch.load(path))
+    """
+    global _default_init
+    assert mode in INIT_MODES
+    previous, _default_init = _default_init, mode
+    try:
+        yield
+    finally:
+        _default_init = previous
+
+
+def solve_normal_equations(AtA: torch.Tensor, AtB: torch.Tensor, ridge=0.):
+    """
+    Solve batched least-squares problems from their normal equations.
+
+    Args:
+        AtA (torch.Tensor): Gram matrices of shape (batch, n, n).
+        AtB (torch.Tensor): Right-hand sides of shape (batch, n, k).
+        ridge (float): Ridge term relative to the mean diagonal of each Gram matrix.
+            None is added by default, since it biases the fit; a Gram matrix that
+            does not factor gets one from 1e-8 upwards.
+
+    Returns:
+        torch.Tensor: Solutions of shape (batch, n, k).
+    """
+    eye = torch.eye(AtA.size(-1), dtype=AtA.dtype, device=AtA.device)
+    scale = AtA.diagonal(dim1=-2, dim2=-1).mean(-1).clamp(min=1e-12)[:, None, None]
+    # bases that saw no samples leave the Gram matrix singular; grow the ridge until it factors
+    for _ in range(5):
+        L, info = torch.linalg.cholesky_ex(AtA + ridge * scale * eye)
+        if not info.any():
+            return torch.cholesky_solve(AtB, L)
+        ridge = max(ridge * 10, 1e-8)
+    return torch.linalg.lstsq(AtA + ridge * scale * eye, AtB).solution
+
+
+class GridSketch:
+    """
+    Bounded-memory summary of the inputs a KANLinear sees over many batches.
+
+    Keeps a uniform reservoir sample of at most ``size`` tokens, used for the
+    quantiles of the adaptive grid and for the refit, plus the exact minimum
+    and maximum of every input feature.
+    """
+
+    def __init__(self, in_features, size=4096, device=None):
+        self.size = size
+        self.samples = torch.empty(size, in_features, device=device)
+        self.filled = 0
+        self.seen = 0
+        self.min = torch.full((in_features,), float("inf"), device=device)
+        self.max = torch.full((in_features,), float("-inf"), device=device)
+
+    @torch.no_grad()
+    def update(self, x: torch.Tensor):
+        x = x.detach().reshape(-1, self.samples.size(1)).to(self.samples.dtype)
+        self.min = torch.minimum(self.min, x.min(0)[0])
+        self.max = torch.maximum(self.max, x.max(0)[0])
+
+        take = min(self.size - self.filled, x.size(0))
+        if take > 0:
+            self.samples[self.filled : self.filled + take] = x[:take]
+            self.filled += take
+        rest = x[take:]
+        if rest.size(0) > 0:
+            # Algorithm R: the j-th token overall replaces a random slot with probability size / j
+            index = self.seen + take + torch.arange(1, rest.size(0) + 1, device=x.device)
+            slot = (torch.rand(rest.size(0), device=x.device) * index).long()
+            keep = slot < self.size
+            self.samples[slot[keep]] = rest[keep]
+        self.seen += x.size(0)
+
+    def sample(self):
+        return self.samples[: self.filled]
+
+
+class KANLinear(torch.nn.Module):
+    def __init__(
+        self,
+        in_features,
+        out_features,
+        grid_size=5,
+        spline_order=3,
+        scale_noise=0.1,
+        scale_base=1.0,
+        scale_spline=1.0,
+        enable_standalone_scale_spline=True,
+        base_activation=torch.nn.SiLU,
+        grid_eps=0.02,
+        grid_range=[-1, 1],
+        solver=None,
+        init=None,
+        backend=None,
+    ):
+        super(KANLinear, self).__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.grid_size = grid_size
+        self.spline_order = spline_order
+        self.solver = solver or _default_solver
+        assert self.solver in SOLVERS
+        self.init = init or _default_init
+        assert self.init in INIT_MODES
+        self.backend = backend or _default_backend
+        assert self.backend in BACKENDS
+        self.chunk_size = 0
+        self.memory_mb = 0
+        self.recompute = False
+
+        h = (grid_range[1] - grid_range[0]) / grid_size
+        grid = (
+            (
+                torch.arange(-spline_order, grid_size + spline_order + 1) * h
+                + grid_range[0]
+            )
+            .expand(in_features, -1)
+            .contiguous()
+        )
+        self.register_buffer("grid", grid)
+        # lets the backends use the closed-form bases until the grid is refit
+        self.uniform_grid = True
+
+        self.base_weight = torch.nn.Parameter(torch.Tensor(out_features, in_features))
+        self.spline_weight = torch.nn.Parameter(
+            torch.Tensor(out_features, in_features, grid_size + spline_order)
+        )
+        if enable_standalone_scale_spline:
+            self.spline_scaler = torch.nn.Parameter(
+                torch.Tensor(out_features, in_features)
+            )
+
+        self.scale_noise = scale_noise
+        self.scale_base = scale_base
+        self.scale_spline = scale_spline
+        self.enable_standalone_scale_spline = enable_standalone_scale_spline
+        self.base_activation = base_activation()
+        self.grid_eps = grid_eps
+
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        if self.init == "skip":
+            return
+        torch.nn.init.kaiming_uniform_(self.base_weight, a=math.sqrt(5) * self.scale_base)
+        with torch.no_grad():
+            noise = (
+                (
+                    torch.rand(self.grid_size + 1, self.in_features, self.out_features)
+                    - 1 / 2
+                )
+                * self.scale_noise
+                / self.grid_size
+            )
+            points = self.grid.T[self.spline_order : -self.spline_order]
+            if self.init == "analytic" and bool((self.grid == self.grid[:1]).all()):
+                # every feature shares the same knots and sample points, so the
+                # per-feature lstsq problems share one (grid_size + 1, coeff) matrix
+                A = self.b_splines(points)[:, 0]
+                coeff = torch.einsum("kp,pio->oik", torch.linalg.pinv(A), noise)
+            else:
+                coeff = self.curve2coeff(points, noise)
+            self.spline_weight.data.copy_(
+                (self.scale_spline if not self.enable_standalone_scale_spline else 1.0)
+                * coeff
+            )
+            if self.enable_standalone_scale_spline:
+                # torch.nn.init.constant_(self.spline_scaler, self.scale_spline)
+                torch.nn.init.kaiming_uniform_(self.spline_scaler, a=math.sqrt(5) * self.scale_spline)
+
+    def b_splines(self, x: torch.Tensor, grid=None):
+        """
+        Compute the B-spline bases for the given input tensor.
+
+        Args:
+            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
+            grid (torch.Tensor, optional): Knots to use instead of ``self.grid``.
+
+        Returns:
+            torch.Tensor: B-spline bases tensor of shape (batch_size, in_features, grid_size + spline_order).
+        """
+        # shape checks only run eagerly so torch.compile does not guard on them
+        if not is_compiling():
+            assert x.dim() == 2 and x.size(1) == self.in_features
+
+        grid: torch.Tensor = (
+            self.grid if grid is None else grid
+        )  # (in_features, grid_size + 2 * spline_order + 1)
+        x = x.unsqueeze(-1)
+        bases = ((x >= grid[:, :-1]) & (x < grid[:, 1:])).to(x.dtype)
+        for k in range(1, self.spline_order + 1):
+            bases = (
+                (x - grid[:, : -(k + 1)])
+                / (grid[:, k:-1] - grid[:, : -(k + 1)])
+                * bases[:, :, :-1]
+            ) + (
+                (grid[:, k + 1 :] - x)
+                / (grid[:, k + 1 :] - grid[:, 1:(-k)])
+                * bases[:, :, 1:]
+            )
+
+        if not is_compiling():
+            assert bases.size() == (
+                x.size(0),
+                self.in_features,
+                self.grid_size + self.spline_order,
+            )
+        return bases.contiguous()
+
+    def curve2coeff(self, x: torch.Tensor, y: torch.Tensor, solver=None, ridge=0.):
+        """
+        Compute the coefficients of the curve that interpolates the given points.
+
+        Args:
+            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
+            y (torch.Tensor): Output tensor of shape (batch_size, in_features, out_features).
+            solver (str, optional): "lstsq" or "cholesky"; defaults to ``self.solver``.
+                "cholesky" solves the normal equations, which is much faster on CPU and
+                does not need cuSOLVER's gels on CUDA. With fewer points than bases it
+                takes the minimum-norm solution from a pseudo-inverse, as lstsq does.
+            ridge (float): Ridge term of the "cholesky" solver, relative to the mean
+                diagonal of each Gram matrix, see ``solve_normal_equations``.
+
+        Returns:
+            torch.Tensor: Coefficients tensor of shape (out_features, in_features, grid_size + spline_order).
+        """
+        assert x.dim() == 2 and x.size(1) == self.in_features
+        assert y.size() == (x.size(0), self.in_features, self.out_features)
+
+        A = self.b_splines(x).transpose(
+            0, 1
+        )  # (in_features, batch_size, grid_size + spline_order)
+        B = y.transpose(0, 1)  # (in_features, batch_size, out_features)
+        if (solver or self.solver) == "cholesky" and A.size(1) < A.size(2):
+            # underdetermined, e.g. the grid_size + 1 points of reset_parameters: the
+            # Gram matrix is singular, so take the minimum-norm fit of the analytic init
+            solution = torch.bmm(torch.linalg.pinv(A), B)
+        elif (solver or self.solver) == "cholesky":
+            At = A.transpose(1, 2)
+            solution = solve_normal_equations(
+                torch.bmm(At, A).double(), torch.bmm(At, B).double(), ridge
+            ).to(y.dtype)  # (in_features, grid_size + spline_order, out_features)
+        else:
+            solution = torch.linalg.lstsq(
+                A, B
+            ).solution  # (in_features, grid_size + spline_order, out_features)
+        result = solution.permute(
+            2, 0, 1
+        )  # (out_features, in_features, grid_size + spline_order)
+
+        assert result.size() == (
+            self.out_features,
+            self.in_features,
+            self.grid_size + self.spline_order,
+        )
+        return result.contiguous()
+
+    @property
+    def scaled_spline_weight(self):
+        return self.spline_weight * (
+            self.spline_scaler.unsqueeze(-1)
+            if self.enable_standalone_scale_spline
+            else 1.0
+        )
+
+    def token_bytes(self, x: torch.Tensor):
+        """
+        Approximate bytes of forward temporaries per token: the two basis
+        tensors alive during the Cox-de Boor recursion, the base activation
+        and the output.
+        """
+        return x.element_size() * (
+            self.in_features * (2 * self.grid.size(1) + 1) + 2 * self.out_features
+        )
+
+    def chunk_tokens(self, x: torch.Tensor):
+        """Tokens per slab, 0 when chunking is off."""
+        if self.chunk_size > 0:
+            return self.chunk_size
+        if self.memory_mb > 0:
+            return max(1, int(self.memory_mb * 2 ** 20) // self.token_bytes(x))
+        return 0
+
+    def forward(self, x: torch.Tensor):
+        if not is_compiling():
+            assert x.dim() == 2 and x.size(1) == self.in_features
+
+        forward = BACKENDS[self.backend]
+        chunk = self.chunk_tokens(x)
+        if chunk <= 0:
+            return forward(self, x)
+
+        if not torch.is_grad_enabled():
+            # write the slabs into one output instead of concatenating copies
+            output = x.new_empty(x.size(0), self.out_features)
+            for start in range(0, x.size(0), chunk):
+                output[start:start + chunk] = forward(self, x[start:start + chunk])
+            return output
+
+        outputs = []
+        for slab in x.split(chunk):
+            if self.recompute:
+                # KANLinear draws no random numbers, so the RNG state need not be restored
+                outputs.append(checkpoint(forward, self, slab, use_reentrant=False, preserve_rng_state=False))
+            else:
+                outputs.append(forward(self, slab))
+        return torch.cat(outputs)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        # checkpoints trained with grid updates carry non-uniform grids
+        self.uniform_grid = grid_is_uniform(self.grid)
+
+    @torch.no_grad()
+    def update_grid(self, x: torch.Tensor, margin=0.01):
+        assert x.dim() == 2 and x.size(1) == self.in_features
+
+        splines = self.b_splines(x)  # (batch, in, coeff)
+        splines = splines.permute(1, 0, 2)  # (in, batch, coeff)
+        orig_coeff = self.scaled_spline_weight  # (out, in, coeff)
+        orig_coeff = orig_coeff.permute(1, 2, 0)  # (in, coeff, out)
+        unreduced_spline_output = torch.bmm(splines, orig_coeff)  # (in, batch, out)
+        unreduced_spline_output = unreduced_spline_output.permute(
+            1, 0, 2
+        )  # (batch, in, out)
+
+        # sort each channel individually to collect data distribution
+        x_sorted = torch.sort(x, dim=0)[0]
+        grid = self._grid_from_sorted(x_sorted, margin)
+
+        self.grid.copy_(grid.T)
+        self.uniform_grid = grid_is_uniform(self.grid)
+        self.spline_weight.data.copy_(self.curve2coeff(x, unreduced_spline_output))
+
+    def _grid_from_sorted(self, x_sorted: torch.Tensor, margin):
+        """Blend of the quantile and the uniform grid of (batch, in_features) sorted inputs."""
+        batch = x_sorted.size(0)
+        grid_adaptive = x_sorted[
+            torch.linspace(
+                0, batch - 1, self.grid_size + 1, dtype=torch.int64, device=x_sorted.device
+            )
+        ]
+
+        uniform_step = (x_sorted[-1] - x_sorted[0] + 2 * margin) / self.grid_size
+        grid_uniform = (
+            torch.arange(
+                self.grid_size + 1, dtype=torch.float32, device=x_sorted.device
+            ).unsqueeze(1)
+            * uniform_step
+            + x_sorted[0]
+            - margin
+        )
+
+        grid = self.grid_eps * grid_uniform + (1 - self.grid_eps) * grid_adaptive
+        grid = torch.concatenate(
+            [
+                grid[:1]
+                - uniform_step
+                * torch.arange(self.spline_order, 0, -1, device=x_sorted.device).unsqueeze(1),
+                grid,
+                grid[-1:]
+                + uniform_step
+                * torch.arange(1, self.spline_order + 1, device=x_sorted.device).unsqueeze(1),
+            ],
+            dim=0,
+        )
+        return grid
+
+    @torch.no_grad()
+    def update_grid_from_sketch(self, sketch: GridSketch, margin=0.01, ridge=0., chunk_size=1024):
+        """
+        Streaming counterpart of ``update_grid``.
+
+        The adaptive grid comes from the quantiles of the sketch sample and the
+        exact extremes of everything observed. The spline weights are refit
+        on the sample by accumulating the normal equations chunk by chunk, so
+        neither the (batch, in, out) target nor the lstsq workspace is built
+        and memory does not grow with the number of observed tokens. With a
+        sketch that holds every token the result matches ``update_grid``.
+        """
+        x = sketch.sample().to(self.grid.device, self.grid.dtype)
+        if x.size(0) < 2:
+            return
+        x_sorted = torch.sort(x, dim=0)[0]
+        x_sorted[0] = sketch.min.to(x_sorted)
+        x_sorted[-1] = sketch.max.to(x_sorted)
+        grid = self._grid_from_sorted(x_sorted, margin).T.contiguous()
+
+        # the targets are the current splines on the sample, as in update_grid:
+        # A_new^T Y = (A_new^T A_old) C_old, so only (in, coeff, coeff) sums are kept
+        orig_coeff = self.scaled_spline_weight.permute(1, 2, 0).double()  # (in, coeff, out)
+        coeff = self.grid_size + self.spline_order
+        AtA = torch.zeros(self.in_features, coeff, coeff, dtype=torch.float64, device=x.device)
+        cross = torch.zeros_like(AtA)
+        for start in range(0, x.size(0), chunk_size):
+            chunk = x[start : start + chunk_size]
+            new_bases = self.b_splines(chunk, grid)  # (chunk, in, coeff)
+            old_bases = self.b_splines(chunk)
+            AtA += torch.einsum("bik,bil->ikl", new_bases, new_bases).double()
+            cross += torch.einsum("bik,bil->ikl", new_bases, old_bases).double()
+        solution = solve_normal_equations(AtA, torch.bmm(cross, orig_coeff), ridge)  # (in, coeff, out)
+
+        self.grid.copy_(grid)
+        self.uniform_grid = grid_is_uniform(self.grid)
+        self.spline_weight.data.copy_(solution.permute(2, 0, 1).to(self.spline_weight.dtype))
+
+    def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):
+        """
+        Compute the regularization loss.
+
+        This is a dumb simulation of the original L1 regularization as stated in the
+        paper, since the original one requires computing absolutes and entropy from the
+        expanded (batch, in_features, out_features) intermediate tensor, which is hidden
+        behind the F.linear function if we want an memory efficient implementation.
+
+        The L1 regularization is now computed as mean absolute value of the spline
+        weights. The authors implementation also includes this term in addition to the
+        sample-based regularization.
+        """
+        l1_fake = self.spline_weight.abs().mean(-1)
+        regularization_loss_activation = l1_fake.sum()
+        p = l1_fake / regularization_loss_activation
+        regularization_loss_entropy = -torch.sum(p * p.log())
+        return (
+            regularize_activation * regularization_loss_activation
+            + regularize_entropy * regularization_loss_entropy
+        )
+
+
+class KAN(torch.nn.Module):
+    def __init__(
+        self,
+        layers_hidden,
+        grid_size=5,
+        spline_order=3,
+        scale_noise=0.1,
+        scale_base=1.0,
+        scale_spline=1.0,
+        base_activation=torch.nn.SiLU,
+        grid_eps=0.02,
+        grid_range=[-1, 1],
+        solver=None,
+        backend=None,
+    ):
+        super(KAN, self).__init__()
+        self.grid_size = grid_size
+        self.spline_order = spline_order
+
+        self.layers = torch.nn.ModuleList()
+        for in_features, out_features in zip(layers_hidden, layers_hidden[1:]):
+            self.layers.append(
+                KANLinear(
+                    in_features,
+                    out_features,
+                    grid_size=grid_size,
+                    spline_order=spline_order,
+                    scale_noise=scale_noise,
+                    scale_base=scale_base,
+                    scale_spline=scale_spline,
+                    base_activation=base_activation,
+                    grid_eps=grid_eps,
+                    grid_range=grid_range,
+                    solver=solver,
+                    backend=backend,
+                )
+            )
+
+    def forward(self, x: torch.Tensor, update_grid=False):
+        for layer in self.layers:
+            if update_grid:
+                layer.update_grid(x)
+            x = layer(x)
+        return x
+
+    def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):
+        return sum(
+            layer.regularization_loss(regularize_activation, regularize_entropy)
+            for layer in self.layers
+        )
+
+
+class GridUpdate:
+    """
+    Scheduled grid updates for every KANLinear in a model.
+
+    This is the training-time form of ``KAN.forward(update_grid=True)``. Call
+    ``step()`` after every optimizer step. Every ``every`` steps (up to step
+    ``until``) the inputs of the next ``observe_steps`` training forwards
+    are collected into one GridSketch per layer. The grids are then refit with
+    ``update_grid_from_sketch``. Under DDP, rank 0's grids and weights are
+    broadcast so every replica stays identical.
+    """
+
+    def __init__(self, model, every=1000, until=None, observe_steps=10, sample_size=4096, margin=0.01, ridge=0.):
+        self.layers = [m for m in model.modules() if isinstance(m, KANLinear)]
+        self.every = every
+        self.until = until
+        self.observe_steps = observe_steps
+        self.sample_size = sample_size
+        self.margin = margin
+        self.ridge = ridge
+        self.step_count = 0
+        self.observed = 0
+        self.updates = 0
+        self.sketches = {}
+        self.handles = []
+
+    def _observe(self, layer, inputs):
+        if layer.training:
+            x = inputs[0]
+            if layer not in self.sketches:
+                self.sketches[layer] = GridSketch(layer.in_features, self.sample_size, device=x.device)
+            self.sketches[layer].update(x)
+
+    def start(self):
+        self.observed = 0
+        self.handles = [layer.register_forward_pre_hook(self._observe) for layer in self.layers]
+
+    def finish(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        for layer, sketch in self.sketches.items():
+            layer.update_grid_from_sketch(sketch, margin=self.margin, ridge=self.ridge)
+        self.sketches = {}
+        self.updates += 1
+
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            for layer in self.layers:
+                torch.distributed.broadcast(layer.grid, 0)
+                torch.distributed.broadcast(layer.spline_weight.data, 0)
+                layer.uniform_grid = grid_is_uniform(layer.grid)
+
+    def step(self):
+        self.step_count += 1
+        if self.handles:
+            self.observed += 1
+            if self.observed >= self.observe_steps:
+                self.finish()
+        elif (
+            self.every > 0
+            and self.step_count % self.every == 0
+            and (self.until is None or self.step_count <= self.until)
+        ):
+            self.start()
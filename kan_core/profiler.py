@@ -0,0 +1,131 @@
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PHASES = ['data', 'forward', 'backward', 'optimizer', 'metric']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, since it started (it cannot be reset)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def cpu_peak_memory(fn):
+    """Peak bytes allocated by torch on the CPU during one call of ``fn``."""
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as prof:
+        fn()
+    # every allocation and free is an instant '[memory]' event; replay them in order
+    events = sorted((e for e in prof.events() if e.name == '[memory]'),
+                    key=lambda e: e.time_range.start)
+    current = peak = 0
+    for e in events:
+        current += e.cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+class StepProfiler(object):
+    """Named wall-clock timers around the phases of a training step.
+
+    With ``enabled=False`` only steps, samples and peak memory are counted, so
+    it can stay in the loop at no cost. Peak memory is the allocator peak of
+    the epoch on CUDA and the peak RSS of the process so far on CPU (omitted
+    where ``resource`` is unavailable). When enabled, the device is
+    synchronized around every phase so that asynchronous CUDA work is charged
+    to the phase that launched it.
+
+    ``trace_steps > 0`` additionally records a ``torch.profiler`` trace of
+    that many steps (after ``trace_wait`` skipped and one warmup step) into
+    ``trace_dir``, readable by TensorBoard.
+    """
+
+    def __init__(self, device, enabled=False, trace_dir=None, trace_steps=0, trace_wait=5):
+        self.device = torch.device(device)
+        self.enabled = enabled
+        self.trace = None
+        if trace_steps > 0 and trace_dir is not None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.type == 'cuda':
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=trace_wait, warmup=1, active=trace_steps, repeat=1),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir),
+                record_shapes=True,
+                profile_memory=True)
+            self.trace.start()
+        self.reset()
+
+    def reset(self):
+        self.totals = OrderedDict((k, 0.) for k in PHASES)
+        self.steps = 0
+        self.samples = 0
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.start_time = time.perf_counter()
+
+    def synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.synchronize()
+        start = time.perf_counter()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            self.synchronize()
+            self.totals[name] = self.totals.get(name, 0.) + time.perf_counter() - start
+
+    def iterate(self, loader):
+        """Yield the batches of ``loader``, timing the wait as ``data``."""
+        iterator = iter(loader)
+        while True:
+            with self.phase('data'):
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+
+    def step(self, batch_size):
+        self.steps += 1
+        self.samples += batch_size
+        if self.trace is not None:
+            self.trace.step()
+
+    def summary(self):
+        """Per-step phase times in ms, samples/sec and peak memory in MB."""
+        elapsed = time.perf_counter() - self.start_time
+        stats = OrderedDict()
+        if self.enabled:
+            for name, total in self.totals.items():
+                stats['%s_ms' % name] = 1000 * total / max(self.steps, 1)
+        stats['samples_per_sec'] = self.samples / elapsed if elapsed > 0 else 0.
+        if self.device.type == 'cuda':
+            stats['peak_mem_mb'] = torch.cuda.max_memory_allocated(self.device) / 1024 ** 2
+        elif resource is not None:
+            stats['peak_mem_mb'] = peak_rss_mb()
+        return stats
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.stop()
+            self.trace = None
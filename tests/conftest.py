@@ -0,0 +1,9 @@
+"""Put the repository root and both project folders on ``sys.path``, as benchmarks/common.py does."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in [ROOT, os.path.join(ROOT, 'Seg_UKAN'), os.path.join(ROOT, 'Diffusion_UKAN')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,165 @@
+"""
+Two-process gloo smoke tests of the DDP paths of Seg_UKAN/train.py and
+Diffusion_UKAN/Diffusion/Train.py: disjoint data shards, all-reduced meters
+that agree over ranks, and parameters that stay identical after a step.
+"""
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data.distributed import DistributedSampler
+
+WORLD_SIZE = 2
+NUM_IMAGES = 11
+
+
+def init_gloo(rank, world_size, init_file):
+    torch.set_num_threads(1)
+    dist.init_process_group('gloo', init_method='file://' + init_file, rank=rank, world_size=world_size)
+
+
+def gather(obj):
+    out = [None] * dist.get_world_size()
+    dist.all_gather_object(out, obj)
+    return out
+
+
+def flat_params(model):
+    return torch.cat([p.detach().flatten() for p in model.parameters()])
+
+
+def assert_disjoint(shards, num_images, per_rank=None):
+    """Shards of range(num_images) that do not overlap, with ``per_rank`` samples each or covering all of it."""
+    indices = [i for shard in shards for i in shard]
+    assert len(indices) == len(set(indices)), 'shards overlap: %s' % shards
+    assert set(indices) <= set(range(num_images))
+    if per_rank is None:
+        assert sorted(indices) == list(range(num_images))
+    else:
+        assert all(len(shard) == per_rank for shard in shards), 'shard sizes %s' % [len(s) for s in shards]
+
+
+def run(worker, tmp_path):
+    mp.spawn(worker, args=(WORLD_SIZE, str(tmp_path / 'dist_init')), nprocs=WORLD_SIZE, join=True)
+
+
+def seg_worker(rank, world_size, init_file):
+    init_gloo(rank, world_size, init_file)
+    try:
+        import archs
+        import losses
+        import train
+        from kan_core.dist_utils import ShardSampler
+        from kan import kan_init
+
+        img_size = 32
+        # the same dataset on every rank, sharded by the samplers
+        generator = torch.Generator().manual_seed(100)
+        images = torch.randn(NUM_IMAGES, 3, img_size, img_size, generator=generator)
+        masks = (torch.rand(NUM_IMAGES, 1, img_size, img_size, generator=generator) > 0.5).float()
+        dataset = TensorDataset(images, masks, torch.arange(NUM_IMAGES))
+
+        # as in train.main: shuffled, drop_last training shards and non-padded validation shards
+        train_sampler = DistributedSampler(dataset, shuffle=True, drop_last=True)
+        train_sampler.set_epoch(1)
+        train_shards = gather(list(train_sampler))
+        val_shards = gather(list(ShardSampler(dataset)))
+        # drop_last: every rank gets the same number of samples
+        assert_disjoint(train_shards, NUM_IMAGES, per_rank=NUM_IMAGES // world_size)
+        assert_disjoint(val_shards, NUM_IMAGES)
+
+        # seed_torch makes the initial weights identical on every rank
+        torch.manual_seed(0)
+        with kan_init('analytic'):
+            model = archs.UKAN(1, 3, False, img_size=img_size, embed_dims=[32, 40, 64])
+        initial = flat_params(model)
+        criterion = losses.BCEDiceLoss()
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+        ddp_model = DDP(model)
+
+        input, target, _ = next(iter(DataLoader(dataset, batch_size=2, sampler=train_sampler)))
+        loss = criterion(ddp_model(input), target)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        params = gather(flat_params(model))
+        assert not torch.equal(params[rank], initial)
+        assert all(torch.equal(p, params[0]) for p in params)
+
+        val_loader = DataLoader(dataset, batch_size=1, sampler=ShardSampler(dataset))
+        scores = gather(dict(train.validate({'deep_supervision': False}, val_loader, model, criterion, 'cpu')))
+        assert all(s == scores[0] for s in scores)
+        # the reduced meters are the averages over the whole validation set
+        model.eval()
+        with torch.no_grad():
+            expected = sum(criterion(model(images[i:i + 1]), masks[i:i + 1]).item() for i in range(NUM_IMAGES))
+        assert scores[0]['loss'] == pytest.approx(expected / NUM_IMAGES, rel=1e-5)
+    finally:
+        dist.destroy_process_group()
+
+
+def diffusion_worker(rank, world_size, init_file):
+    init_gloo(rank, world_size, init_file)
+    try:
+        from Diffusion import GaussianDiffusionTrainer
+        from Diffusion.Data import DeviceLoader
+        from Diffusion.Train import model_dict
+        from Diffusion.kan_utils.kan import kan_init
+
+        img_size = 32
+        # --data_format png/packed: DistributedSampler as in build_dataloader
+        sampler = DistributedSampler(TensorDataset(torch.arange(NUM_IMAGES)), shuffle=True, drop_last=True, seed=0)
+        sampler.set_epoch(1)
+        assert_disjoint(gather(list(sampler)), NUM_IMAGES, per_rank=NUM_IMAGES // world_size)
+
+        # --data_format device: every image holds its index, which survives the flips
+        labelled = torch.arange(NUM_IMAGES, dtype=torch.uint8).view(-1, 1, 1, 1).expand(-1, 3, 4, 4).contiguous()
+        batch_size = 2
+        loader = DeviceLoader(labelled, batch_size, rank=rank, world_size=world_size, seed=0)
+        loader.set_epoch(1)
+        seen = [int(i) for x_0, _ in loader for i in ((x_0[:, 0, 0, 0] * 0.5 + 0.5) * 255).round()]
+        # incomplete batches are dropped as well
+        assert_disjoint(gather(seen), NUM_IMAGES, per_rank=NUM_IMAGES // world_size // batch_size * batch_size)
+
+        torch.manual_seed(0)
+        with kan_init('analytic'):
+            net_model = model_dict['UKan_Hybrid'](T=1000, ch=32, ch_mult=[1, 2, 3, 4], attn=[2],
+                                                  num_res_blocks=2, dropout=0., img_size=img_size)
+        initial = flat_params(net_model)
+        trainer = GaussianDiffusionTrainer(net_model, 1e-4, 0.02, 1000)
+        # as in Train.train: independent timesteps and noise per rank
+        trainer.generator = torch.Generator().manual_seed(rank)
+        trainer = DDP(trainer, bucket_cap_mb=25, gradient_as_bucket_view=True)
+        optimizer = torch.optim.AdamW(net_model.parameters(), lr=1e-4, weight_decay=1e-4)
+
+        images = torch.randint(0, 256, (NUM_IMAGES, 3, img_size, img_size), dtype=torch.uint8,
+                               generator=torch.Generator().manual_seed(100))
+        loader = DeviceLoader(images, batch_size, rank=rank, world_size=world_size, seed=0)
+        x_0, _ = next(iter(loader))
+        loss = trainer(x_0).sum() / 1000.
+        optimizer.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(net_model.parameters(), 1.)
+        optimizer.step()
+        params = gather(flat_params(net_model))
+        assert not torch.equal(params[rank], initial)
+        assert all(torch.equal(p, params[0]) for p in params)
+        # different data and noise per rank
+        losses = gather(loss.item())
+        assert losses[0] != losses[1]
+    finally:
+        dist.destroy_process_group()
+
+
+def test_seg_ddp(tmp_path):
+    for module in ['albumentations', 'sklearn', 'pandas', 'tensorboardX', 'medpy', 'yaml', 'matplotlib', 'seaborn']:
+        pytest.importorskip(module)
+    run(seg_worker, tmp_path)
+
+
+def test_diffusion_ddp(tmp_path):
+    for module in ['torchvision', 'skimage']:
+        pytest.importorskip(module)
+    run(diffusion_worker, tmp_path)
@@ -0,0 +1,52 @@
+"""The streaming grid update against ``KANLinear.update_grid`` when the sketch keeps every token."""
+import torch
+
+from kan_core import GridSketch, GridUpdate, KANLinear
+
+IN_FEATURES, OUT_FEATURES, TOKENS = 6, 5, 200
+
+
+def make_layer():
+    torch.manual_seed(0)
+    return KANLinear(IN_FEATURES, OUT_FEATURES, grid_size=5, spline_order=3, init='analytic')
+
+
+def make_batches():
+    torch.manual_seed(1)
+    # skewed inputs, so the adaptive grid moves away from the uniform one
+    return [torch.randn(TOKENS // 4, IN_FEATURES).exp() - 1 for _ in range(4)]
+
+
+def assert_same_layer(layer, expected):
+    torch.testing.assert_close(layer.grid, expected.grid)
+    x = torch.cat(make_batches())
+    with torch.no_grad():
+        torch.testing.assert_close(layer(x), expected(x), rtol=1e-4, atol=1e-5)
+
+
+def test_sketch_matches_update_grid():
+    batches = make_batches()
+    expected = make_layer()
+    expected.update_grid(torch.cat(batches))
+
+    layer = make_layer()
+    sketch = GridSketch(IN_FEATURES, size=TOKENS)
+    for x in batches:
+        sketch.update(x)
+    layer.update_grid_from_sketch(sketch, chunk_size=64)
+    assert_same_layer(layer, expected)
+
+
+def test_grid_update_matches_update_grid():
+    batches = make_batches()
+    expected = make_layer()
+    expected.update_grid(torch.cat(batches))
+
+    layer = make_layer()
+    updater = GridUpdate(layer, every=1, observe_steps=len(batches), sample_size=TOKENS)
+    updater.step()  # starts observing
+    for x in batches:
+        layer(x)
+        updater.step()
+    assert updater.updates == 1
+    assert_same_layer(layer, expected)
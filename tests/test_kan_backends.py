@@ -0,0 +1,111 @@
+"""The kan_core forward backends against the reference, and loading of pre-kan_core checkpoints."""
+import pytest
+import torch
+import torch.nn.functional as F
+
+from kan_core import BACKENDS, KAN, KANLinear, set_backend
+
+IN_FEATURES, OUT_FEATURES, TOKENS = 12, 7, 64
+GRID_SIZE, SPLINE_ORDER = 5, 3
+
+
+def make_layer(backend='reference'):
+    torch.manual_seed(0)
+    return KANLinear(IN_FEATURES, OUT_FEATURES, grid_size=GRID_SIZE, spline_order=SPLINE_ORDER,
+                     init='analytic', backend=backend)
+
+
+def make_input(requires_grad=False):
+    torch.manual_seed(1)
+    # partly outside grid_range, where only the outer bases are non-zero
+    x = torch.rand(TOKENS, IN_FEATURES) * 3 - 1.5
+    return x.requires_grad_(requires_grad)
+
+
+def baseline_b_splines(grid, x, spline_order):
+    """b_splines of the KANLinear in Seg_UKAN/kan.py before kan_core."""
+    x = x.unsqueeze(-1)
+    bases = ((x >= grid[:, :-1]) & (x < grid[:, 1:])).to(x.dtype)
+    for k in range(1, spline_order + 1):
+        bases = (
+            (x - grid[:, : -(k + 1)]) / (grid[:, k:-1] - grid[:, : -(k + 1)]) * bases[:, :, :-1]
+        ) + (
+            (grid[:, k + 1:] - x) / (grid[:, k + 1:] - grid[:, 1:(-k)]) * bases[:, :, 1:]
+        )
+    return bases
+
+
+def baseline_forward(state, x):
+    """forward of the KANLinear in Seg_UKAN/kan.py before kan_core, from its state_dict."""
+    spline_weight = state['spline_weight'] * state['spline_scaler'].unsqueeze(-1)
+    base_output = F.linear(F.silu(x), state['base_weight'])
+    bases = baseline_b_splines(state['grid'], x, SPLINE_ORDER)
+    return base_output + F.linear(bases.view(x.size(0), -1), spline_weight.view(OUT_FEATURES, -1))
+
+
+@pytest.mark.parametrize('backend', [b for b in BACKENDS if b != 'reference'])
+def test_forward_matches_reference(backend):
+    x = make_input()
+    with torch.no_grad():
+        expected = make_layer('reference')(x)
+        output = make_layer(backend)(x)
+    torch.testing.assert_close(output, expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('backend', [b for b in BACKENDS if b != 'reference'])
+def test_backward_matches_reference(backend):
+    grads = {}
+    for name in ['reference', backend]:
+        layer = make_layer(name)
+        x = make_input(requires_grad=True)
+        (layer(x) ** 2).sum().backward()
+        grads[name] = [x.grad] + [p.grad for p in layer.parameters()]
+    for grad, expected in zip(grads[backend], grads['reference']):
+        torch.testing.assert_close(grad, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_sparse_is_inference_only():
+    # with autograd enabled the sparse backend runs the reference itself
+    layer = make_layer('sparse')
+    x = make_input(requires_grad=True)
+    output = layer(x)
+    assert output.grad_fn is not None
+    layer.backend = 'reference'
+    assert torch.equal(output, layer(x))
+
+
+@pytest.mark.parametrize('backend', ['uniform', 'sparse'])
+def test_non_uniform_grid_falls_back(backend):
+    layer = make_layer()
+    layer.update_grid(make_input() * 0.5)
+    assert not layer.uniform_grid
+    x = make_input()
+    with torch.no_grad():
+        expected = layer(x)
+        layer.backend = backend
+        torch.testing.assert_close(layer(x), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_set_backend():
+    model = KAN([IN_FEATURES, 16, OUT_FEATURES])
+    set_backend(model, 'fused')
+    assert all(layer.backend == 'fused' for layer in model.layers)
+
+
+def test_baseline_state_dict_loads_strictly():
+    torch.manual_seed(2)
+    h = 2. / GRID_SIZE
+    grid = (torch.arange(-SPLINE_ORDER, GRID_SIZE + SPLINE_ORDER + 1) * h - 1).expand(IN_FEATURES, -1).contiguous()
+    state = {
+        'grid': grid,
+        'base_weight': torch.randn(OUT_FEATURES, IN_FEATURES),
+        'spline_weight': torch.randn(OUT_FEATURES, IN_FEATURES, GRID_SIZE + SPLINE_ORDER),
+        'spline_scaler': torch.randn(OUT_FEATURES, IN_FEATURES),
+    }
+    x = make_input()
+    for backend in BACKENDS:
+        layer = make_layer(backend)
+        layer.load_state_dict(state, strict=True)
+        assert layer.uniform_grid
+        with torch.no_grad():
+            torch.testing.assert_close(layer(x), baseline_forward(state, x), rtol=1e-4, atol=1e-5)
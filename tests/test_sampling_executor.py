@@ -0,0 +1,38 @@
+"""SamplingExecutor in eager mode reproduces GaussianDiffusionSampler bit for bit."""
+import pytest
+import torch
+
+for module in ['torchvision', 'skimage']:
+    pytest.importorskip(module)
+
+from Diffusion.Diffusion import GaussianDiffusionSampler  # noqa: E402
+from Diffusion.Executor import SamplingExecutor  # noqa: E402
+from Diffusion.Schedules import PARAMETERIZATIONS, SCHEDULES  # noqa: E402
+from Diffusion.Train import model_dict  # noqa: E402
+from Diffusion.kan_utils.kan import kan_init  # noqa: E402
+
+T, IMG_SIZE, BATCH_SIZE = 5, 32, 2
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    with kan_init('analytic'):
+        net_model = model_dict['UKan_Hybrid'](T=1000, ch=32, ch_mult=[1, 2, 3, 4], attn=[2],
+                                              num_res_blocks=1, dropout=0., img_size=IMG_SIZE)
+    return net_model.eval()
+
+
+def sample(sampler, seed=0):
+    torch.manual_seed(seed)
+    x_T = torch.randn(BATCH_SIZE, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        return sampler(x_T)
+
+
+@pytest.mark.parametrize('parameterization', PARAMETERIZATIONS)
+@pytest.mark.parametrize('schedule', SCHEDULES)
+def test_eager_matches_sampler(model, schedule, parameterization):
+    reference = GaussianDiffusionSampler(model, 1e-4, 0.02, T, schedule=schedule, parameterization=parameterization)
+    executor = SamplingExecutor(reference, mode='eager', progress=False)
+    assert torch.equal(sample(executor), sample(reference))